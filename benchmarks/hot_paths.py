@@ -0,0 +1,222 @@
+"""
+Machine Learning Pipeline Hot Path Benchmark
+
+Times the pipeline_lib hot paths on datasets of several sizes, built by replicating the kiwifruit datasets.
+
+Usage:
+    python benchmarks/hot_paths.py --output hot_paths.json
+    python benchmarks/hot_paths.py --baseline hot_paths.json --threshold 1.2
+"""
+
+##########################################################################################################
+### Imports
+##########################################################################################################
+
+# External
+import argparse
+import glob
+import json
+import os, sys
+import pandas as pd
+import platform
+import statistics
+import tempfile
+import time
+import traceback
+
+from typing import Callable
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+# Internal
+from pipeline_lib.config import Config, get_config
+from pipeline_lib.data import Data, join_path
+
+##########################################################################################################
+### Constants
+##########################################################################################################
+
+KIWI_DATA_DIR = join_path(BASE_DIR, "pipelines/kiwi_datasets/data")
+# The configuration is loaded relative to a pipeline directory
+PIPELINE_DIR = join_path(BASE_DIR, "pipelines/kiwi_datasets")
+TARGET_VAR = "gt_weight"
+DF_QUERY = "maMAratio > 0.7"
+INCLUDE_ESTIMATORS = ["lr", "ridge", "dt"]
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Benchmarks faster than this, in seconds, are too noisy to report as regressions
+NOISE_FLOOR = 0.01
+
+##########################################################################################################
+### Data
+##########################################################################################################
+
+def get_kiwi_data() -> pd.DataFrame:
+    """Combine the individual kiwifruit datasets, excluding the combined and extended copies."""
+    files = [ f for f in sorted(glob.glob(join_path(KIWI_DATA_DIR, "*.csv")))
+        if not f.endswith("_extended.csv") and "_combined" not in f ]
+    return pd.concat([ pd.read_csv(f) for f in files ], join = "inner", ignore_index = True)
+
+def replicate(df: pd.DataFrame, size: int) -> pd.DataFrame:
+    """Replicate a dataframe until it has the requested number of rows."""
+    copies = -(-size // len(df))
+    return pd.concat([df] * copies, ignore_index = True).iloc[:size].reset_index(drop = True)
+
+def get_benchmark_config(file_path: str) -> Config:
+    config = get_config(BASE_DIR)
+    config.set("base_dir", BASE_DIR, False)
+    config.set("file_path", file_path)
+    config.set("target", TARGET_VAR)
+    config.set("df_query", DF_QUERY)
+    config.set("use_mlflow", False)
+    config.set("use_gpu", False)
+    config.set("fold", 3)
+    return config
+
+def get_grid_config(n_models: int = 20, n_params: int = 10) -> dict:
+    """Get a synthetic custom grid configuration."""
+    grid_config = {}
+    for i in range(n_models):
+        params = {}
+        for j in range(n_params):
+            if j % 2 == 0:
+                params[f"param_{j}"] = { "value": list(range(10)) }
+            else:
+                params[f"param_{j}"] = { "value": [0.1, 1.0], "distribution": "uniform", "kwargs": { "loc": 0, "scale": 1 } }
+        grid_config[f"model_{i}"] = params
+    return grid_config
+
+##########################################################################################################
+### Benchmark
+##########################################################################################################
+
+def time_case(func: Callable, repeat: int) -> dict:
+    """Time a benchmark case, returning summary statistics in seconds."""
+    timings = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    except Exception as e:
+        traceback.print_exc()
+        return { "min": None, "median": None, "mean": None, "runs": len(timings), "error": f"{type(e).__name__}: {e}" }
+
+    return { "min": min(timings), "median": statistics.median(timings), "mean": statistics.mean(timings),
+        "runs": len(timings), "error": None }
+
+def run_size(size: int, df: pd.DataFrame, tmp_dir: str, repeat: int, results: dict) -> None:
+    """Run the dataset-dependent benchmark cases for a single dataset size."""
+    file_path = join_path(tmp_dir, f"kiwi_{size}.csv")
+    replicate(df, size).to_csv(file_path, index = False)
+    config = get_benchmark_config(file_path)
+    data = Data()
+
+    results[f"Data.read_csv@{size}"] = time_case(lambda: data.read_csv(file_path), repeat)
+    sample = data.read_csv(file_path)
+    results[f"Data.query@{size}"] = time_case(lambda: data.query(config, sample), repeat)
+    results[f"Data.load@{size}"] = time_case(lambda: data.load(file_path, config), repeat)
+    results[f"Data.train_test_split@{size}"] = time_case(
+        lambda: data.train_test_split(sample, config.get("training_frac"), config.get("random_seed")), repeat)
+
+    # The PyCaret cases share a single setup session
+    pycaret_cases = [f"estimator.setup@{size}", f"compare_models@{size}", f"predict_model@{size}"]
+    try:
+        from pipeline_lib.estimator import PyCaretRegressor, setup
+        estimator = PyCaretRegressor()
+        estimator.pycaret # Exclude the PyCaret import time from the first run
+    except ImportError as e:
+        for name in pycaret_cases:
+            results[name] = { "min": None, "median": None, "mean": None, "runs": 0, "error": f"{type(e).__name__}: {e}" }
+        return
+
+    train_df, test_df = data.train_test_split(sample, config.get("training_frac"), config.get("random_seed"))
+    results[pycaret_cases[0]] = time_case(lambda: setup(estimator, config, train_df, "benchmark"), repeat)
+
+    models = []
+    def compare_models():
+        models[:] = [ estimator.compare_models(include = INCLUDE_ESTIMATORS, n_select = 1, verbose = False) ]
+    results[pycaret_cases[1]] = time_case(compare_models, repeat)
+
+    if len(models) > 0:
+        results[pycaret_cases[2]] = time_case(lambda: estimator.predict_model(models[0], data = test_df), repeat)
+
+def run_benchmarks(sizes: list, repeat: int) -> dict:
+    """Run all benchmark cases."""
+    results = {}
+    results["get_config"] = time_case(lambda: get_config(BASE_DIR), repeat)
+
+    from pipeline_lib.tuning import GridTransformer
+    grid_config = get_grid_config()
+    for search_algorithm, search_library in [("grid", "scikit-learn"), ("random", "scikit-learn")]:
+        grid_transformer = GridTransformer(search_algorithm, search_library)
+        results[f"GridTransformer.transform:{search_algorithm}"] = time_case(
+            lambda: grid_transformer.transform(grid_config), repeat)
+
+    df = get_kiwi_data()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            run_size(size, df, tmp_dir, repeat, results)
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Print the fastest time of each benchmark relative to a baseline.
+
+    Returns
+    ---------
+    regressions: list
+        The names of benchmarks that are slower than the baseline by more than the threshold ratio.
+    """
+    regressions = []
+    print(f"{'benchmark':50} {'baseline':>10} {'current':>10} {'ratio':>8}")
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("min")
+        after = result.get("min")
+        if before is None or after is None:
+            before = "-" if before is None else f"{before:.4f}"
+            after = "failed" if after is None else f"{after:.4f}"
+            print(f"{name:50} {before:>10} {after:>10} {'-':>8}")
+            continue
+
+        ratio = after / before if before > 0 else float("inf")
+        flag = ""
+        if ratio > threshold and max(before, after) > NOISE_FLOOR:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(f"{name:50} {before:10.4f} {after:10.4f} {ratio:7.2f}x{flag}")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Benchmark the pipeline_lib hot paths on the kiwifruit datasets.")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = DEFAULT_SIZES,
+        help = f"The dataset sizes in rows. Defaults to '{' '.join(str(size) for size in DEFAULT_SIZES)}'.")
+    parser.add_argument("--repeat", type = int, default = 3, help = "The number of runs per benchmark. Defaults to '3'.")
+    parser.add_argument("--output", default = None, help = "An optional JSON file to write the results to.")
+    parser.add_argument("--baseline", default = None, help = "An optional JSON file of baseline results to compare against.")
+    parser.add_argument("--threshold", type = float, default = 1.2,
+        help = "The slowdown ratio that is reported as a regression. Defaults to '1.2'.")
+    args = parser.parse_args()
+    baseline = os.path.abspath(args.baseline) if args.baseline is not None else None
+    output = os.path.abspath(args.output) if args.output is not None else None
+    os.chdir(PIPELINE_DIR)
+
+    results = {
+        "meta": { "python": platform.python_version(), "platform": platform.platform(), "sizes": args.sizes,
+            "repeat": args.repeat, "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()) },
+        "results": run_benchmarks(args.sizes, args.repeat)
+    }
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results["results"], json.load(f)["results"], args.threshold)
+        if len(regressions) > 0:
+            sys.exit(1)
+    else:
+        print(json.dumps(results, indent = 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Machine Learning Pipeline Import Time Benchmark
+
+Measures the import time of each pipeline entry point and pipeline_lib module within fresh interpreters.
+
+Usage:
+    python benchmarks/import_time.py --output import_time.json
+    python benchmarks/import_time.py --baseline import_time.json
+"""
+
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+import argparse
+import glob
+import json
+import os, sys
+import subprocess
+import time
+
+##########################################################################################################
+### Constants  
+##########################################################################################################
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MODULES = ["pipeline_lib.config", "pipeline_lib.data", "pipeline_lib.custom_estimators", "pipeline_lib.estimator", 
+    "pipeline_lib.pipelines"]
+# The import section of each entry point ends at the first banner after the imports banner
+SECTION_BANNER = "#" * 106 + "\n### "
+
+##########################################################################################################
+### Benchmark  
+##########################################################################################################
+
+def get_import_section(path: str) -> str:
+    """Extract the import section of an entry point script."""
+    with open(path) as f:
+        source = f.read()
+    sections = source.split(SECTION_BANNER)
+    return SECTION_BANNER.join(sections[:2]) if len(sections) > 2 else source
+
+def time_code(code: str, cwd: str, repeat: int) -> dict:
+    """Time the execution of some code within fresh interpreters, returning the fastest run."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", code], cwd = cwd, capture_output = True, text = True)
+        timings.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            return { "seconds": None, "error": process.stderr.strip().splitlines()[-1] }
+    return { "seconds": min(timings), "error": None }
+
+def run_benchmarks(repeat: int) -> dict:
+    """Time the interpreter start up, each pipeline_lib module, and each pipeline entry point."""
+    results = {}
+    interpreter = time_code("pass", BASE_DIR, repeat)["seconds"]
+    results["interpreter"] = { "seconds": interpreter, "error": None }
+
+    for module in MODULES:
+        results[f"module:{module}"] = time_code(f"import {module}", BASE_DIR, repeat)
+
+    for path in sorted(glob.glob(os.path.join(BASE_DIR, "pipelines", "*", "src", "*.py"))):
+        pipeline_dir = os.path.dirname(os.path.dirname(path))
+        name = os.path.relpath(path, os.path.join(BASE_DIR, "pipelines"))
+        results[f"entry_point:{name}"] = time_code(get_import_section(path), pipeline_dir, repeat)
+
+    # Report import time net of interpreter start up
+    for result in results.values():
+        if result["seconds"] is not None:
+            result["import_seconds"] = max(result["seconds"] - interpreter, 0)
+    return results
+
+def compare(results: dict, baseline: dict) -> None:
+    """Print the import time of each benchmark relative to a baseline."""
+    print(f"{'benchmark':60} {'baseline':>10} {'current':>10} {'speedup':>8}")
+    for name, result in results.items():
+        if name == "interpreter":
+            continue
+        before = baseline.get(name, {}).get("import_seconds")
+        after = result.get("import_seconds")
+        if before is None or after is None:
+            before = "failed" if before is None else f"{before:.3f}"
+            after = "failed" if after is None else f"{after:.3f}"
+            print(f"{name:60} {before:>10} {after:>10} {'-':>8}")
+            continue
+        speedup = before / after if after > 0 else float("inf")
+        print(f"{name:60} {before:10.3f} {after:10.3f} {speedup:7.1f}x")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Measure the import time of pipeline entry points.")
+    parser.add_argument("--repeat", type = int, default = 3, help = "The number of runs per benchmark. Defaults to '3'.")
+    parser.add_argument("--output", default = None, help = "An optional JSON file to write the results to.")
+    parser.add_argument("--baseline", default = None, help = "An optional JSON file of baseline results to compare against.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    else:
+        print(json.dumps(results, indent = 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Machine Learning Pipeline Batch
+
+A library for running several pipeline scenarios within warm processes in the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+import argparse
+import glob
+import os, sys
+import runpy
+import time
+import traceback
+
+from dataclasses import dataclass
+from typing import List
+
+# Internal
+from pipeline_lib.config import add_argument
+from pipeline_lib.data import join_path, share_frames
+from pipeline_lib.distributed import get_n_workers, parallel_map, stop_executor
+
+##########################################################################################################
+### Library  
+##########################################################################################################
+
+# Modules imported once by each warm process. The estimators import PyCaret lazily, so its task modules are listed explicitly
+WARM_MODULES = ["pipeline_lib.estimator", "pipeline_lib.pipelines", "pycaret.regression", "pycaret.classification", "mlflow"]
+
+@dataclass
+class BatchResult:
+    """The result of a single pipeline run."""
+    pipeline: str
+    scenario: str
+    elapsed: float
+    error: str = None
+
+def _init_worker() -> None:
+    """Import shared modules, and enable dataframe sharing, within a warm process."""
+    import importlib
+    for module in WARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    share_frames()
+
+def _abort_run() -> None:
+    """Release the state left behind by a failed pipeline run, so that it does not leak into the next run."""
+    cleanups = [stop_executor]
+    # The MLFlow run is only started if the pipeline library has been imported
+    if "pipeline_lib.pipelines" in sys.modules:
+        from pipeline_lib.pipelines import abort_mlflow
+        cleanups.append(abort_mlflow)
+
+    for cleanup in cleanups:
+        try:
+            cleanup()
+        except Exception:
+            traceback.print_exc()
+
+def run_pipeline(base_dir: str, pipeline: str, scenario: str) -> BatchResult:
+    """
+    Run the main() function of a pipeline for a scenario within the current process.
+
+    Parameters
+    --------------
+    base_dir: str
+        The base directory for the ML pipeline project.
+    pipeline: str
+        The pipeline name within the pipelines directory.
+    scenario: str
+        The scenario name within the scenarios directory.
+
+    Returns
+    ---------
+    result: BatchResult
+        The result of the run.
+    """
+    base_dir = os.path.abspath(base_dir)
+    pipeline_dir = join_path(join_path(base_dir, "pipelines"), pipeline)
+    current_dir = os.getcwd()
+    argv = sys.argv
+    start = time.perf_counter()
+    error = None
+
+    try:
+        os.chdir(pipeline_dir)
+        sys.argv = ["src/run.py", "--base_dir", base_dir, "--scenario", scenario]
+        runpy.run_path("src/run.py", run_name = "__main__")
+    except (Exception, SystemExit):
+        error = traceback.format_exc()
+        _abort_run()
+    finally:
+        sys.argv = argv
+        os.chdir(current_dir)
+
+    return BatchResult(pipeline, scenario, time.perf_counter() - start, error)
+
+def _run_task(task: tuple) -> BatchResult:
+    return run_pipeline(*task)
+
+def get_scenarios(base_dir: str, patterns: List[str]) -> List[str]:
+    """
+    Expand scenario names and glob patterns relative to the scenarios directory.
+
+    Parameters
+    --------------
+    base_dir: str
+        The base directory for the ML pipeline project.
+    patterns: List[str]
+        Scenario names or glob patterns, without the .yaml extension.
+
+    Returns
+    ---------
+    scenarios: List[str]
+        The scenario names.
+    """
+    scenario_dir = join_path(base_dir, "scenarios")
+    scenarios = []
+    for pattern in patterns:
+        files = sorted(glob.glob(join_path(scenario_dir, f"{pattern}.yaml")))
+        if len(files) == 0:
+            scenarios.append(pattern)
+        for file in files:
+            scenarios.append(os.path.relpath(file, scenario_dir)[:-len(".yaml")])
+    return scenarios
+
+def run_scenarios(base_dir: str, pipelines: List[str], scenarios: List[str], n_workers: int = 1) -> List[BatchResult]:
+    """
+    Run several pipelines for several scenarios using warm processes.
+
+    Each process imports the pipeline dependencies once, and shares loaded dataframes between the scenarios that it runs.
+
+    Parameters
+    --------------
+    base_dir: str
+        The base directory for the ML pipeline project.
+    pipelines: List[str]
+        The pipeline names.
+    scenarios: List[str]
+        The scenario names or glob patterns.
+    n_workers: int
+        The number of warm worker processes. Runs are performed within the current process by default, and -1 uses
+        all available cores.
+
+    Returns
+    ---------
+    results: List[BatchResult]
+        The result of each run, ordered by scenario and then by pipeline.
+    """
+    tasks = [ 
+        (base_dir, pipeline, scenario) 
+        for scenario in get_scenarios(base_dir, scenarios) 
+        for pipeline in pipelines 
+    ]
+
+    if get_n_workers(n_workers) <= 1 or len(tasks) <= 1:
+        _init_worker()
+        return [ _run_task(task) for task in tasks ]
+    return parallel_map(_run_task, tasks, n_workers, initializer = _init_worker)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description = 'Run several pipelines for several scenarios using warm processes.'
+    )
+    parser.add_argument("--pipelines", nargs = "+", required = True, help = "The pipeline names.")
+    parser.add_argument("--scenarios", nargs = "+", required = True, 
+        help = "The scenario names or glob patterns (e.g. kiwifruit_regression/*).")
+    add_argument(parser, "--base_dir", ".", "The base project directory", str)
+    add_argument(parser, "--workers", 1, "The number of warm worker processes")
+    args = parser.parse_args()
+
+    results = run_scenarios(args.base_dir, args.pipelines, args.scenarios, args.workers)
+    for result in results:
+        status = "failed" if result.error else "completed"
+        print(f"{result.pipeline} {result.scenario}: {status} in {result.elapsed:.1f}s")
+        if result.error:
+            print(result.error)
+
+    if any(result.error for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Machine Learning Pipeline Cache
+
+A library for caching expensive pipeline results on disk within the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+import hashlib
+import os
+import pandas as pd
+
+from joblib import dump, hash as joblib_hash, load
+from typing import Any, Callable, Tuple
+
+# Internal
+from pipeline_lib.data import join_path
+
+##########################################################################################################
+### Library  
+##########################################################################################################
+
+def hash_dataframe(df: pd.DataFrame) -> str:
+    """
+    Get a content hash for a dataframe or series.
+
+    Parameters
+    --------------
+    df: DataFrame
+        The dataframe.
+
+    Returns
+    ---------
+    digest: str
+        The content hash.
+    """
+    if df is None:
+        return "none"
+
+    hasher = hashlib.sha1()
+    if isinstance(df, pd.DataFrame):
+        hasher.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode())
+    else:
+        hasher.update(repr((df.name, str(df.dtype))).encode())
+    hasher.update(pd.util.hash_pandas_object(df, index = True).values.tobytes())
+    return hasher.hexdigest()
+
+def hash_key(*args) -> str:
+    """Get a content hash for a collection of picklable objects."""
+    return joblib_hash(args)
+
+class ResultCache:
+    """
+    A size-bounded, content-addressed cache of pipeline results.
+
+    Entries are stored as joblib files named after their key. When the cache grows beyond max_size_mb,
+    the least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir: str, max_size_mb: float = None) -> None:
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def get_path(self, key: str) -> str:
+        return join_path(self.cache_dir, f"{key}.joblib")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Get a cached result.
+
+        Parameters
+        --------------
+        key: str
+            The cache key.
+
+        Returns
+        ---------
+        result: (bool, Any)
+            Whether the key was found, and the cached value.
+        """
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return False, None
+
+        try:
+            value = load(path)
+        except Exception:
+            # Treat unreadable entries as misses
+            os.remove(path)
+            return False, None
+
+        # Mark as recently used
+        os.utime(path)
+        return True, value
+
+    def get_file(self, key: str) -> str:
+        """Get the path of a cached file, or None if the key is not found."""
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        return path
+
+    def set(self, key: str, value: Any) -> str:
+        """Add a result to the cache, evicting old entries if required."""
+        return self.set_file(key, lambda path: dump(value, path))
+
+    def set_file(self, key: str, write: Callable[[str], Any]) -> str:
+        """Add a file to the cache using a function that writes to a given path, evicting old entries if required."""
+        path = self.get_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache is within its size limit."""
+        if self.max_size_mb is None:
+            return
+
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".joblib"):
+                continue
+            path = join_path(self.cache_dir, file_name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        max_size = self.max_size_mb * 1024 * 1024
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= max_size:
+                break
+            os.remove(path)
+            total_size -= size
@@ -9,91 +9,82 @@ A library of custom estimators for the machine learning pipeline.
 ##########################################################################################################
 
 # External
-from interpret.glassbox import ExplainableBoostingClassifier, ExplainableBoostingRegressor
-from pyod.models.copod import COPOD
-from pyod.models.lmdd import LMDD
-from pyod.models.loci import LOCI
-from pyod.models.loda import LODA
-from sklearn.cluster import MiniBatchKMeans
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.linear_model import GammaRegressor, SGDRegressor, TweedieRegressor
-from sklearn.mixture import GaussianMixture as GaussianMixtureBase, BayesianGaussianMixture as BayesianGaussianMixtureBase
+from collections.abc import Mapping
+from importlib import import_module
 
 ##########################################################################################################
 ### Library  
 ##########################################################################################################
 
+class LazyRegistry(Mapping):
+    """
+    A registry of estimator classes that are imported on first use.
+
+    Classes are declared as "module:ClassName" strings, so that importing the registry does not import 
+    the libraries that provide them.
+    """
+    def __init__(self, paths: dict) -> None:
+        self.paths = paths
+        self.classes = {}
+
+    def __getitem__(self, key: str) -> type:
+        if key not in self.classes:
+            module_name, class_name = self.paths[key].split(":")
+            self.classes[key] = getattr(import_module(module_name), class_name)
+        return self.classes[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
 ##########################################################################################################
 ### Regression  
 ##########################################################################################################
 
-CUSTOM_REGRESSORS = {
-    "ebm": ExplainableBoostingRegressor,
-    "gamma": GammaRegressor,
-    "gp": GaussianProcessRegressor,
-    "sgd": SGDRegressor,
-    "tweedie": TweedieRegressor
-}
+CUSTOM_REGRESSORS = LazyRegistry({
+    "ebm": "interpret.glassbox:ExplainableBoostingRegressor",
+    "gamma": "sklearn.linear_model:GammaRegressor",
+    "gp": "sklearn.gaussian_process:GaussianProcessRegressor",
+    "sgd": "sklearn.linear_model:SGDRegressor",
+    "tweedie": "sklearn.linear_model:TweedieRegressor"
+})
 
 ##########################################################################################################
 ### Classification  
 ##########################################################################################################
 
-CUSTOM_CLASSIFIERS = {
-    "ebm": ExplainableBoostingClassifier
-}
+CUSTOM_CLASSIFIERS = LazyRegistry({
+    "ebm": "interpret.glassbox:ExplainableBoostingClassifier"
+})
 
 ##########################################################################################################
 ### Anomaly Detection  
 ##########################################################################################################
 
-CUSTOM_ANOMALY_DETECTION = {
-    "copod": COPOD,
-    "lmdd": LMDD,
-    "loci": LOCI,
-    "loda": LODA,
-}
+CUSTOM_ANOMALY_DETECTION = LazyRegistry({
+    "copod": "pyod.models.copod:COPOD",
+    "lmdd": "pyod.models.lmdd:LMDD",
+    "loci": "pyod.models.loci:LOCI",
+    "loda": "pyod.models.loda:LODA",
+})
 
 ##########################################################################################################
 ### Clustering  
 ##########################################################################################################
 
-class GaussianMixture(GaussianMixtureBase):
-    def __init__(self, n_clusters = 4, *, covariance_type='full', tol=1e-3,
-                 reg_covar=1e-6, max_iter=100, n_init=1, init_params='kmeans',
-                 weights_init=None, means_init=None, precisions_init=None,
-                 random_state=None, warm_start=False,
-                 verbose=0, verbose_interval=10):
-        super().__init__(
-            n_components=n_clusters, tol=tol, reg_covar=reg_covar,
-            max_iter=max_iter, n_init=n_init, init_params=init_params,
-            random_state=random_state, warm_start=warm_start,
-            verbose=verbose, verbose_interval=verbose_interval)
-        self.n_clusters = n_clusters
-        
-    def fit(self, X, y=None):
-        super().fit(X, y)
-        self.labels_ = self.predict(X)
-
-class BayesianGaussianMixture(BayesianGaussianMixtureBase):
-    def __init__(self, n_clusters = 4, *, covariance_type='full', tol=1e-3,
-                 reg_covar=1e-6, max_iter=100, n_init=1, init_params='kmeans',
-                 weights_init=None, means_init=None, precisions_init=None,
-                 random_state=None, warm_start=False,
-                 verbose=0, verbose_interval=10):
-        super().__init__(
-            n_components=n_clusters, tol=tol, reg_covar=reg_covar,
-            max_iter=max_iter, n_init=n_init, init_params=init_params,
-            random_state=random_state, warm_start=warm_start,
-            verbose=verbose, verbose_interval=verbose_interval)
-        self.n_clusters = n_clusters
-        
-    def fit(self, X, y=None):
-        super().fit(X, y)
-        self.labels_ = self.predict(X)
-
-CUSTOM_CLUSTERING = {
-    "mbkmeans": MiniBatchKMeans,
-    "gmm": GaussianMixture,
-    "bgmm": BayesianGaussianMixture
-}
\ No newline at end of file
+CUSTOM_CLUSTERING = LazyRegistry({
+    "mbkmeans": "sklearn.cluster:MiniBatchKMeans",
+    "gmm": "pipeline_lib.custom_mixtures:GaussianMixture",
+    "bgmm": "pipeline_lib.custom_mixtures:BayesianGaussianMixture"
+})
+
+def __getattr__(name: str):
+    """Import the custom mixture models on first use."""
+    if name in ["GaussianMixture", "BayesianGaussianMixture"]:
+        return getattr(import_module("pipeline_lib.custom_mixtures"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+Machine Learning Pipeline Custom Mixtures
+
+A library of custom mixture models for clustering within the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+from sklearn.mixture import GaussianMixture as GaussianMixtureBase, BayesianGaussianMixture as BayesianGaussianMixtureBase
+
+##########################################################################################################
+### Library  
+##########################################################################################################
+
+class GaussianMixture(GaussianMixtureBase):
+    def __init__(self, n_clusters = 4, *, covariance_type='full', tol=1e-3,
+                 reg_covar=1e-6, max_iter=100, n_init=1, init_params='kmeans',
+                 weights_init=None, means_init=None, precisions_init=None,
+                 random_state=None, warm_start=False,
+                 verbose=0, verbose_interval=10):
+        super().__init__(
+            n_components=n_clusters, tol=tol, reg_covar=reg_covar,
+            max_iter=max_iter, n_init=n_init, init_params=init_params,
+            random_state=random_state, warm_start=warm_start,
+            verbose=verbose, verbose_interval=verbose_interval)
+        self.n_clusters = n_clusters
+        
+    def fit(self, X, y=None):
+        super().fit(X, y)
+        self.labels_ = self.predict(X)
+
+class BayesianGaussianMixture(BayesianGaussianMixtureBase):
+    def __init__(self, n_clusters = 4, *, covariance_type='full', tol=1e-3,
+                 reg_covar=1e-6, max_iter=100, n_init=1, init_params='kmeans',
+                 weights_init=None, means_init=None, precisions_init=None,
+                 random_state=None, warm_start=False,
+                 verbose=0, verbose_interval=10):
+        super().__init__(
+            n_components=n_clusters, tol=tol, reg_covar=reg_covar,
+            max_iter=max_iter, n_init=n_init, init_params=init_params,
+            random_state=random_state, warm_start=warm_start,
+            verbose=verbose, verbose_interval=verbose_interval)
+        self.n_clusters = n_clusters
+        
+    def fit(self, X, y=None):
+        super().fit(X, y)
+        self.labels_ = self.predict(X)
@@ -9,17 +9,275 @@ A library for data loading and manipulation within the machine learning pipeline
 ##########################################################################################################
 
 # External
+import ast
+import hashlib
+import numpy as np
+import operator
 import os
 import pandas as pd
+import re
 
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Tuple
+
+# Internal
+from pipeline_lib.monitoring import record
 
 ##########################################################################################################
 ### Library  
 ##########################################################################################################
 
+# File extensions for natively supported columnar formats
+PARQUET_EXTENSIONS = [".parquet", ".pq"]
+FEATHER_EXTENSIONS = [".feather", ".ftr", ".arrow"]
+
+# Dataframes shared between pipeline runs within the same process, in least recently used order. Disabled when None.
+_SHARED_FRAMES: OrderedDict = None
+_MAX_SHARED_FRAMES = 8
+
+# Comparison operators that can be checked against parquet row group statistics
+COMPARISON_OPERATORS = { 
+    ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt, ast.LtE: operator.le, ast.Eq: operator.eq, ast.In: None 
+}
+# The reversed operator, for comparisons with a constant on the left
+REVERSED_OPERATORS = { ast.Gt: ast.Lt(), ast.GtE: ast.LtE(), ast.Lt: ast.Gt(), ast.LtE: ast.GtE(), ast.Eq: ast.Eq() }
+# Query expression nodes that are evaluated independently for each row
+ROW_WISE_NODES = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Name, ast.Constant, ast.List, 
+    ast.Tuple, ast.expr_context, ast.boolop, ast.operator, ast.unaryop, ast.cmpop)
+
+def share_frames(enabled: bool = True, max_frames: int = 8) -> None:
+    """
+    Share loaded dataframes between pipeline runs within the current process.
+
+    When enabled, reading an unchanged file with the same arguments returns a copy of the previously loaded dataframe.
+
+    Parameters
+    --------------
+    enabled: bool
+        Whether to share dataframes. Disabling clears any shared dataframes.
+    max_frames: int
+        The maximum number of shared dataframes. The least recently used dataframe is removed beyond this.
+    """
+    global _SHARED_FRAMES, _MAX_SHARED_FRAMES
+    _SHARED_FRAMES = OrderedDict() if enabled else None
+    _MAX_SHARED_FRAMES = max_frames
+
+def _get_shared_frame(key: str, read: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """Get a copy of a shared dataframe, reading and sharing it if it is not already shared."""
+    if key in _SHARED_FRAMES:
+        _SHARED_FRAMES.move_to_end(key)
+    else:
+        _SHARED_FRAMES[key] = read()
+        while len(_SHARED_FRAMES) > max(_MAX_SHARED_FRAMES, 1):
+            _SHARED_FRAMES.popitem(last = False)
+    return _SHARED_FRAMES[key].copy()
+
 def join_path(p1: str, p2: str) -> str:
     return os.path.join(p1, p2)
 
+def get_file_key(name: str, **kwargs) -> str:
+    """
+    Get a cache key for a source file.
+
+    The key is derived from the absolute file path, modification time, file size, and any reader arguments.
+    A change to any of these will produce a different key.
+
+    Parameters
+    --------------
+    name: str
+        The file name.
+    **kwargs
+        Additional reader arguments.
+
+    Returns
+    ---------
+    key: str
+        The cache key.
+    """
+    stat = os.stat(name)
+    reader_args = repr(sorted(kwargs.items()))
+    source = f"{os.path.abspath(name)}|{stat.st_mtime_ns}|{stat.st_size}|{reader_args}"
+    return hashlib.sha1(source.encode()).hexdigest()
+
+def get_cache_file(name: str, cache_dir: str, **kwargs) -> str:
+    """
+    Get the columnar cache file for a source file.
+
+    Cache files are prefixed by a key of the source path and reader arguments, so that the entries of previous 
+    versions of the source file can be found and removed (see remove_stale_cache_files).
+
+    Parameters
+    --------------
+    name: str
+        The file name.
+    cache_dir: str
+        The cache directory.
+    **kwargs
+        Additional reader arguments.
+
+    Returns
+    ---------
+    cache_file: str
+        The cache file path.
+    """
+    reader_args = repr(sorted(kwargs.items()))
+    source_key = hashlib.sha1(f"{os.path.abspath(name)}|{reader_args}".encode()).hexdigest()[:16]
+    return join_path(cache_dir, f"{source_key}_{get_file_key(name, **kwargs)}.feather")
+
+def remove_stale_cache_files(cache_file: str) -> None:
+    """Remove the cache files of previous versions of the source file of a cache file."""
+    cache_dir, file_name = os.path.split(cache_file)
+    prefix = f"{file_name.split('_', 1)[0]}_"
+    for stale_file in os.listdir(cache_dir):
+        if stale_file.startswith(prefix) and stale_file.endswith(".feather") and stale_file != file_name:
+            try:
+                os.remove(join_path(cache_dir, stale_file))
+            except OSError:
+                # Removed by a concurrent pipeline run
+                continue
+
+def hash_file(name: str, block_size: int = 1 << 20) -> str:
+    """
+    Get a content hash for a file.
+
+    Unlike get_file_key, the hash is unaffected by the file location and modification time, 
+    so it remains stable when files are copied or checked out.
+
+    Parameters
+    --------------
+    name: str
+        The file name.
+    block_size: int
+        The number of bytes to read at a time.
+
+    Returns
+    ---------
+    digest: str
+        The content hash.
+    """
+    hasher = hashlib.sha1()
+    with open(name, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _parse_query(df_query: str) -> ast.Expression:
+    """Parse a dataframe query as a Python expression, replacing any backtick-quoted column names."""
+    names = []
+    def replace(match):
+        names.append(match.group(1))
+        return f"__column_{len(names) - 1}"
+    expression = ast.parse(re.sub(r"`([^`]*)`", replace, df_query), mode = "eval")
+    for node in ast.walk(expression):
+        if isinstance(node, ast.Name) and node.id.startswith("__column_"):
+            node.id = names[int(node.id[len("__column_"):])]
+    return expression
+
+def get_query_columns(df_query: str, columns: List[str]) -> List[str]:
+    """
+    Get the columns referenced by a dataframe query.
+
+    Parameters
+    --------------
+    df_query: str
+        The dataframe query.
+    columns: List[str]
+        The available columns.
+
+    Returns
+    ---------
+    query_columns: List[str]
+        The referenced columns, in their original order. None if the query cannot be parsed, 
+        such as when it references local variables.
+    """
+    try:
+        expression = _parse_query(df_query)
+    except SyntaxError:
+        return None
+    names = { node.id for node in ast.walk(expression) if isinstance(node, ast.Name) }
+    return [ column for column in columns if column in names ]
+
+def is_row_wise_query(df_query: str) -> bool:
+    """
+    Whether a dataframe query only compares values within each row, so that it may be applied to chunks of rows.
+
+    Queries containing function calls or attributes, such as "x > x.mean()", may depend on other rows.
+
+    Parameters
+    --------------
+    df_query: str
+        The dataframe query.
+
+    Returns
+    ---------
+    row_wise: bool
+        Whether the query is row-wise.
+    """
+    try:
+        expression = _parse_query(df_query)
+    except SyntaxError:
+        return False
+    return all(isinstance(node, ROW_WISE_NODES) for node in ast.walk(expression))
+
+def get_query_filters(df_query: str) -> List[Tuple[str, ast.cmpop, object]]:
+    """
+    Get the simple comparisons that every row matching a dataframe query must satisfy.
+
+    Only comparisons between a column and a constant within the top-level conjunction of the query are returned, 
+    such as "x > 0.5 and y in [1, 2]". Other conditions are ignored.
+
+    Parameters
+    --------------
+    df_query: str
+        The dataframe query.
+
+    Returns
+    ---------
+    filters: List[(str, cmpop, object)]
+        The column, comparison operator and constant of each comparison.
+    """
+    try:
+        expression = _parse_query(df_query)
+    except SyntaxError:
+        return []
+
+    conditions, filters = [expression.body], []
+    while len(conditions) > 0:
+        node = conditions.pop()
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            conditions.extend(node.values)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+            conditions.extend([node.left, node.right])
+        elif isinstance(node, ast.Compare):
+            operands = [node.left] + node.comparators
+            for left, op, right in zip(operands, node.ops, operands[1:]):
+                try:
+                    if isinstance(left, ast.Name) and type(op) in COMPARISON_OPERATORS:
+                        filters.append((left.id, op, ast.literal_eval(right)))
+                    elif isinstance(right, ast.Name) and type(op) in REVERSED_OPERATORS:
+                        filters.append((right.id, REVERSED_OPERATORS[type(op)], ast.literal_eval(left)))
+                except ValueError:
+                    # The operand is not a constant
+                    continue
+    return filters
+
+def _may_match(statistics, op: ast.cmpop, value) -> bool:
+    """Whether a row group may contain rows satisfying a comparison, based upon its column statistics."""
+    if statistics is None or not statistics.has_min_max:
+        return True
+    minimum, maximum = statistics.min, statistics.max
+    try:
+        if isinstance(op, ast.In):
+            return any(minimum <= v <= maximum for v in value)
+        if isinstance(op, ast.Eq):
+            return minimum <= value <= maximum
+        if isinstance(op, (ast.Gt, ast.GtE)):
+            return COMPARISON_OPERATORS[type(op)](maximum, value)
+        return COMPARISON_OPERATORS[type(op)](minimum, value)
+    except TypeError:
+        # Incomparable types, such as a string constant for a numeric column
+        return True
+
 class Data:
     def read_csv(self, name: str, **kwargs) -> pd.DataFrame:
         """
@@ -39,6 +297,419 @@ class Data:
         """
         return pd.read_csv(name, **kwargs)
 
+    def read_parquet(self, name: str, **kwargs) -> pd.DataFrame:
+        """
+        Wrapper method to load a parquet file.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        **kwargs
+            Additional arguments.
+
+        Returns
+        ---------
+        df: DataFrame
+            The dataframe.
+        """
+        return pd.read_parquet(name, **kwargs)
+
+    def read_feather(self, name: str, columns: list = None) -> pd.DataFrame:
+        """
+        Load a feather file using memory-mapped Arrow buffers.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        columns: list
+            An optional subset of columns to load.
+
+        Returns
+        ---------
+        df: DataFrame
+            The dataframe.
+        """
+        from pyarrow import feather
+        table = feather.read_table(name, columns = columns, memory_map = True)
+        return table.to_pandas()
+
+    def read_cached_csv(self, name: str, cache_dir: str, **kwargs) -> pd.DataFrame:
+        """
+        Load a csv file, caching the parsed dataframe in a columnar format.
+
+        Subsequent reads of an unchanged file will skip csv parsing, and load the cached feather file instead.
+        Only the latest version of each file is cached, so the cache files of previous versions are removed. Falls back to parsing the csv file if pyarrow is unavailable, or the dataframe cannot be cached.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        cache_dir: str
+            The cache directory.
+        **kwargs
+            Additional arguments.
+
+        Returns
+        ---------
+        df: DataFrame
+            The dataframe.
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            return self.read_csv(name, **kwargs)
+
+        cache_file = get_cache_file(name, cache_dir, **kwargs)
+        if os.path.isfile(cache_file):
+            return self.read_feather(cache_file)
+
+        df = self.read_csv(name, **kwargs)
+        os.makedirs(cache_dir, exist_ok = True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            df.to_feather(tmp_file)
+            os.replace(tmp_file, cache_file)
+            remove_stale_cache_files(cache_file)
+        except (ValueError, TypeError, pyarrow.ArrowException):
+            # Non-default indices and mixed-type columns cannot be serialised
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+        return df
+
+    def read(self, name: str, config = None, **kwargs) -> pd.DataFrame:
+        """
+        Load a data file based upon its file extension.
+
+        Parquet and feather files are loaded natively. All other files are loaded as csv files, 
+        using the columnar cache if it has been enabled. If dataframes are shared (see share_frames), 
+        a copy of a previously loaded dataframe is returned.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        config: Config
+            The optional configuration object.
+        **kwargs
+            Additional arguments.
+
+        Returns
+        ---------
+        df: DataFrame
+            The dataframe.
+        """
+        if _SHARED_FRAMES is not None:
+            df = _get_shared_frame(get_file_key(name, **kwargs), lambda: self._read(name, config, **kwargs))
+        else:
+            df = self._read(name, config, **kwargs)
+        record("rows_loaded", len(df))
+        return df
+
+    def _read(self, name: str, config = None, **kwargs) -> pd.DataFrame:
+        extension = os.path.splitext(name)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            return self.read_parquet(name, **kwargs)
+        if extension in FEATHER_EXTENSIONS:
+            return self.read_feather(name, **kwargs)
+
+        cache_dir = self.get_cache_dir(config)
+        if cache_dir is None:
+            return self.read_csv(name, **kwargs)
+        return self.read_cached_csv(name, cache_dir, **kwargs)
+
+    def read_columns(self, name: str) -> List[str]:
+        """
+        Read the column names of a data file, without loading its data.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+
+        Returns
+        ---------
+        columns: List[str]
+            The column names.
+        """
+        extension = os.path.splitext(name)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            from pyarrow.parquet import read_schema
+            return [ column for column in read_schema(name).names if not column.startswith("__index_level_") ]
+        if extension in FEATHER_EXTENSIONS:
+            from pyarrow import ipc
+            with ipc.open_file(name) as reader:
+                return reader.schema.names
+        return list(pd.read_csv(name, nrows = 0).columns)
+
+    def get_columns(self, name: str, config, exclude: List[str] = None, features: bool = False) -> List[str]:
+        """
+        Get the columns of a data file that are required by the pipeline.
+
+        Columns are selected by removing any excluded columns, and by the include_features and drop_features parameters
+        when features is set. The target, label_feature and fold_groups columns are always included.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        config: Config
+            The configuration object.
+        exclude: List[str]
+            Additional columns that are not required.
+        features: bool
+            Whether to select columns using include_features and drop_features, which only the preprocessing
+            pipeline applies.
+
+        Returns
+        ---------
+        columns: List[str]
+            The required columns, in their original order. None if all columns are required.
+        """
+        include = (config.get("include_features", False) or []) if features else []
+        drop = ((config.get("drop_features", False) or []) if features else []) + (exclude or [])
+        if len(include) == 0 and len(drop) == 0:
+            return None
+
+        columns = self.read_columns(name)
+        required = [ config.get(k, False) for k in ["target", "label_feature", "fold_groups"] ]
+        selected = [ 
+            column for column in columns 
+            if column in required or ((len(include) == 0 or column in include) and column not in drop) 
+        ]
+        return None if len(selected) == len(columns) else selected
+
+    def load(self, name: str, config, exclude: List[str] = None, query: bool = True, select: bool = True, 
+        features: bool = False) -> pd.DataFrame:
+        """
+        Load the rows and columns of a data file that are required by the pipeline.
+
+        The required columns (see get_columns) and the df_query predicate are pushed down into the read, so that only
+        the matching data is materialised. Csv files are parsed in chunks of read_chunk_size rows, parquet row groups
+        that cannot match the query are skipped using their column statistics, and feather files are filtered one
+        record batch at a time. Queries that are not row-wise (see is_row_wise_query) are applied once the selected
+        columns have been read. The result is the same as applying Data.query to the full dataframe.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        config: Config
+            The configuration object.
+        exclude: List[str]
+            Additional columns that are not required.
+        query: bool
+            Whether to apply the df_query predicate.
+        select: bool
+            Whether to select the required columns.
+        features: bool
+            Whether to select columns using include_features and drop_features (see get_columns).
+
+        Returns
+        ---------
+        df: DataFrame
+            The dataframe.
+        """
+        columns = self.get_columns(name, config, exclude, features) if select else None
+        df_query = config.get("df_query") if query else None
+        if columns is None and df_query is None:
+            df = self.read(name, config)
+        else:
+            chunk_size = config.get("read_chunk_size", False)
+            if _SHARED_FRAMES is not None:
+                key = get_file_key(name, columns = columns, df_query = df_query, chunk_size = chunk_size)
+                df = _get_shared_frame(key, lambda: self._read_filtered(name, config, columns, df_query, chunk_size))
+            else:
+                df = self._read_filtered(name, config, columns, df_query, chunk_size)
+            record("rows_loaded", len(df))
+
+            if df_query is not None:
+                # Matches Data.query
+                df = df.reset_index()
+
+        if config.get("compact_dtypes", False):
+            df = self.compact(df, config.get("compact_float_tolerance", False), 
+                config.get("max_category_ratio", False), exclude = [config.get("target", False)])
+        return df
+
+    def compact(self, df: pd.DataFrame, float_tolerance: float = 0, max_category_ratio: float = 0.5, 
+        exclude: List[str] = None, verbose: bool = True) -> pd.DataFrame:
+        """
+        Reduce the memory usage of a dataframe by compacting its column types.
+
+        Integer columns are downcast to the smallest integer type that holds their values, and float columns 
+        are downcast to float32 if the relative error of every value is within the tolerance. String columns 
+        are converted to categoricals if the ratio of unique values to rows is at most max_category_ratio.
+
+        Parameters
+        --------------
+        df: DataFrame
+            The dataframe.
+        float_tolerance: float
+            The maximum relative error when downcasting floats. 0 only downcasts floats losslessly, 
+            and None never downcasts floats.
+        max_category_ratio: float
+            The maximum ratio of unique values to rows for categorical columns. None never converts strings.
+        exclude: List[str]
+            Columns to leave unchanged.
+        verbose: bool
+            Whether to print the memory saved.
+
+        Returns
+        ---------
+        df: DataFrame
+            The compacted dataframe.
+        """
+        exclude = exclude or []
+        before = df.memory_usage(deep = True).sum()
+        columns = {}
+        for column in df.columns:
+            if column in exclude:
+                continue
+            series = df[column]
+            if pd.api.types.is_integer_dtype(series) and series.dtype.itemsize > 1:
+                columns[column] = pd.to_numeric(series, downcast = "integer")
+            elif series.dtype == np.float64 and float_tolerance is not None:
+                values = series.to_numpy()
+                compact = values.astype(np.float32)
+                if np.allclose(compact, values, rtol = float_tolerance, atol = 0, equal_nan = True):
+                    columns[column] = pd.Series(compact, index = series.index, name = column)
+            elif (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)) and not isinstance(
+                series.dtype, pd.CategoricalDtype) and max_category_ratio is not None and len(series) > 0:
+                if pd.api.types.infer_dtype(series) == "string" and series.nunique() / len(series) <= max_category_ratio:
+                    columns[column] = series.astype("category")
+
+        if len(columns) == 0:
+            return df
+        df = df.copy(deep = False)
+        for column, values in columns.items():
+            df[column] = values
+        after = df.memory_usage(deep = True).sum()
+        if verbose:
+            print(f"Compacted {len(columns)} columns from {before / 1024 ** 2:.1f}MB to {after / 1024 ** 2:.1f}MB, "
+                f"saving {(before - after) / 1024 ** 2:.1f}MB ({1 - after / before:.0%})")
+        return df
+
+    def _read_filtered(self, name: str, config, columns: List[str], df_query: str, chunk_size: int) -> pd.DataFrame:
+        """Read the selected columns of the rows matching a query, preserving the original row index."""
+        read_columns = columns
+        if df_query is not None and columns is not None:
+            all_columns = self.read_columns(name)
+            query_columns = get_query_columns(df_query, all_columns)
+            if query_columns is None:
+                read_columns = None
+            else:
+                read_columns = [ column for column in all_columns if column in columns or column in query_columns ]
+
+        # Queries that may depend on other rows are applied to the whole dataframe
+        chunk_query = df_query if df_query is not None and is_row_wise_query(df_query) else None
+        extension = os.path.splitext(name)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            chunks = self._read_parquet_row_groups(name, read_columns, chunk_query)
+        else:
+            cache_file = None
+            if extension not in FEATHER_EXTENSIONS:
+                cache_dir = self.get_cache_dir(config)
+                if cache_dir is not None:
+                    cache_file = get_cache_file(name, cache_dir)
+            if extension in FEATHER_EXTENSIONS or (cache_file is not None and os.path.isfile(cache_file)):
+                # Filter previously parsed csv files using the columnar cache
+                chunks = self._read_feather_batches(cache_file or name, read_columns)
+            else:
+                usecols = None if read_columns is None else lambda column: column in read_columns
+                chunks = pd.read_csv(name, usecols = usecols, chunksize = chunk_size or 100000)
+
+        filtered = []
+        for chunk in chunks:
+            if chunk_query is not None:
+                chunk = chunk.query(chunk_query)
+            if columns is not None and chunk_query == df_query:
+                chunk = chunk[columns]
+            filtered.append(chunk)
+        if len(filtered) == 0:
+            columns = columns if columns is not None else self.read_columns(name)
+            return pd.DataFrame(columns = columns)
+
+        df = pd.concat(filtered)
+        if chunk_query != df_query:
+            df = df.query(df_query)
+            if columns is not None:
+                df = df[columns]
+        return df
+
+    def _read_feather_batches(self, name: str, columns: List[str]) -> Iterator[pd.DataFrame]:
+        from pyarrow import feather
+        table = feather.read_table(name, columns = columns, memory_map = True)
+        offset = 0
+        for batch in table.to_batches():
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+
+    def _read_parquet_row_groups(self, name: str, columns: List[str], df_query: str) -> Iterator[pd.DataFrame]:
+        from pyarrow.parquet import ParquetFile
+        parquet_file = ParquetFile(name)
+        filters = get_query_filters(df_query) if df_query is not None else []
+        offset, n_read = 0, 0
+        for i in range(parquet_file.num_row_groups):
+            row_group = parquet_file.metadata.row_group(i)
+            n_rows = row_group.num_rows
+            statistics = { row_group.column(j).path_in_schema: row_group.column(j).statistics for j in range(row_group.num_columns) }
+            if all(_may_match(statistics.get(column), op, value) for column, op, value in filters):
+                chunk = parquet_file.read_row_group(i, columns = columns).to_pandas()
+                chunk.index = pd.RangeIndex(offset, offset + n_rows)
+                n_read += 1
+                yield chunk
+            offset += n_rows
+
+        if n_read == 0:
+            # Every row group was skipped, so return an empty chunk with the column types of the file
+            chunk = parquet_file.schema_arrow.empty_table().to_pandas()
+            yield chunk if columns is None else chunk[columns]
+
+    def read_chunks(self, name: str, chunk_size: int, **kwargs) -> Iterator[pd.DataFrame]:
+        """
+        Load a data file as a sequence of bounded-size chunks.
+
+        The index of each chunk continues on from the previous chunk, matching the index of the full dataframe.
+
+        Parameters
+        --------------
+        name: str
+            The file name.
+        chunk_size: int
+            The maximum number of rows per chunk.
+        **kwargs
+            Additional arguments.
+
+        Returns
+        ---------
+        chunks: Iterator[DataFrame]
+            The dataframe chunks.
+        """
+        extension = os.path.splitext(name)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            from pyarrow.parquet import ParquetFile
+            batches = ParquetFile(name).iter_batches(batch_size = chunk_size, **kwargs)
+        elif extension in FEATHER_EXTENSIONS:
+            from pyarrow import feather
+            batches = feather.read_table(name, memory_map = True, **kwargs).to_batches(max_chunksize = chunk_size)
+        else:
+            for chunk in pd.read_csv(name, chunksize = chunk_size, **kwargs):
+                record("rows_loaded", len(chunk))
+                yield chunk
+            return
+
+        offset = 0
+        for batch in batches:
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            record("rows_loaded", len(chunk))
+            yield chunk
+
     def train_test_split(self, df: pd.DataFrame, frac: float = 0.9, random_state: int = None) -> tuple:
         """
         Perform a train-test split.
@@ -89,6 +760,32 @@ class Data:
         file_name = join_path(base_dir, file_path)
         return file_name
 
+    def get_cache_dir(self, config) -> str:
+        """
+        Return the directory for cached data files.
+
+        Parameters
+        --------------
+        config: Config
+            The configuration object.
+
+        Returns
+        ---------
+        cache_dir: str
+            The cache directory. None if caching is disabled.
+        """
+        if config is None:
+            return None
+
+        cache_dir = config.get("data_cache_dir", False)
+        if cache_dir is None:
+            return None
+
+        base_dir = config.get("base_dir", False)
+        if base_dir is None:
+            return cache_dir
+        return join_path(base_dir, cache_dir)
+
     def query(self, config, df: pd.DataFrame) -> pd.DataFrame:
         """
         Wrapper method for performing dataframe queries.
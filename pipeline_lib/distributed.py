@@ -5,24 +5,384 @@ A library for facilitating distributed and parallel computing within the machine
 """
 
 ##########################################################################################################
-### Imports  
+### Imports
 ##########################################################################################################
 
 # External
+import abc
 import os
 
+from contextlib import nullcontext
+from typing import Callable, ContextManager, List
+
 ##########################################################################################################
-### Library  
+### Library
 ##########################################################################################################
 
-def init_dask():
-    import dask.distributed as dd
-    import dask_mpi as dm
-    """Initialise Dask cluster files, and connect to cluster using a client."""
-    # Initialise Dask cluster and store worker files in current work directory
-    dm.initialize(local_directory = os.getcwd())
-    client = dd.Client()
-    return client
-
-def close_dask(client):
-    client.close()
+EXECUTORS = ["local", "ray", "dask"]
+DASK_CLUSTERS = ["local", "mpi"]
+MB = 1024 ** 2
+
+def _read_first_line(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+def get_available_cpus() -> int:
+    """
+    Get the number of CPU cores available to the current process.
+
+    Accounts for CPU affinity, container CPU quotas, and the cores allocated to a Slurm task.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # Container CPU quota, using cgroup v2
+    quota = _read_first_line("/sys/fs/cgroup/cpu.max")
+    if quota is not None and not quota.startswith("max"):
+        limit, period = quota.split()
+        cpus = min(cpus, max(1, int(int(limit) / int(period))))
+
+    slurm_cpus = os.environ.get("SLURM_CPUS_PER_TASK")
+    if slurm_cpus is not None and slurm_cpus.isdigit():
+        cpus = min(cpus, int(slurm_cpus))
+    return max(cpus, 1)
+
+def get_available_memory() -> int:
+    """
+    Get the memory available to the current process in bytes.
+
+    Accounts for the available system memory, container memory limits, and the memory allocated to a Slurm job.
+    """
+    available = []
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available.append(int(line.split()[1]) * 1024)
+    except OSError:
+        try:
+            available.append(os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE"))
+        except (AttributeError, ValueError, OSError):
+            pass
+
+    # Container memory limits, using cgroup v2 and v1
+    for limit_file, usage_file in [("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes")]:
+        limit, usage = _read_first_line(limit_file), _read_first_line(usage_file)
+        if limit is not None and limit.isdigit() and int(limit) < 1 << 60:
+            available.append(int(limit) - int(usage or 0))
+            break
+
+    # Slurm memory allocations are in megabytes
+    mem_per_node, mem_per_cpu = os.environ.get("SLURM_MEM_PER_NODE"), os.environ.get("SLURM_MEM_PER_CPU")
+    if mem_per_node is not None and mem_per_node.isdigit():
+        available.append(int(mem_per_node) * MB)
+    elif mem_per_cpu is not None and mem_per_cpu.isdigit():
+        available.append(int(mem_per_cpu) * get_available_cpus() * MB)
+
+    if len(available) == 0:
+        return None
+    return max(min(available), 0)
+
+def get_n_workers(n_workers: int = -1, worker_memory_mb: int = None) -> int:
+    """
+    Get the number of worker processes to use.
+
+    Parameters
+    --------------
+    n_workers: int
+        The requested number of workers. Negative values are relative to the available cores, as for n_jobs,
+        so -1 uses all available cores. None uses a single worker.
+    worker_memory_mb: int
+        The optional memory required by each worker, in megabytes. Limits the workers to the available memory.
+
+    Returns
+    ---------
+    n_workers: int
+        The number of workers.
+    """
+    if n_workers is None:
+        return 1
+    if n_workers < 0:
+        n_workers = get_available_cpus() + 1 + n_workers
+    if worker_memory_mb is not None and worker_memory_mb > 0:
+        memory = get_available_memory()
+        if memory is not None:
+            n_workers = min(n_workers, memory // (worker_memory_mb * MB))
+    return max(int(n_workers), 1)
+
+class Executor(metaclass = abc.ABCMeta):
+    """
+    Base class for executors, which apply functions to items in parallel.
+
+    Executors are started once per pipeline run, and may be used as context managers.
+    """
+    name = None
+
+    def __init__(self, n_workers: int = -1, worker_memory_mb: int = None) -> None:
+        self.n_workers = get_n_workers(n_workers, worker_memory_mb)
+        self.worker_memory_mb = worker_memory_mb
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def map(self, func: Callable, items: list) -> List:
+        """
+        Apply a function to each item concurrently.
+
+        Parameters
+        --------------
+        func: Callable
+            A picklable function of a single argument.
+        items: list
+            The function arguments.
+
+        Returns
+        ---------
+        results: list
+            The function results, in the same order as the items.
+        """
+        return
+
+    def joblib_backend(self) -> ContextManager:
+        """
+        Get a context manager that runs joblib tasks on the executor, for libraries that parallelise using joblib.
+
+        Usage:
+            with executor.joblib_backend():
+                est.fit(X, y)
+        """
+        return nullcontext()
+
+    def get_n_jobs(self, n_jobs: int) -> int:
+        """Resolve a joblib n_jobs value against the cores of the executor, rather than the current node."""
+        return n_jobs
+
+    def close(self) -> None:
+        pass
+
+class LocalExecutor(Executor):
+    """Run tasks using a pool of local worker processes, or within the current process for a single worker."""
+    name = "local"
+
+    def __init__(self, n_workers: int = -1, worker_memory_mb: int = None, initializer: Callable = None,
+        initargs: tuple = ()) -> None:
+        super().__init__(n_workers, worker_memory_mb)
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def map(self, func: Callable, items: list) -> List:
+        if self.n_workers <= 1 or len(items) <= 1:
+            return [ func(item) for item in items ]
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers = min(self.n_workers, len(items)), initializer = self.initializer,
+            initargs = self.initargs) as executor:
+            return list(executor.map(func, items))
+
+class RayExecutor(Executor):
+    """
+    Run tasks on a Ray cluster.
+
+    Connects to a remote cluster if an address is given, and otherwise starts a local Ray instance using the available cores.
+    """
+    name = "ray"
+
+    def __init__(self, n_workers: int = -1, worker_memory_mb: int = None, address: str = None) -> None:
+        super().__init__(n_workers, worker_memory_mb)
+        self.address = address
+        self.initialised = False
+
+    def start(self) -> None:
+        import ray
+        if ray.is_initialized():
+            return
+        if self.address is not None:
+            ray.init(address = self.address)
+        else:
+            ray.init(num_cpus = self.n_workers)
+        self.initialised = True
+
+    def map(self, func: Callable, items: list) -> List:
+        import ray
+        remote_func = ray.remote(func)
+        return ray.get([ remote_func.remote(item) for item in items ])
+
+    def joblib_backend(self) -> ContextManager:
+        import joblib
+        from ray.util.joblib import register_ray
+        register_ray()
+        return joblib.parallel_backend("ray")
+
+    def get_n_jobs(self, n_jobs: int) -> int:
+        if n_jobs is None or n_jobs >= 0:
+            return n_jobs
+        import ray
+        return max(int(ray.cluster_resources().get("CPU", 1)) + 1 + n_jobs, 1)
+
+    def close(self) -> None:
+        if self.initialised:
+            import ray
+            ray.shutdown()
+            self.initialised = False
+
+class DaskExecutor(Executor):
+    """
+    Run tasks on a Dask cluster.
+
+    Clusters:
+        local - Start a local cluster of single-threaded worker processes, sharing the available memory.
+        mpi - Start a cluster across MPI ranks using dask_mpi, storing worker files in the current work directory.
+    """
+    name = "dask"
+
+    def __init__(self, n_workers: int = -1, worker_memory_mb: int = None, cluster: str = "local") -> None:
+        if cluster not in DASK_CLUSTERS:
+            raise Exception(f"Invalid Dask cluster error: {cluster}. Must be one of {DASK_CLUSTERS}")
+        super().__init__(n_workers, worker_memory_mb)
+        self.cluster_type = cluster
+        self.cluster = None
+        self.client = None
+
+    def start(self) -> None:
+        import dask.distributed as dd
+        if self.cluster_type == "mpi":
+            import dask_mpi as dm
+            dm.initialize(local_directory = os.getcwd())
+            self.client = dd.Client()
+            return
+
+        memory = get_available_memory()
+        memory_limit = "auto"
+        if self.worker_memory_mb is not None:
+            memory_limit = self.worker_memory_mb * MB
+        elif memory is not None:
+            memory_limit = memory // self.n_workers
+        self.cluster = dd.LocalCluster(n_workers = self.n_workers, threads_per_worker = 1, memory_limit = memory_limit)
+        self.client = dd.Client(self.cluster)
+
+    def map(self, func: Callable, items: list) -> List:
+        return self.client.gather(self.client.map(func, items, pure = False))
+
+    def joblib_backend(self) -> ContextManager:
+        import joblib
+        return joblib.parallel_backend("dask")
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if self.cluster is not None:
+            self.cluster.close()
+            self.cluster = None
+
+# The executor for the current pipeline run
+_EXECUTOR: Executor = None
+
+def get_executor() -> Executor:
+    """Get the executor for the current pipeline run, or None if no executor has been started."""
+    return _EXECUTOR
+
+def create_executor(config) -> Executor:
+    """
+    Create an executor from the pipeline configuration.
+
+    Parameters
+    --------------
+    config: Config
+        The pipeline configuration object.
+
+    Returns
+    ---------
+    executor: Executor
+        The executor, which has not been started.
+    """
+    # run_distributed: false is the same as the local executor, but true selected Ray or Dask depending on the pipeline
+    if config.get("run_distributed", False):
+        raise Exception(f"Invalid parameter error: run_distributed. It has been replaced by executor, which must be one of {EXECUTORS}")
+
+    name = config.get("executor", False) or "local"
+    n_workers = config.get("n_workers", False)
+    n_workers = -1 if n_workers is None else n_workers
+    worker_memory_mb = config.get("worker_memory_mb", False)
+    if name == "local":
+        return LocalExecutor(n_workers, worker_memory_mb)
+    if name == "ray":
+        address = config.get("ray_address", False) or config.get("RAY_ADDRESS", False)
+        return RayExecutor(n_workers, worker_memory_mb, address)
+    if name == "dask":
+        return DaskExecutor(n_workers, worker_memory_mb, config.get("dask_cluster", False) or "local")
+    raise Exception(f"Invalid executor error: {name}. Must be one of {EXECUTORS}")
+
+def start_executor(config) -> Executor:
+    """
+    Start the configured executor for a pipeline run.
+
+    Parameters
+    --------------
+    config: Config
+        The pipeline configuration object.
+
+    Returns
+    ---------
+    executor: Executor
+        The started executor.
+    """
+    global _EXECUTOR
+    _EXECUTOR = create_executor(config)
+    _EXECUTOR.start()
+    return _EXECUTOR
+
+def stop_executor() -> None:
+    """Stop the executor for the current pipeline run."""
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.close()
+        _EXECUTOR = None
+
+def is_distributed(config) -> bool:
+    """Whether the pipeline is configured to run on a Ray or Dask cluster."""
+    return (config.get("executor", False) or "local") != "local"
+
+def parallel_map(func: Callable, items: list, n_workers: int = 1, distributed: bool = False,
+    initializer: Callable = None, initargs: tuple = ()) -> List:
+    """
+    Apply a function to each item concurrently.
+
+    Parameters
+    --------------
+    func: Callable
+        A picklable function of a single argument.
+    items: list
+        The function arguments.
+    n_workers: int
+        The number of local worker processes. Negative values are relative to the available cores, so -1 uses all
+        available cores. Ignored when distributed.
+    distributed: bool
+        Whether to submit tasks to the executor of the current pipeline run, if one has been started.
+    initializer: Callable
+        An optional function called once by each local worker process.
+    initargs: tuple
+        The initializer arguments.
+
+    Returns
+    ---------
+    results: list
+        The function results, in the same order as the items.
+    """
+    if distributed and _EXECUTOR is not None:
+        return _EXECUTOR.map(func, items)
+    return LocalExecutor(n_workers, initializer = initializer, initargs = initargs).map(func, items)
@@ -9,21 +9,28 @@ A library of estimators for the machine learning pipeline.
 ##########################################################################################################
 
 # External
+from __future__ import annotations
+
 import abc
+import hashlib
 import pandas as pd
-import pycaret.classification
-import pycaret.regression
-import sklearn
 
-from typing import List, Tuple
+from typing import List, Tuple, TYPE_CHECKING
 
 from enum import Enum, unique
-from joblib import dump
+from importlib import import_module
+from joblib import dump, load
+
+if TYPE_CHECKING:
+    import sklearn
 
 # Internal
 from pipeline_lib.custom_estimators import CUSTOM_ANOMALY_DETECTION, CUSTOM_CLASSIFIERS, CUSTOM_CLUSTERING, CUSTOM_REGRESSORS 
 from pipeline_lib.config import Config
 from pipeline_lib.data import join_path
+from pipeline_lib.distributed import get_n_workers, is_distributed, parallel_map
+from pipeline_lib.monitoring import record
+from pipeline_lib.profiling import span, timed
 
 ##########################################################################################################
 ### Library  
@@ -37,6 +44,9 @@ class EstimatorTask(Enum):
     CLUSTERING = "clustering"
     ANOMALY_DETECTION = "anomaly"
 
+# Supported ensemble methods, in the order that they are built
+ENSEMBLE_METHODS = ["stacking", "blending", "boosting", "bagging", "blended_boosting", "blended_bagging"]
+
 class PyCaretEstimatorBase(metaclass = abc.ABCMeta):
     """Abstract base class for estimators."""
     @abc.abstractmethod
@@ -59,6 +69,10 @@ class PyCaretEstimatorBase(metaclass = abc.ABCMeta):
     def get_logs(self, **kwargs):
         return
 
+    @abc.abstractmethod
+    def models(self, **kwargs):
+        return
+
     @abc.abstractmethod
     def create_model(self, estimator, **kwargs):
         return  
@@ -111,117 +125,491 @@ class PyCaretEstimatorBase(metaclass = abc.ABCMeta):
     def get_config(self, variable: str):
         return
 
+    @abc.abstractmethod
+    def save_config(self, file_name: str):
+        return
+
+    @abc.abstractmethod
+    def load_config(self, file_name: str):
+        return
+
+    @abc.abstractmethod
+    def set_config(self, variable: str, value):
+        return
+
 class PyCaretRegressor(PyCaretEstimatorBase):
     """Estimator for regression."""
+    @property
+    def pycaret(self):
+        """The PyCaret regression module, imported on first use."""
+        return import_module("pycaret.regression")
+
     def setup(self, **kwargs):
-        return pycaret.regression.setup(**kwargs)
+        return self.pycaret.setup(**kwargs)
 
     def compare_models(self, **kwargs):
-        return pycaret.regression.compare_models(**kwargs)
+        return self.pycaret.compare_models(**kwargs)
 
     def pull(self, **kwargs):
-        return pycaret.regression.pull(**kwargs)
+        return self.pycaret.pull(**kwargs)
 
     def tune_model(self, estimator, **kwargs):
-        return pycaret.regression.tune_model(estimator, **kwargs)
+        return self.pycaret.tune_model(estimator, **kwargs)
 
     def get_logs(self, **kwargs):
-        return pycaret.regression.get_logs(**kwargs)
+        return self.pycaret.get_logs(**kwargs)
+
+    def models(self, **kwargs):
+        return self.pycaret.models(**kwargs)
 
     def create_model(self, estimator, **kwargs):
-        return pycaret.regression.create_model(estimator, **kwargs)
+        return self.pycaret.create_model(estimator, **kwargs)
 
     def get_config(self, **kwargs):
-        return pycaret.regression.get_config(**kwargs)
+        return self.pycaret.get_config(**kwargs)
 
     def ensemble_model(self, estimator, **kwargs):
-        return pycaret.regression.ensemble_model(estimator, **kwargs)
+        return self.pycaret.ensemble_model(estimator, **kwargs)
 
     def finalize_model(self, estimator, **kwargs):
-        return pycaret.regression.finalize_model(estimator, **kwargs)
+        return self.pycaret.finalize_model(estimator, **kwargs)
 
     def predict_model(self, estimator, **kwargs):
-        return pycaret.regression.predict_model(estimator, **kwargs)
+        return self.pycaret.predict_model(estimator, **kwargs)
 
     def plot_model(self, estimator, **kwargs):
-        return pycaret.regression.plot_model(estimator, **kwargs)
+        return self.pycaret.plot_model(estimator, **kwargs)
 
     def interpret_model(self, estimator, **kwargs):
-        return pycaret.regression.interpret_model(estimator, **kwargs)
+        return self.pycaret.interpret_model(estimator, **kwargs)
 
     def blend_models(self, estimators: list, **kwargs):
-        return pycaret.regression.blend_models(estimators, **kwargs)
+        return self.pycaret.blend_models(estimators, **kwargs)
 
     def stack_models(self, estimators: list, **kwargs):
-        return pycaret.regression.stack_models(estimators, **kwargs)
+        return self.pycaret.stack_models(estimators, **kwargs)
 
     def automl(self, **kwargs):
-        return pycaret.regression.automl(**kwargs)
+        return self.pycaret.automl(**kwargs)
 
     def save_model(self, estimator, **kwargs):
-        return pycaret.regression.save_model(estimator, **kwargs)
+        return self.pycaret.save_model(estimator, **kwargs)
 
     def load_model(self, model_name: str):
-        return pycaret.regression.load_model(model_name)
+        return self.pycaret.load_model(model_name)
 
     def get_config(self, variable: str):
-        return pycaret.regression.get_config(variable)
+        return self.pycaret.get_config(variable)
+
+    def save_config(self, file_name: str):
+        return self.pycaret.save_config(file_name)
+
+    def load_config(self, file_name: str):
+        return self.pycaret.load_config(file_name)
+
+    def set_config(self, variable: str, value):
+        return self.pycaret.set_config(variable, value)
 
 class PyCaretClassifier(PyCaretEstimatorBase):
     """Estimator for classification."""
+    @property
+    def pycaret(self):
+        """The PyCaret classification module, imported on first use."""
+        return import_module("pycaret.classification")
+
     def setup(self, **kwargs):
-        return pycaret.classification.setup(**kwargs)
+        return self.pycaret.setup(**kwargs)
 
     def compare_models(self, **kwargs):
-        return pycaret.classification.compare_models(**kwargs)
+        return self.pycaret.compare_models(**kwargs)
 
     def pull(self, **kwargs):
-        return pycaret.classification.pull(**kwargs)
+        return self.pycaret.pull(**kwargs)
 
     def tune_model(self, estimator, **kwargs):
-        return pycaret.classification.tune_model(estimator, **kwargs)
+        return self.pycaret.tune_model(estimator, **kwargs)
 
     def get_logs(self, **kwargs):
-        return pycaret.classification.get_logs(**kwargs)
+        return self.pycaret.get_logs(**kwargs)
+
+    def models(self, **kwargs):
+        return self.pycaret.models(**kwargs)
 
     def create_model(self, estimator, **kwargs):
-        return pycaret.classification.create_model(estimator, **kwargs)
+        return self.pycaret.create_model(estimator, **kwargs)
 
     def get_config(self, **kwargs):
-        return pycaret.classification.get_config(**kwargs)
+        return self.pycaret.get_config(**kwargs)
 
     def ensemble_model(self, estimator, **kwargs):
-        return pycaret.classification.ensemble_model(estimator, **kwargs)
+        return self.pycaret.ensemble_model(estimator, **kwargs)
 
     def finalize_model(self, estimator, **kwargs):
-        return pycaret.classification.finalize_model(estimator, **kwargs)
+        return self.pycaret.finalize_model(estimator, **kwargs)
 
     def predict_model(self, estimator, **kwargs):
-        return pycaret.classification.predict_model(estimator, **kwargs)
+        return self.pycaret.predict_model(estimator, **kwargs)
 
     def plot_model(self, estimator, **kwargs):
-        return pycaret.classification.plot_model(estimator, **kwargs)
+        return self.pycaret.plot_model(estimator, **kwargs)
 
     def interpret_model(self, estimator, **kwargs):
-        return pycaret.classification.interpret_model(estimator, **kwargs)
+        return self.pycaret.interpret_model(estimator, **kwargs)
 
     def blend_models(self, estimators: list, **kwargs):
-        return pycaret.classification.blend_models(estimators, **kwargs)
+        return self.pycaret.blend_models(estimators, **kwargs)
 
     def stack_models(self, estimators: list, **kwargs):
-        return pycaret.classification.stack_models(estimators, **kwargs)
+        return self.pycaret.stack_models(estimators, **kwargs)
 
     def automl(self, **kwargs):
-        return pycaret.classification.automl(**kwargs)
+        return self.pycaret.automl(**kwargs)
         
     def save_model(self, estimator, **kwargs):
-        return pycaret.classification.save_model(estimator, **kwargs)
+        return self.pycaret.save_model(estimator, **kwargs)
 
     def load_model(self, model_name: str):
-        return pycaret.classification.load_model(model_name)
+        return self.pycaret.load_model(model_name)
 
     def get_config(self, variable: str):
-        return pycaret.classification.get_config(variable)
+        return self.pycaret.get_config(variable)
+
+    def save_config(self, file_name: str):
+        return self.pycaret.save_config(file_name)
+
+    def load_config(self, file_name: str):
+        return self.pycaret.load_config(file_name)
+
+    def set_config(self, variable: str, value):
+        return self.pycaret.set_config(variable, value)
+
+class EstimatorWrapper(PyCaretEstimatorBase):
+    """Base class for estimator wrappers, which delegate to a wrapped estimator."""
+    def __init__(self, estimator: PyCaretEstimatorBase) -> None:
+        self.estimator = estimator
+
+    def setup(self, **kwargs):
+        return self.estimator.setup(**kwargs)
+
+    def compare_models(self, **kwargs):
+        return self.estimator.compare_models(**kwargs)
+
+    def pull(self, **kwargs):
+        return self.estimator.pull(**kwargs)
+
+    def tune_model(self, estimator, **kwargs):
+        return self.estimator.tune_model(estimator, **kwargs)
+
+    def get_logs(self, **kwargs):
+        return self.estimator.get_logs(**kwargs)
+
+    def models(self, **kwargs):
+        return self.estimator.models(**kwargs)
+
+    def create_model(self, estimator, **kwargs):
+        return self.estimator.create_model(estimator, **kwargs)
+
+    def ensemble_model(self, estimator, **kwargs):
+        return self.estimator.ensemble_model(estimator, **kwargs)
+
+    def finalize_model(self, estimator, **kwargs):
+        return self.estimator.finalize_model(estimator, **kwargs)
+
+    def predict_model(self, estimator, **kwargs):
+        return self.estimator.predict_model(estimator, **kwargs)
+
+    def plot_model(self, estimator, **kwargs):
+        return self.estimator.plot_model(estimator, **kwargs)
+
+    def interpret_model(self, estimator, **kwargs):
+        return self.estimator.interpret_model(estimator, **kwargs)
+
+    def blend_models(self, estimators: list, **kwargs):
+        return self.estimator.blend_models(estimators, **kwargs)
+
+    def stack_models(self, estimators: list, **kwargs):
+        return self.estimator.stack_models(estimators, **kwargs)
+
+    def automl(self, **kwargs):
+        return self.estimator.automl(**kwargs)
+
+    def save_model(self, estimator, **kwargs):
+        return self.estimator.save_model(estimator, **kwargs)
+
+    def load_model(self, model_name: str):
+        return self.estimator.load_model(model_name)
+
+    def get_config(self, variable: str):
+        return self.estimator.get_config(variable)
+
+    def save_config(self, file_name: str):
+        return self.estimator.save_config(file_name)
+
+    def load_config(self, file_name: str):
+        return self.estimator.load_config(file_name)
+
+    def set_config(self, variable: str, value):
+        return self.estimator.set_config(variable, value)
+
+class CachedEstimator(EstimatorWrapper):
+    """
+    Estimator wrapper that memoises compare_models and tune_model results on disk.
+
+    Results are keyed by a fingerprint of the setup session (the transformed training data, random seed, and folds),
+    the wrapped estimator type, the input model, and the call arguments. Changing a tuning argument only
+    invalidates the entries that used it. Cached models are re-evaluated within the current session, 
+    so that they may still be selected by automl.
+    """
+    def __init__(self, estimator: PyCaretEstimatorBase, config: Config) -> None:
+        from pipeline_lib.cache import ResultCache
+        super().__init__(estimator)
+        cache_dir = join_path(config.get("base_dir", False), config.get("result_cache_dir"))
+        self.cache = ResultCache(cache_dir, config.get("result_cache_size_mb"))
+        self.session_key = None
+        self.last_pull = None
+
+    def _get_key(self, method: str, *args, **kwargs) -> str:
+        from pipeline_lib.cache import hash_key
+        if self.session_key is None:
+            self.session_key = self._get_session_key()
+        return hash_key(self.session_key, type(self.estimator).__name__, method, args, sorted(kwargs.items()))
+
+    def _get_session_key(self) -> str:
+        from pipeline_lib.cache import hash_dataframe, hash_key
+        X_train = self.estimator.get_config("X_train")
+        y_train = self.estimator.get_config("y_train")
+        session_args = [ self.estimator.get_config(variable) for variable in ["seed", "fold_generator", "fold_groups_param"] ]
+        return hash_key(session_args, hash_dataframe(X_train), hash_dataframe(y_train))
+
+    def _cached(self, method: str, func, *args, **kwargs):
+        key = self._get_key(method, *args, **kwargs)
+        hit, value = self.cache.get(key)
+        if hit:
+            result, self.last_pull = value
+            models = result if type(result) is list else [result]
+            for model in models:
+                self.estimator.create_model(model, verbose = False)
+            return result
+
+        result = func(*args, **kwargs)
+        self.last_pull = None
+        self.cache.set(key, (result, self.estimator.pull()))
+        return result
+
+    def setup(self, **kwargs):
+        self.session_key = None
+        return self.estimator.setup(**kwargs)
+
+    def compare_models(self, **kwargs):
+        return self._cached("compare_models", self.estimator.compare_models, **kwargs)
+
+    def pull(self, **kwargs):
+        if self.last_pull is not None:
+            return self.last_pull
+        return self.estimator.pull(**kwargs)
+
+    def tune_model(self, estimator, **kwargs):
+        return self._cached("tune_model", self.estimator.tune_model, estimator, **kwargs)
+
+    def create_model(self, estimator, **kwargs):
+        self.last_pull = None
+        return self.estimator.create_model(estimator, **kwargs)
+
+    def ensemble_model(self, estimator, **kwargs):
+        self.last_pull = None
+        return self.estimator.ensemble_model(estimator, **kwargs)
+
+    def predict_model(self, estimator, **kwargs):
+        self.last_pull = None
+        return self.estimator.predict_model(estimator, **kwargs)
+
+    def blend_models(self, estimators: list, **kwargs):
+        self.last_pull = None
+        return self.estimator.blend_models(estimators, **kwargs)
+
+    def stack_models(self, estimators: list, **kwargs):
+        self.last_pull = None
+        return self.estimator.stack_models(estimators, **kwargs)
+
+    def load_config(self, file_name: str):
+        self.session_key = None
+        return self.estimator.load_config(file_name)
+
+class OptunaStudyEstimator(EstimatorWrapper):
+    """
+    Estimator wrapper that stores the Optuna studies of tune_model in a persistent SQLite or RDB storage.
+
+    Studies are named after the experiment and the model, and keyed by the setup session, the input model, and
+    the tuning arguments. Interrupted or repeated tuning runs resume from the completed trials of a matching study,
+    and only run the remaining trials. The best trial is selected from all trials of the study.
+    """
+    def __init__(self, estimator: PyCaretEstimatorBase, config: Config, experiment_name: str) -> None:
+        from pipeline_lib.tuning import get_optuna_storage
+        super().__init__(estimator)
+        self.storage = get_optuna_storage(config.get("optuna_storage"), config.get("base_dir", False))
+        self.pruner = config.get("optuna_pruner")
+        self.experiment_name = experiment_name
+        self.session_key = None
+
+    def _get_study_name(self, estimator, **kwargs) -> str:
+        from pipeline_lib.cache import hash_dataframe, hash_key
+        if self.session_key is None:
+            X_train = self.estimator.get_config("X_train")
+            y_train = self.estimator.get_config("y_train")
+            self.session_key = hash_key(self.estimator.get_config("seed"), hash_dataframe(X_train), hash_dataframe(y_train))
+        # The number of trials may change without invalidating the study
+        tune_args = sorted((k, v) for k, v in kwargs.items() if k != "n_iter")
+        key = hash_key(self.session_key, type(self.estimator).__name__, estimator, tune_args)
+        return f"{self.experiment_name}/{type(estimator).__name__}/{key[:12]}"
+
+    def setup(self, **kwargs):
+        self.session_key = None
+        return self.estimator.setup(**kwargs)
+
+    def tune_model(self, estimator, **kwargs):
+        if kwargs.get("search_library") != "optuna":
+            return self.estimator.tune_model(estimator, **kwargs)
+
+        from pipeline_lib.tuning import get_completed_trials, persistent_study
+        if self.pruner is not None:
+            kwargs["early_stopping"] = self.pruner
+        study_name = self._get_study_name(estimator, **kwargs)
+        n_iter = kwargs.get("n_iter") or 10
+        completed = get_completed_trials(self.storage, study_name)
+        # At least one trial is run, so that the best trial of the study is refit
+        kwargs["n_iter"] = max(n_iter - completed, 1)
+        if completed > 0:
+            print(f"Resuming Optuna study {study_name} from {completed} completed trials")
+        with persistent_study(self.storage, study_name):
+            return self.estimator.tune_model(estimator, **kwargs)
+
+    def load_config(self, file_name: str):
+        self.session_key = None
+        return self.estimator.load_config(file_name)
+
+# The estimator session restored within each worker process
+_WORKER_SESSION = None
+
+def _restore_session(estimator: PyCaretEstimatorBase, session: bytes) -> None:
+    """Restore a saved setup session within a worker process, once per session."""
+    global _WORKER_SESSION
+    session_key = hashlib.sha1(session).hexdigest()
+    if _WORKER_SESSION == session_key:
+        return
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        session_file = join_path(tmp_dir, "session.pkl")
+        with open(session_file, "wb") as f:
+            f.write(session)
+        estimator.load_config(session_file)
+    _WORKER_SESSION = session_key
+
+# Setup session containers of the models evaluated by create_model, and their cross-validation scores
+MODEL_CONTAINERS = ["master_model_container", "create_model_container"]
+
+def _session_task(task: tuple):
+    """Run a function of the setup session within a worker process, and return the models that it evaluated."""
+    estimator, session, func, args = task
+    if session is not None:
+        _restore_session(estimator, session)
+    containers = [ estimator.get_config(container) for container in MODEL_CONTAINERS ]
+    n_evaluated = len(containers[0])
+    result = func(estimator, *args)
+    return result, [ container[n_evaluated:] for container in containers ]
+
+def run_in_sessions(estimator: PyCaretEstimatorBase, func, args_list: List[tuple], n_workers: int = 1, 
+    distributed: bool = False, register: bool = True) -> list:
+    """
+    Run several independent functions of the current setup session, concurrently if configured.
+
+    The setup session is saved once, and restored by each worker before running its function. The restored session
+    includes the fold generator, so every worker evaluates models on the same cross-validation folds. The models 
+    evaluated by each worker are added to the current session along with their cross-validation scores, so that 
+    they may be selected by automl without being evaluated again.
+
+    Parameters
+    --------------
+    estimator: PyCaretEstimatorBase
+        The estimator.
+    func: Callable
+        A module-level function accepting the estimator followed by the arguments of each task.
+    args_list: List[tuple]
+        The arguments for each task.
+    n_workers: int
+        The number of local worker processes.
+    distributed: bool
+        Whether to run tasks on the executor of the current pipeline run.
+    register: bool
+        Whether to add the models evaluated by workers to the current session.
+
+    Returns
+    ---------
+    results: list
+        The function results, in the same order as the arguments.
+    """
+    if not distributed and (get_n_workers(n_workers) <= 1 or len(args_list) <= 1):
+        return [ func(estimator, *args) for args in args_list ]
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        session_file = join_path(tmp_dir, "session.pkl")
+        estimator.save_config(session_file)
+        with open(session_file, "rb") as f:
+            session = f.read()
+
+    tasks = [ (estimator, session, func, args) for args in args_list ]
+    results = []
+    containers = [ estimator.get_config(container) for container in MODEL_CONTAINERS ]
+    for result, evaluated in parallel_map(_session_task, tasks, n_workers, distributed):
+        if register:
+            for container, entries in zip(containers, evaluated):
+                container.extend(entries)
+        results.append(result)
+    return results
+
+def _create_and_tune(estimator: PyCaretEstimatorBase, model, create: bool, kwargs: dict) -> sklearn.base.BaseEstimator:
+    if create:
+        model = estimator.create_model(model)
+    return estimator.tune_model(model, **kwargs)
+
+def tune_models(estimator: PyCaretEstimatorBase, config: Config, models: list, tune_kwargs: List[dict], 
+    create: bool = False, register: bool = True) -> List[sklearn.base.BaseEstimator]:
+    """
+    Tune several independent models, concurrently if configured.
+
+    Models are tuned across tuning_workers local processes, or using the Ray or Dask executor if configured.
+    Searches using tune-sklearn already run their trials with Ray Tune, so they are not submitted as executor
+    tasks, which would otherwise start Ray Tune inside Ray tasks.
+
+    Parameters
+    --------------
+    estimator: PyCaretEstimatorBase
+        The estimator.
+    config: Config
+        The pipeline configuration object.
+    models: list
+        The models to tune.
+    tune_kwargs: List[dict]
+        The tuning arguments for each model.
+    create: bool
+        Whether to create each model before tuning.
+    register: bool
+        Whether to add models tuned by workers to the current session, so that they may be selected by automl.
+
+    Returns
+    ---------
+    tuned_models: list
+        The tuned models, in the same order as the input models.
+    """
+    n_workers = config.get("tuning_workers")
+    uses_ray_tune = any(kwargs.get("search_library") == "tune-sklearn" for kwargs in tune_kwargs)
+    distributed = is_distributed(config) and not uses_ray_tune
+    args_list = [ (model, create, kwargs) for model, kwargs in zip(models, tune_kwargs) ]
+    tuned_models = run_in_sessions(estimator, _create_and_tune, args_list, n_workers, distributed, register)
+    record("models_evaluated", len(tuned_models))
+    record("tuning_trials", sum(kwargs.get("n_iter") or 0 for kwargs in tune_kwargs))
+    return tuned_models
 
 def add_custom_estimators(estimator: PyCaretEstimatorBase, config: Config, search_algorithm: str, 
     search_library: str, tuned_top: List[sklearn.base.BaseEstimator]) -> List[sklearn.base.BaseEstimator]:    
@@ -243,24 +631,84 @@ def add_custom_estimators(estimator: PyCaretEstimatorBase, config: Config, searc
     for k, v in custom_grid_config.items():
         custom_grid[k] = v
 
-    model_list = []
+    estimator_instances = []
+    tune_kwargs = []
     evaluation_metric = config.get("evaluation_metric")
     for custom_estimator in custom_estimators:
         if custom_estimator not in available_estimators:
             continue
 
-        estimator_instance = available_estimators.get(custom_estimator)()
-        trained_model = estimator.create_model(estimator_instance)
-        tuned_model = estimator.tune_model(trained_model, search_algorithm = search_algorithm, optimize = evaluation_metric,
+        estimator_instances.append(available_estimators.get(custom_estimator)())
+        tune_kwargs.append(dict(search_algorithm = search_algorithm, optimize = evaluation_metric,
             search_library = search_library, n_iter = config.get("n_iter"), custom_grid = custom_grid.get(custom_estimator), 
             early_stopping = config.get("early_stopping_algo"), early_stopping_max_iters = config.get("early_stop"), 
-            choose_better = True) 
-        model_list.append(tuned_model)
-
-    combined_models = estimator.compare_models(include = tuned_top + model_list, n_select = config.get("n_select"), 
-        sort = evaluation_metric, turbo = config.get("turbo"))
+            choose_better = True))
+
+    # Only the screening finalists are tuned
+    if config.get("screening"):
+        from pipeline_lib.screening import screen_models
+        with span("screen_custom_models"):
+            finalists = screen_models(estimator, config, estimator_instances)
+        kept = [ i for i, instance in enumerate(estimator_instances) if any(instance is model for model in finalists) ]
+        estimator_instances = [ estimator_instances[i] for i in kept ]
+        tune_kwargs = [ tune_kwargs[i] for i in kept ]
+
+    # Tuned models are re-evaluated by compare_models below
+    with span("tune_custom_models"):
+        model_list = tune_models(estimator, config, estimator_instances, tune_kwargs, create = True, register = False)
+
+    with span("compare_custom_models"):
+        include = tuned_top + model_list
+        if config.get("racing"):
+            from pipeline_lib.screening import race_models
+            include = race_models(estimator, config, include)
+        combined_models = estimator.compare_models(include = include, n_select = config.get("n_select"), 
+            sort = evaluation_metric, turbo = config.get("turbo"))
+        record("models_evaluated", len(estimator.pull()))
     return combined_models
 
+def _build_ensemble(estimator: PyCaretEstimatorBase, method: str, tuned_top: List[sklearn.base.BaseEstimator], 
+    top_models: List[sklearn.base.BaseEstimator], kwargs: dict) -> sklearn.base.BaseEstimator:
+    """Build a single ensemble estimator."""
+    evaluation_metric = kwargs["evaluation_metric"]
+    n_estimators = kwargs["n_estimators"]
+
+    if method == "stacking":
+        meta_model = estimator.create_model(kwargs["meta_model"])
+        tuned_meta_model = estimator.tune_model(meta_model, search_algorithm = kwargs["search_algorithm"], 
+            optimize = evaluation_metric, search_library = kwargs["search_library"], n_iter = kwargs["n_iter"], 
+            custom_grid = kwargs["custom_grid"].get(meta_model)) 
+        return estimator.stack_models(tuned_top, optimize = evaluation_metric, meta_model = tuned_meta_model)
+
+    if method == "blending":
+        return estimator.blend_models(tuned_top, optimize = evaluation_metric, choose_better = True)
+
+    if method == "boosting":
+        return estimator.ensemble_model(tuned_top[0], method = "Boosting", optimize = evaluation_metric, 
+            choose_better = True, n_estimators = n_estimators)
+
+    if method == "bagging":
+        return estimator.ensemble_model(tuned_top[0], method = "Bagging", optimize = evaluation_metric, 
+            choose_better = True, n_estimators = n_estimators)
+
+    if method == "blended_boosting":
+        boosted_top = [ 
+            estimator.ensemble_model(model, method = "Boosting", optimize = evaluation_metric, 
+                choose_better = True, n_estimators = n_estimators)
+            for model in top_models 
+        ]
+        return estimator.blend_models(boosted_top, optimize = evaluation_metric, choose_better = True)
+
+    if method == "blended_bagging":
+        bagging_top = [ 
+            estimator.ensemble_model(model, method = "Bagging", optimize = evaluation_metric, 
+                choose_better = True, n_estimators = n_estimators)
+            for model in top_models 
+        ]
+        return estimator.blend_models(bagging_top, optimize = evaluation_metric, choose_better = True)
+
+    raise Exception(f"Error: Invalid ensemble method - {method}")
+
 def train_ensemble_estimators(estimator: PyCaretEstimatorBase, config: Config, search_algorithm: str, 
     search_library: str) -> Tuple[sklearn.base.BaseEstimator]:    
     """Train several ensemble models, and return the best performing one."""
@@ -270,60 +718,58 @@ def train_ensemble_estimators(estimator: PyCaretEstimatorBase, config: Config, s
     custom_grid = config.get_custom_grid(search_algorithm, search_library) 
     ensemble_methods = config.get_as("ensemble_methods", set)
 
+    # Screen candidates on subsamples, so that only the finalists are cross-validated on the full training set
+    include = config.get("include_estimators")
+    if config.get("screening"):
+        from pipeline_lib.screening import screen_models
+        with span("screen_models"):
+            include = screen_models(estimator, config, include) or include
+
+    # Drop candidates that are dominated on their first folds
+    if config.get("racing"):
+        from pipeline_lib.screening import race_models
+        with span("race_models"):
+            include = race_models(estimator, config, include) or include
+
     # Train and tune estimators
-    top_models = estimator.compare_models(include = config.get("include_estimators"), n_select = config.get("n_select"), 
-        sort = evaluation_metric, turbo = config.get("turbo"))
-    sorted_models = estimator.pull().index
+    with span("compare_models"):
+        top_models = estimator.compare_models(include = include, n_select = config.get("n_select"), 
+            sort = evaluation_metric, turbo = config.get("turbo"))
+        sorted_models = estimator.pull().index
+        record("models_evaluated", len(sorted_models))
 
     if type(top_models) is not list:
         top_models = [top_models]
-    tuned_top = [ 
-        estimator.tune_model(model, search_algorithm = search_algorithm, optimize = evaluation_metric,
+    tune_kwargs = [ 
+        dict(search_algorithm = search_algorithm, optimize = evaluation_metric,
             search_library = search_library, n_iter = n_iter, custom_grid = custom_grid.get(sorted_models[i]), 
             early_stopping = config.get("early_stopping_algo"), early_stopping_max_iters = config.get("early_stop"), 
             choose_better = True) 
-        for i, model in enumerate(top_models) 
+        for i in range(len(top_models)) 
     ]
+    with span("tune_models"):
+        tuned_top = tune_models(estimator, config, top_models, tune_kwargs)
 
-    tuned_top = add_custom_estimators(estimator, config, search_algorithm, search_library, tuned_top)
+    with span("custom_estimators"):
+        tuned_top = add_custom_estimators(estimator, config, search_algorithm, search_library, tuned_top)
     
     # Train ensemble estimators
-    if "stacking" in ensemble_methods:
-        meta_model = estimator.create_model(config.get("meta_model"))
-        tuned_meta_model = estimator.tune_model(meta_model, search_algorithm = search_algorithm, 
-            optimize = evaluation_metric, search_library = search_library, n_iter = n_iter, custom_grid = custom_grid.get(meta_model)) 
-        stacking_ensemble = estimator.stack_models(tuned_top, optimize = evaluation_metric, meta_model = tuned_meta_model)
-
-    if "blending" in ensemble_methods:
-        blending_ensemble = estimator.blend_models(tuned_top, optimize = evaluation_metric, choose_better = True)
-
-    if "boosting" in ensemble_methods:
-        boosting_ensemble = estimator.ensemble_model(tuned_top[0], method = "Boosting", optimize = evaluation_metric, 
-            choose_better = True, n_estimators = n_estimators)
-
-    if "bagging" in ensemble_methods:
-        bagging_ensemble = estimator.ensemble_model(tuned_top[0], method = "Bagging", optimize = evaluation_metric, 
-            choose_better = True, n_estimators = n_estimators)
-
-    if "blended_boosting" in ensemble_methods:
-        boosted_top = [ 
-            estimator.ensemble_model(model, method = "Boosting", optimize = evaluation_metric, 
-                choose_better = True, n_estimators = n_estimators)
-            for model in top_models 
-        ]
-        boosted_blending_ensemble = estimator.blend_models(boosted_top, optimize = evaluation_metric, choose_better = True)
-
-    if "blended_bagging" in ensemble_methods:
-        bagging_top = [ 
-            estimator.ensemble_model(model, method = "Bagging", optimize = evaluation_metric, 
-                choose_better = True, n_estimators = n_estimators)
-            for model in top_models 
-        ]
-        bagging_blending_ensemble = estimator.blend_models(bagging_top, optimize = evaluation_metric, choose_better = True)
+    ensemble_kwargs = { 
+        "evaluation_metric": evaluation_metric, "n_estimators": n_estimators, "n_iter": n_iter, 
+        "search_algorithm": search_algorithm, "search_library": search_library, "custom_grid": custom_grid, 
+        "meta_model": config.get("meta_model") 
+    }
+    methods = [ method for method in ENSEMBLE_METHODS if method in ensemble_methods ]
+    args_list = [ (method, tuned_top, top_models, ensemble_kwargs) for method in methods ]
+    n_workers = config.get("ensemble_workers")
+    with span("ensembles"):
+        ensembles = run_in_sessions(estimator, _build_ensemble, args_list, n_workers)
+        record("models_evaluated", len(ensembles))
 
     # Use AutoML to select best model in session
-    best_model = estimator.automl(optimize = evaluation_metric)        
-    final_ensemble = estimator.finalize_model(best_model)
+    with span("finalize"):
+        best_model = estimator.automl(optimize = evaluation_metric)        
+        final_ensemble = estimator.finalize_model(best_model)
     return best_model, final_ensemble
 
 def _get_setup_kwargs(config: Config, data: pd.DataFrame, experiment_name: str) -> dict:
@@ -352,6 +798,39 @@ def _get_setup_kwargs(config: Config, data: pd.DataFrame, experiment_name: str)
 
     return kwargs
 
+# Setup arguments that only affect logging, and may differ between pipelines sharing a cached setup
+LOGGING_SETUP_ARGS = ["data", "experiment_name", "log_experiment", "log_plots", "log_profile", "log_data", "profile", "silent"]
+
+def _cached_setup(task: str, setup_func, save_config, load_config, get_config, set_config, config: Config, kwargs: dict):
+    """
+    Run an estimator setup, or restore a previously fitted setup session from the setup cache.
+
+    Cached sessions are keyed by the estimator task, a hash of the input data, and the remaining setup arguments.
+    Logging options are reapplied to restored sessions, so that pipelines with different experiments may share them.
+    Restored sessions return the same global variables as setup.
+    """
+    cache_dir = config.get("setup_cache_dir")
+    if cache_dir is None:
+        return setup_func(**kwargs)
+
+    from pipeline_lib.cache import ResultCache, hash_dataframe, hash_key
+    cache = ResultCache(join_path(config.get("base_dir", False), cache_dir), config.get("setup_cache_size_mb"))
+    setup_args = { k: v for k, v in kwargs.items() if k not in LOGGING_SETUP_ARGS }
+    key = hash_key(task, hash_dataframe(kwargs["data"]), sorted(setup_args.items()))
+
+    session_file = cache.get_file(key)
+    if session_file is None:
+        est_setup = setup_func(**kwargs)
+        cache.set_file(key, save_config)
+        return est_setup
+
+    load_config(session_file)
+    set_config("exp_name_log", kwargs["experiment_name"])
+    set_config("logging_param", kwargs["log_experiment"])
+    set_config("log_plots_param", kwargs["log_plots"])
+    return tuple([ get_config(variable) for variable in get_config("pycaret_globals") ])
+
+@timed("setup")
 def setup(estimator: PyCaretEstimatorBase, config: Config, data: pd.DataFrame, experiment_name: str):
     kwargs = _get_setup_kwargs(config, data, experiment_name)
     kwargs["fold_shuffle"] = True
@@ -363,16 +842,18 @@ def setup(estimator: PyCaretEstimatorBase, config: Config, data: pd.DataFrame, e
     for config_arg in config_args:
         kwargs[config_arg] = config.get(config_arg)
 
-    return estimator.setup(**kwargs) 
+    return _cached_setup(config.get("est_task"), estimator.setup, estimator.save_config, estimator.load_config, 
+        estimator.get_config, estimator.set_config, config, kwargs)
     
+@timed("setup")
 def unsupervised_setup(config: Config, data: pd.DataFrame, experiment_name: str, type: str = EstimatorTask.CLUSTERING.value):
     if type == EstimatorTask.ANOMALY_DETECTION.value:
-        from pycaret.anomaly import setup
+        from pycaret.anomaly import get_config, load_config, save_config, set_config, setup
     else:
-        from pycaret.clustering import setup
+        from pycaret.clustering import get_config, load_config, save_config, set_config, setup
 
     kwargs = _get_setup_kwargs(config, data, experiment_name)
-    return setup(**kwargs) 
+    return _cached_setup(type, setup, save_config, load_config, get_config, set_config, config, kwargs) 
 
 def get_unsupervised_custom_model(model_name: str, type: str, **kwargs) -> sklearn.base.BaseEstimator:
     if type == EstimatorTask.ANOMALY_DETECTION.value:
@@ -380,8 +861,19 @@ def get_unsupervised_custom_model(model_name: str, type: str, **kwargs) -> sklea
     else:
         return CUSTOM_CLUSTERING.get(model_name)(**kwargs)
     
+def get_prediction_pipeline(estimator: PyCaretEstimatorBase, model) -> sklearn.base.BaseEstimator:
+    """Combine the fitted preprocessing pipeline from setup with a model, so that predictions no longer require setup."""
+    from copy import deepcopy
+    pipeline = deepcopy(estimator.get_config("prep_pipe"))
+    pipeline.steps.append(["trained_model", model])
+    return pipeline
+
 def save_local_model(model, experiment_name: str, path = "data") -> str:
     """Save the model to a local directory."""
     model_path = join_path(path, f"{experiment_name}.joblib")
     dump(model, model_path) 
     return model_path
+
+def load_local_model(model_path: str):
+    """Load a model from a local directory."""
+    return load(model_path)
@@ -0,0 +1,268 @@
+"""
+Machine Learning Pipeline Monitoring
+
+A library for exporting runtime metrics from running pipelines to Prometheus.
+"""
+
+##########################################################################################################
+### Imports
+##########################################################################################################
+
+# External
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.request import Request, urlopen
+
+##########################################################################################################
+### Library
+##########################################################################################################
+
+EXPORTERS = ["http", "textfile", "pushgateway"]
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metric names, mapped to their types and descriptions
+METRICS = {
+    "ml_pipeline_running": ("gauge", "Whether the pipeline is running."),
+    "ml_pipeline_start_timestamp_seconds": ("gauge", "The time that the pipeline started."),
+    "ml_pipeline_last_progress_timestamp_seconds": ("gauge", "The time of the most recent pipeline progress."),
+    "ml_pipeline_stage": ("gauge", "The current pipeline stage."),
+    "ml_pipeline_stage_start_timestamp_seconds": ("gauge", "The time that the current pipeline stage started."),
+    "ml_pipeline_stage_duration_seconds": ("gauge", "The duration of the most recently completed run of each stage."),
+    "ml_pipeline_rows_loaded_total": ("counter", "The number of input data rows loaded."),
+    "ml_pipeline_models_evaluated_total": ("counter", "The number of models trained and cross-validated."),
+    "ml_pipeline_tuning_trials_total": ("counter", "The number of hyperparameter search iterations completed."),
+    "ml_pipeline_scored_rows_total": ("counter", "The number of rows scored."),
+    "ml_pipeline_scoring_seconds_total": ("counter", "The time spent scoring rows."),
+    "ml_pipeline_scoring_rows_per_second": ("gauge", "The throughput of the most recent scoring call."),
+}
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class PipelineMetrics:
+    """
+    Runtime metrics for a single pipeline run.
+
+    Metrics are labelled by pipeline and scenario, and rendered in the Prometheus text exposition format.
+    Stage metrics are updated by listening to the spans of the pipeline tracer.
+    """
+    def __init__(self, pipeline: str, scenario: str = None) -> None:
+        self.labels = { "pipeline": pipeline, "scenario": scenario or "experiment" }
+        self.values: Dict[Tuple[str, tuple], float] = {}
+        self.stage = None
+        self.lock = threading.Lock()
+        now = time.time()
+        # Counters are exported from the start of the run, so that rates are defined before the first increment
+        for name, (metric_type, _) in METRICS.items():
+            if metric_type == "counter":
+                self.set(name, 0)
+        self.set("ml_pipeline_running", 1)
+        self.set("ml_pipeline_start_timestamp_seconds", now)
+        self.set("ml_pipeline_last_progress_timestamp_seconds", now)
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a metric value."""
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increment a counter, and record progress."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+            self.values[("ml_pipeline_last_progress_timestamp_seconds", ())] = time.time()
+
+    def set_stage(self, stage: str) -> None:
+        """Set the current stage."""
+        now = time.time()
+        with self.lock:
+            self.values = { k: v for k, v in self.values.items()
+                if k[0] not in ["ml_pipeline_stage", "ml_pipeline_stage_start_timestamp_seconds"] }
+            self.stage = stage
+            if stage is not None:
+                self.values[("ml_pipeline_stage", (("stage", stage),))] = 1
+                self.values[("ml_pipeline_stage_start_timestamp_seconds", (("stage", stage),))] = now
+            self.values[("ml_pipeline_last_progress_timestamp_seconds", ())] = now
+
+    def on_span_start(self, path: str) -> None:
+        self.set_stage(path)
+
+    def on_span_end(self, span) -> None:
+        self.set("ml_pipeline_stage_duration_seconds", span.wall_time, stage = span.path)
+        parent = span.path.rsplit("/", 1)[0] if "/" in span.path else None
+        self.set_stage(parent)
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            values = dict(self.values)
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            samples = [ (labels, value) for (key, labels), value in values.items() if key == name ]
+            if len(samples) == 0:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(samples):
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in list(self.labels.items()) + list(labels))
+                lines.append(f"{name}{{{label_str}}} {value}")
+        return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """HTTP request handler serving GET /metrics."""
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+class Monitor:
+    """
+    Export pipeline metrics using a Prometheus exporter.
+
+    Exporters:
+        http - Serve metrics from an HTTP endpoint for Prometheus to scrape.
+        textfile - Periodically write metrics to a file for the node exporter textfile collector.
+        pushgateway - Periodically push metrics to a Prometheus Pushgateway.
+    """
+    def __init__(self, metrics: PipelineMetrics, exporter: str, port: int = 8000, textfile_dir: str = None,
+        pushgateway: str = None, interval: float = 15) -> None:
+        if exporter not in EXPORTERS:
+            raise Exception(f"Invalid metrics exporter error: {exporter}. Must be one of {EXPORTERS}")
+        self.metrics = metrics
+        self.exporter = exporter
+        self.port = port
+        self.textfile_dir = textfile_dir
+        self.pushgateway = pushgateway
+        self.interval = interval
+        self.server = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self) -> None:
+        if self.exporter == "http":
+            try:
+                self.server = ThreadingHTTPServer(("", self.port), MetricsRequestHandler)
+            except OSError as e:
+                print(f"Metrics exporter unavailable on port {self.port}: {e}")
+                return
+            self.server.daemon_threads = True
+            self.server.metrics = self.metrics
+            self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        else:
+            self.thread = threading.Thread(target = self._export_periodically, daemon = True)
+        self.thread.start()
+
+    def _export_periodically(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def _get_job_path(self) -> str:
+        labels = self.metrics.labels
+        return f"metrics/job/ml_pipeline/pipeline/{labels['pipeline']}/scenario/{labels['scenario']}"
+
+    def export(self) -> None:
+        """Write or push the current metrics."""
+        try:
+            if self.exporter == "textfile":
+                os.makedirs(self.textfile_dir, exist_ok = True)
+                labels = self.metrics.labels
+                path = os.path.join(self.textfile_dir, f"ml_pipeline_{labels['pipeline']}_{labels['scenario']}.prom")
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(self.metrics.render())
+                os.replace(tmp_path, path)
+            elif self.exporter == "pushgateway":
+                request = Request(f"http://{self.pushgateway}/{self._get_job_path()}", data = self.metrics.render().encode(),
+                    method = "PUT", headers = { "Content-Type": PROMETHEUS_CONTENT_TYPE })
+                urlopen(request, timeout = 10).close()
+        except OSError as e:
+            # Metrics are best effort, and must not fail the pipeline
+            print(f"Metrics export error: {e}")
+
+    def stop(self) -> None:
+        """Mark the pipeline as finished, export the final metrics, and stop the exporter."""
+        self.metrics.set_stage(None)
+        self.metrics.set("ml_pipeline_running", 0)
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        elif self.thread is not None:
+            self.thread.join()
+            self.export()
+
+# The monitor for the current pipeline run
+_MONITOR: Monitor = None
+
+def get_monitor() -> Monitor:
+    """Get the monitor for the current pipeline run, or None if metrics are not exported."""
+    return _MONITOR
+
+def start_monitoring(pipeline: str, config) -> Monitor:
+    """
+    Start exporting metrics for a pipeline run, if a metrics exporter is configured.
+
+    Parameters
+    --------------
+    pipeline: str
+        The pipeline name.
+    config: Config
+        The pipeline configuration object.
+
+    Returns
+    ---------
+    monitor: Monitor
+        The monitor, or None if metrics are not exported.
+    """
+    global _MONITOR
+    exporter = config.get("metrics_exporter", False)
+    if exporter is None:
+        return None
+
+    textfile_dir = config.get("metrics_textfile_dir", False)
+    if textfile_dir is not None:
+        textfile_dir = os.path.join(config.get("base_dir", False) or ".", textfile_dir)
+    metrics = PipelineMetrics(pipeline, config.get("scenario", False))
+    _MONITOR = Monitor(metrics, exporter, config.get("metrics_port", False), textfile_dir,
+        config.get("metrics_pushgateway", False), config.get("metrics_interval", False) or 15)
+    _MONITOR.start()
+    return _MONITOR
+
+def stop_monitoring() -> None:
+    """Stop exporting metrics for the current pipeline run."""
+    global _MONITOR
+    if _MONITOR is not None:
+        _MONITOR.stop()
+        _MONITOR = None
+
+def record(name: str, value: float = 1) -> None:
+    """
+    Increment a pipeline counter, such as rows_loaded or models_evaluated. Does nothing unless metrics are exported.
+
+    The name excludes the ml_pipeline_ prefix and _total suffix.
+    """
+    if _MONITOR is not None:
+        _MONITOR.metrics.inc(f"ml_pipeline_{name}_total", value)
+
+def record_scoring(n_rows: int, seconds: float) -> None:
+    """Record the number of rows scored and the scoring time. Does nothing unless metrics are exported."""
+    if _MONITOR is not None:
+        record("scored_rows", n_rows)
+        record("scoring_seconds", seconds)
+        if seconds > 0:
+            _MONITOR.metrics.set("ml_pipeline_scoring_rows_per_second", n_rows / seconds)
@@ -9,22 +9,29 @@ A library for constructing pipeline components within the machine learning pipel
 ##########################################################################################################
 
 # External
-from typing import Callable, List
+from __future__ import annotations
+
+from typing import Callable, List, TYPE_CHECKING
 
-import sklearn
-import mlflow
 import os
 import pandas as pd
+import queue
 import tempfile
+import threading
 import time
 import uuid
 
 from dataclasses import dataclass, field
 
+if TYPE_CHECKING:
+    import sklearn
+
 # Internal
 from pipeline_lib.config import Config
 from pipeline_lib.data import join_path
 from pipeline_lib.estimator import save_local_model 
+from pipeline_lib.profiling import get_tracer, span, timed
+from pipeline_lib.resources import get_sampler
 
 ##########################################################################################################
 ### Library  
@@ -53,21 +60,258 @@ def get_experiment_name(project_name: str, config: Config) -> str:
     experiment_name = f"{project_name}_{scenario}"
     return experiment_name
 
+class ArtifactUploader:
+    """
+    Upload MLFlow artifacts in the background.
+
+    Uploads are placed on a bounded queue, and consumed by worker threads, so that they overlap with the 
+    remaining pipeline work. Submitting blocks when the queue is full. Call flush to wait for all 
+    uploads to complete, and to raise any upload errors.
+    """
+    def __init__(self, run_id: str, n_workers: int = 2, max_queue_size: int = 16) -> None:
+        import mlflow
+        self.client = mlflow.tracking.MlflowClient()
+        self.run_id = run_id
+        self.staging_dir = tempfile.TemporaryDirectory()
+        self.queue = queue.Queue(maxsize = max_queue_size)
+        self.timings = []
+        self.errors = []
+        self.lock = threading.Lock()
+        self.workers = [ threading.Thread(target = self._work, daemon = True) for _ in range(max(n_workers, 1)) ]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                return
+
+            name, func, args, submitted = task
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append((name, e))
+            finally:
+                end = time.perf_counter()
+                with self.lock:
+                    self.timings.append({ "artifact": name, "queued": round(start - submitted, 4), 
+                        "upload": round(end - start, 4) })
+                self.queue.task_done()
+
+    def submit(self, name: str, func: Callable, *args) -> None:
+        """Submit an upload function and its arguments."""
+        self.queue.put((name, func, args, time.perf_counter()))
+
+    def log_artifact(self, local_path: str, artifact_path: str = None) -> None:
+        """Upload a file, or a directory under its own name, to the run."""
+        if os.path.isdir(local_path):
+            if artifact_path is None:
+                artifact_path = os.path.basename(os.path.normpath(local_path))
+            self.submit(local_path, self.client.log_artifacts, self.run_id, local_path, artifact_path)
+        else:
+            self.submit(local_path, self.client.log_artifact, self.run_id, local_path, artifact_path)
+
+    def flush(self) -> List[dict]:
+        """
+        Wait for all submitted uploads to complete.
+
+        Returns
+        ---------
+        timings: List[dict]
+            The time spent queued and uploading for each artifact, in seconds.
+        """
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+            timings = list(self.timings)
+        if len(errors) > 0:
+            failed = ", ".join(f"{name} ({e})" for name, e in errors)
+            raise Exception(f"Artifact upload error: {failed}")
+        return timings
+
+    def close(self) -> None:
+        """Stop the worker threads, and remove staged files."""
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.staging_dir.cleanup()
+
+# The artifact uploader for the active MLFlow run
+_UPLOADER: ArtifactUploader = None
+
+def get_uploader() -> ArtifactUploader:
+    """Get the artifact uploader for the active MLFlow run, or None if uploads are synchronous."""
+    return _UPLOADER
+
+def upload_artifact(local_path: str, artifact_path: str = None) -> None:
+    """Log a file or directory to the active MLFlow run, in the background if an uploader is enabled."""
+    if _UPLOADER is not None:
+        _UPLOADER.log_artifact(local_path, artifact_path)
+        return
+
+    import mlflow
+    if os.path.isdir(local_path):
+        if artifact_path is None:
+            artifact_path = os.path.basename(os.path.normpath(local_path))
+        mlflow.log_artifacts(local_path, artifact_path)
+    else:
+        mlflow.log_artifact(local_path, artifact_path)
+
 def init_mlflow(config: Config) -> tempfile.TemporaryDirectory:
     """Initialise the MLFlow run."""
+    global _UPLOADER
+    import mlflow
     mlflow.set_tracking_uri(config.get("MLFLOW_TRACKING_URI")) # Enable tracking using MLFlow
-    mlflow.start_run()
+    run = mlflow.start_run()
     tmp_dir = tempfile.TemporaryDirectory()
+
+    upload_workers = config.get("artifact_upload_workers", False)
+    if upload_workers is not None and upload_workers > 0:
+        _UPLOADER = ArtifactUploader(run.info.run_id, upload_workers, config.get("artifact_upload_queue_size", False) or 16)
     return tmp_dir
 
+def flush_artifacts() -> List[dict]:
+    """Wait for background artifact uploads to complete, and log their timings to the active MLFlow run."""
+    global _UPLOADER
+    if _UPLOADER is None:
+        return []
+
+    import mlflow
+    uploader, _UPLOADER = _UPLOADER, None
+    start = time.perf_counter()
+    try:
+        timings = uploader.flush()
+    finally:
+        uploader.close()
+
+    mlflow.log_metric("artifact_upload_time", sum(timing["upload"] for timing in timings))
+    mlflow.log_metric("artifact_upload_wait", time.perf_counter() - start)
+    mlflow.log_dict({ "artifacts": timings }, "artifact_upload_timings.json")
+    return timings
+
+def abort_mlflow() -> None:
+    """End the active MLFlow run as failed, and stop any background artifact uploads without raising their errors."""
+    global _UPLOADER
+    uploader, _UPLOADER = _UPLOADER, None
+    if uploader is not None:
+        uploader.close()
+
+    import mlflow
+    if mlflow.active_run() is not None:
+        mlflow.end_run(status = "FAILED")
+
+def log_spans(tmp_dir: tempfile.TemporaryDirectory) -> None:
+    """
+    Log the completed timing spans as MLFlow metrics, and the trace file and any profiles as artifacts.
+
+    If resources are sampled, the stage resource usage is logged as metrics, and the resource report as an artifact.
+    """
+    tracer = get_tracer()
+    sampler = get_sampler()
+    with MetricSink() as sink:
+        sink.log_metrics(tracer.get_metrics())
+        if sampler is not None:
+            sink.log_metrics(sampler.get_metrics())
+    if sampler is not None:
+        upload_artifact(sampler.save(join_path(tmp_dir.name, "resources.json")))
+    upload_artifact(tracer.save(join_path(tmp_dir.name, "trace.json")))
+    for profile in tracer.profiles:
+        upload_artifact(profile)
+        summary = f"{os.path.splitext(profile)[0]}.txt"
+        if os.path.isfile(summary):
+            upload_artifact(summary)
+
 def end_mlflow(project_name: str, experiment_name: str, tmp_dir: tempfile.TemporaryDirectory, author: str = None) -> None:
-    """End the MLFlow run."""
+    """
+    End the MLFlow run, after any background artifact uploads have completed.
+
+    The spans are logged and the run is ended once the pipeline root span has closed, so that they include the 
+    whole pipeline.
+    """
+    import mlflow
+    with span("upload"):
+        flush_artifacts()
     mlflow.set_tag("project", project_name)
     mlflow.set_tag("experiment", experiment_name)
     if author is not None:
         mlflow.set_tag("author", author)
-    mlflow.end_run()
-    tmp_dir.cleanup()
+
+    def end_run():
+        log_spans(tmp_dir)
+        mlflow.end_run()
+        tmp_dir.cleanup()
+    get_tracer().defer(end_run)
+
+class MetricSink:
+    """
+    Buffer MLFlow metrics, and log them using bulk requests.
+
+    Metrics are flushed in chunks of at most batch_size metrics per request, when the buffer is full, 
+    and when the sink is closed. Use as a context manager to flush remaining metrics on exit.
+    """
+    def __init__(self, run_id: str = None, batch_size: int = 1000) -> None:
+        import mlflow
+        self.client = mlflow.tracking.MlflowClient()
+        self.run_id = run_id if run_id is not None else mlflow.active_run().info.run_id
+        self.batch_size = batch_size
+        self.metrics = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    def log_metric(self, key: str, value: float, step: int = 0) -> None:
+        """Add a metric to the buffer."""
+        from mlflow.entities import Metric
+        timestamp = int(time.time() * 1000)
+        self.metrics.append(Metric(key, float(value), timestamp, step or 0))
+        if len(self.metrics) >= self.batch_size:
+            self.flush()
+
+    def log_metrics(self, metrics: dict, step: int = 0) -> None:
+        """Add a dictionary of metrics to the buffer."""
+        for k, v in metrics.items():
+            self.log_metric(k, v, step)
+
+    def flush(self) -> None:
+        """Log all buffered metrics."""
+        for i in range(0, len(self.metrics), self.batch_size):
+            self.client.log_batch(self.run_id, metrics = self.metrics[i:i + self.batch_size])
+        self.metrics = []
+
+    def log_trace(self, df: pd.DataFrame, name: str, path: str) -> str:
+        """
+        Log a complete trace, such as per-sample predictions, as a single columnar artifact.
+
+        Parameters
+        --------------
+        df: DataFrame
+            The trace dataframe.
+        name: str
+            The artifact file name, without an extension.
+        path: str
+            The local directory to write the artifact to before logging.
+
+        Returns
+        ---------
+        trace_path: str
+            The local path of the artifact.
+        """
+        try:
+            trace_path = join_path(path, f"{name}.parquet")
+            df.to_parquet(trace_path, index = False)
+        except ImportError:
+            trace_path = join_path(path, f"{name}.csv")
+            df.to_csv(trace_path, index = False)
+        upload_artifact(trace_path)
+        return trace_path
 
 @dataclass
 class PlotParameters:
@@ -77,6 +321,7 @@ class PlotParameters:
     plots: List[str] = field(default_factory = list)
     model: sklearn.base.BaseEstimator = None
 
+@timed("plots")
 def pipeline_plots(plot_params: PlotParameters, default_model: sklearn.base.BaseEstimator, save: str,
     log_artifact = False) -> None:
     """Save pipeline plots from a plot parameter object."""    
@@ -92,7 +337,7 @@ def pipeline_plots(plot_params: PlotParameters, default_model: sklearn.base.Base
         kwargs["plot"] = plot
         model_plot = plot_params.plot_model(plot_params.model, **kwargs)
         if log_artifact:
-            mlflow.log_artifact(join_path(save, model_plot))
+            upload_artifact(join_path(save, model_plot))
 
 def create_local_directory(config: Config) -> str:
     """
@@ -120,6 +365,7 @@ def create_local_directory(config: Config) -> str:
     os.makedirs(full_dir, exist_ok = True)
     return full_dir
     
+@timed("save_results")
 def save_local_results(config: Config, model, experiment_name: str, assigned_df: pd.DataFrame = None,
     plot_params: PlotParameters = None, save_path: str = None) -> None:
     """Save pipeline results to the local data directory."""
@@ -136,10 +382,9 @@ def save_local_results(config: Config, model, experiment_name: str, assigned_df:
 
     return save_path
 
-def save_mlflow_model(config: Config, model, experiment_name: str) -> None:
-    """Save the model to the MLFlow model registry."""
-    model_info = mlflow.sklearn.log_model(model, artifact_path = experiment_name)
-    run_id = mlflow.active_run().info.run_id
+def _register_mlflow_model(config: Config, run_id: str, experiment_name: str) -> None:
+    """Register a logged model, and add its description."""
+    import mlflow
     model_uri = f"runs:/{run_id}/{experiment_name}" 
     model_version = mlflow.register_model(model_uri, experiment_name)
 
@@ -151,12 +396,32 @@ def save_mlflow_model(config: Config, model, experiment_name: str) -> None:
         client = mlflow.tracking.MlflowClient()
         client.update_model_version(experiment_name, model_version.version, model_description)
 
+def _upload_mlflow_model(uploader: ArtifactUploader, config: Config, model_path: str, experiment_name: str) -> None:
+    uploader.client.log_artifacts(uploader.run_id, model_path, experiment_name)
+    _register_mlflow_model(config, uploader.run_id, experiment_name)
+
+def save_mlflow_model(config: Config, model, experiment_name: str) -> None:
+    """Save the model to the MLFlow model registry."""
+    import mlflow
+    uploader = get_uploader()
+    if uploader is None:
+        mlflow.sklearn.log_model(model, artifact_path = experiment_name)
+        _register_mlflow_model(config, mlflow.active_run().info.run_id, experiment_name)
+        return
+
+    # Serialise the model now, then upload and register it in the background
+    from mlflow.models import Model
+    model_path = join_path(uploader.staging_dir.name, experiment_name)
+    mlflow_model = Model(artifact_path = experiment_name, run_id = uploader.run_id)
+    mlflow.sklearn.save_model(model, model_path, mlflow_model = mlflow_model)
+    uploader.submit(model_path, _upload_mlflow_model, uploader, config, model_path, experiment_name)
+
+@timed("save_results")
 def save_mlflow_results(config: Config, model, experiment_name: str, tmp_dir: tempfile.TemporaryDirectory, 
     assigned_df: pd.DataFrame = None, plot_params: PlotParameters = None) -> None:
     """Save pipeline results to the MLFlow server."""
-    
     config_path = config.export(tmp_dir.name)
-    mlflow.log_artifact(config_path)
+    upload_artifact(config_path)
     
     # Saving model to MLFlow registry
     save_mlflow_model(config, model, experiment_name)
@@ -164,7 +429,7 @@ def save_mlflow_results(config: Config, model, experiment_name: str, tmp_dir: te
     if assigned_df is not None:
         df_path = join_path(tmp_dir.name, f"{experiment_name}.csv")
         assigned_df.to_csv(df_path)
-        mlflow.log_artifact(df_path)
+        upload_artifact(df_path)
 
     if plot_params is not None:
         pipeline_plots(plot_params, model, tmp_dir.name, True)
\ No newline at end of file
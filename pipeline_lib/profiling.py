@@ -0,0 +1,297 @@
+"""
+Machine Learning Pipeline Profiling
+
+A library for recording stage-level timing spans and profiles within the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports
+##########################################################################################################
+
+# External
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterator, List
+
+# Internal
+from pipeline_lib.config import Config
+from pipeline_lib.data import join_path
+from pipeline_lib.monitoring import start_monitoring, stop_monitoring
+from pipeline_lib.resources import print_recommendation, start_sampling, stop_sampling
+
+##########################################################################################################
+### Library
+##########################################################################################################
+
+PROFILERS = ["cprofile", "sampling"]
+
+@dataclass
+class Span:
+    """A completed timing span."""
+    name: str
+    path: str
+    depth: int
+    start: float
+    wall_time: float
+    cpu_time: float
+
+class SamplingProfiler:
+    """
+    A low-overhead statistical profiler.
+
+    A background thread samples the call stack of the profiled thread at a fixed interval, and counts
+    each distinct stack. Results are written in the collapsed stack format used by flame graph tools.
+    """
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def enable(self) -> None:
+        self.thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.thread = threading.Thread(target = self._sample, daemon = True)
+        self.thread.start()
+
+    def disable(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def dump_stats(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class Tracer:
+    """
+    Record nested wall-clock and CPU time spans for pipeline stages.
+
+    Optionally profiles the first span matching profile_stage, using either cProfile or a sampling profiler.
+    Listeners with on_span_start(path) and on_span_end(span) methods are notified as spans start and end.
+    Functions deferred using defer are run once the outermost span has closed.
+    """
+    def __init__(self, profile_stage: str = None, profiler: str = "cprofile", profile_interval: float = 0.01,
+        profile_dir: str = ".") -> None:
+        if profiler not in PROFILERS:
+            raise Exception(f"Invalid profiler error: {profiler}. Must be one of {PROFILERS}")
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_interval = profile_interval
+        self.profile_dir = profile_dir
+        self.spans: List[Span] = []
+        self.stack: List[str] = []
+        self.profiles: List[str] = []
+        self.listeners = []
+        self.deferred: List[Callable] = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def _start_profiler(self):
+        if self.profiler == "sampling":
+            profiler = SamplingProfiler(self.profile_interval)
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _save_profile(self, profiler, name: str) -> None:
+        self.profile_stage = None # Profile a single stage only
+        profile_dir = self.profile_dir
+        os.makedirs(profile_dir, exist_ok = True)
+        file_name = name.replace("/", "_")
+        if self.profiler == "sampling":
+            path = join_path(profile_dir, f"{file_name}.folded")
+            profiler.dump_stats(path)
+        else:
+            import io
+            import pstats
+            path = join_path(profile_dir, f"{file_name}.prof")
+            profiler.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream = summary).sort_stats("cumulative").print_stats(50)
+            with open(join_path(profile_dir, f"{file_name}.txt"), "w") as f:
+                f.write(summary.getvalue())
+        self.profiles.append(path)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Record a span for the enclosed block, nested within any enclosing spans."""
+        # Spans are only recorded on the main thread, so that nesting is well defined
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        self.stack.append(name)
+        path = "/".join(self.stack)
+        for listener in self.listeners:
+            listener.on_span_start(path)
+        profiler = self._start_profiler() if self.profile_stage in (name, path) else None
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_wall
+            cpu_time = time.process_time() - start_cpu
+            if profiler is not None:
+                profiler.disable()
+                self._save_profile(profiler, path)
+            self.stack.pop()
+            span = Span(name, path, len(self.stack), start_wall - self.origin, wall_time, cpu_time)
+            with self.lock:
+                self.spans.append(span)
+            for listener in self.listeners:
+                listener.on_span_end(span)
+            if len(self.stack) == 0:
+                deferred, self.deferred = self.deferred, []
+                for func in deferred:
+                    func()
+
+    def defer(self, func: Callable) -> None:
+        """Run a function once the outermost span has closed, or immediately if no span is open."""
+        if len(self.stack) == 0:
+            func()
+        else:
+            self.deferred.append(func)
+
+    def get_metrics(self) -> dict:
+        """Get the total wall-clock and CPU time for each span path, in seconds."""
+        metrics = {}
+        for span in self.spans:
+            wall_key, cpu_key = f"time/{span.path}", f"cpu_time/{span.path}"
+            metrics[wall_key] = metrics.get(wall_key, 0) + span.wall_time
+            metrics[cpu_key] = metrics.get(cpu_key, 0) + span.cpu_time
+        return metrics
+
+    def save(self, path: str) -> str:
+        """
+        Save the spans as a trace file.
+
+        The file uses the Chrome trace event format, and can be opened using chrome://tracing or Perfetto.
+        Span durations and CPU times are included as event arguments.
+
+        Parameters
+        --------------
+        path: str
+            The trace file path.
+
+        Returns
+        ---------
+        path: str
+            The trace file path.
+        """
+        events = []
+        for span in sorted(self.spans, key = lambda span: span.start):
+            events.append({ "name": span.name, "ph": "X", "pid": os.getpid(), "tid": 0,
+                "ts": span.start * 1e6, "dur": span.wall_time * 1e6, "args": asdict(span) })
+
+        with open(path, "w") as f:
+            json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f, indent = 2)
+        return path
+
+# The tracer for the current pipeline run
+_TRACER = Tracer()
+
+def get_tracer() -> Tracer:
+    """Get the tracer for the current pipeline run."""
+    return _TRACER
+
+def start_tracing(config: Config) -> Tracer:
+    """
+    Start a new tracer for a pipeline run.
+
+    Parameters
+    --------------
+    config: Config
+        The pipeline configuration object.
+
+    Returns
+    ---------
+    tracer: Tracer
+        The tracer.
+    """
+    global _TRACER
+    _TRACER = Tracer(config.get("profile_stage", False), config.get("profiler", False) or "cprofile",
+        config.get("profile_interval", False) or 0.01, config.get("trace_dir", False) or ".")
+    return _TRACER
+
+def span(name: str):
+    """
+    Record a timing span for a pipeline stage.
+
+    Usage:
+        with span("setup"):
+            setup(...)
+    """
+    return _TRACER.span(name)
+
+def timed(name: str = None) -> Callable:
+    """Decorator to record a timing span for each function call, named after the function by default."""
+    def decorator(func: Callable) -> Callable:
+        span_name = name if name is not None else func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_pipeline(project_name: str, config: Config) -> Callable:
+    """
+    Decorator to trace a pipeline main function.
+
+    The whole pipeline is recorded as a root span named after the project. On exit, the spans are
+    saved as a trace file within the trace_dir directory. Runtime metrics are exported to Prometheus
+    for the duration of the pipeline if a metrics_exporter is configured. If a resource_interval is
+    configured, the peak RSS and CPU utilisation of each stage are sampled, and a recommended resource
+    profile is printed and saved alongside the trace file.
+    """
+    def decorator(main: Callable) -> Callable:
+        @functools.wraps(main)
+        def wrapper(*args, **kwargs):
+            tracer = start_tracing(config)
+            sampler = start_sampling(config)
+            if sampler is not None:
+                tracer.listeners.append(sampler)
+            monitor = start_monitoring(project_name, config)
+            if monitor is not None:
+                tracer.listeners.append(monitor.metrics)
+            try:
+                with tracer.span(project_name):
+                    return main(*args, **kwargs)
+            finally:
+                stop_monitoring()
+                stop_sampling()
+                trace_dir = config.get("trace_dir", False)
+                current_time = time.strftime("%Y-%m-%d-%H_%M_%S", time.gmtime())
+                if trace_dir is not None:
+                    os.makedirs(trace_dir, exist_ok = True)
+                    tracer.save(join_path(trace_dir, f"{project_name}_{current_time}.json"))
+                if sampler is not None:
+                    print_recommendation(sampler.recommend())
+                    if trace_dir is not None:
+                        sampler.save(join_path(trace_dir, f"{project_name}_{current_time}_resources.json"))
+        return wrapper
+    return decorator
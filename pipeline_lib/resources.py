@@ -0,0 +1,313 @@
+"""
+Machine Learning Pipeline Resources
+
+A library for sampling the memory and CPU usage of pipeline stages, and recommending Slurm resource profiles.
+"""
+
+##########################################################################################################
+### Imports
+##########################################################################################################
+
+# External
+import json
+import math
+import os
+import threading
+import time
+
+from dataclasses import asdict, dataclass
+from typing import Dict, Tuple
+
+##########################################################################################################
+### Library
+##########################################################################################################
+
+PROC_DIR = "/proc"
+MB = 1024 ** 2
+# Stages shorter than this, in seconds, are too short to estimate CPU utilisation
+MIN_STAGE_TIME = 1.0
+
+def _read_proc_stat(pid: str) -> Tuple[int, float, int]:
+    """Read the parent process ID, CPU time in seconds, and RSS in bytes of a process."""
+    with open(os.path.join(PROC_DIR, pid, "stat")) as f:
+        # The process name may contain spaces, and is enclosed in parentheses
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return int(fields[1]), cpu_time, int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+
+def _read_proc_children(pid: str) -> list:
+    """Read the child process IDs of each thread of a process."""
+    task_dir = os.path.join(PROC_DIR, pid, "task")
+    children = []
+    for tid in os.listdir(task_dir):
+        with open(os.path.join(task_dir, tid, "children")) as f:
+            children.extend(f.read().split())
+    return children
+
+def _walk_process_tree(pid: str) -> Tuple[float, int]:
+    """Sum the CPU time and RSS of a process tree, reading only the processes within the tree."""
+    cpu_time, total_rss = 0, 0
+    pids = [pid]
+    while len(pids) > 0:
+        pid = pids.pop()
+        try:
+            _, process_cpu_time, rss = _read_proc_stat(pid)
+            pids.extend(_read_proc_children(pid))
+        except (OSError, IndexError, ValueError):
+            # The process has exited
+            continue
+        cpu_time += process_cpu_time
+        total_rss += rss
+    return cpu_time, total_rss
+
+def _scan_process_tree(pid: str) -> Tuple[float, int]:
+    """Sum the CPU time and RSS of a process tree, reading every process to find the children of each process."""
+    usage, children = {}, {}
+    for process in os.listdir(PROC_DIR):
+        if not process.isdigit():
+            continue
+        try:
+            ppid, process_cpu_time, rss = _read_proc_stat(process)
+        except (OSError, IndexError, ValueError):
+            # The process has exited
+            continue
+        usage[process] = (process_cpu_time, rss)
+        children.setdefault(str(ppid), []).append(process)
+
+    cpu_time, total_rss = 0, 0
+    pids = [pid]
+    while len(pids) > 0:
+        pid = pids.pop()
+        process_cpu_time, rss = usage.get(pid, (0, 0))
+        cpu_time += process_cpu_time
+        total_rss += rss
+        pids.extend(children.get(pid, []))
+    return cpu_time, total_rss
+
+def get_process_usage() -> Tuple[float, int]:
+    """
+    Get the CPU time and RSS of the current process and its child processes, such as joblib workers.
+
+    Process trees are read from /proc where available. The tree is walked using the child process lists of
+    /proc/<pid>/task/<tid>/children, or by scanning every process on kernels without them. Otherwise, only the 
+    current process and any terminated child processes are included, and the RSS is the peak RSS of the current 
+    process.
+
+    Returns
+    ---------
+    cpu_time: float
+        The CPU time in seconds.
+    rss: int
+        The resident set size in bytes.
+    """
+    times = os.times()
+    # Terminated child processes are not included in the process tree
+    cpu_time = times.children_user + times.children_system
+    if not os.path.isfile(os.path.join(PROC_DIR, "self", "stat")):
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+        return cpu_time + times.user + times.system, max_rss if max_rss > 1 << 32 else max_rss * 1024
+
+    pid = str(os.getpid())
+    if os.path.isfile(os.path.join(PROC_DIR, pid, "task", pid, "children")):
+        tree_cpu_time, rss = _walk_process_tree(pid)
+    else:
+        tree_cpu_time, rss = _scan_process_tree(pid)
+    return cpu_time + tree_cpu_time, rss
+
+@dataclass
+class StageResources:
+    """The resource usage of a pipeline stage."""
+    path: str
+    wall_time: float
+    cpu_time: float
+    peak_rss_mb: float
+
+    @property
+    def cpu_util(self) -> float:
+        """The mean number of CPU cores in use."""
+        return self.cpu_time / self.wall_time if self.wall_time > 0 else 0
+
+class ResourceSampler:
+    """
+    Sample the peak RSS and CPU utilisation of pipeline stages, including child processes.
+
+    A background thread samples the memory usage of the process tree at a fixed interval. Stages are
+    tracked by listening to the spans of the pipeline tracer, and repeated stages are combined.
+    """
+    def __init__(self, interval: float = 0.5, headroom: float = 1.25) -> None:
+        self.interval = interval
+        self.headroom = headroom
+        self.stages: Dict[str, StageResources] = {}
+        self.active: Dict[str, list] = {}
+        self.start_time = time.perf_counter()
+        self.start_cpu_time, self.peak_rss = get_process_usage()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.update()
+
+    def update(self) -> int:
+        """Sample the current RSS in bytes, and update the peak RSS of all active stages."""
+        _, rss = get_process_usage()
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            for stage in self.active.values():
+                stage[2] = max(stage[2], rss)
+        return rss
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target = self._sample, daemon = True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def on_span_start(self, path: str) -> None:
+        cpu_time, rss = get_process_usage()
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            self.active[path] = [time.perf_counter(), cpu_time, rss]
+
+    def on_span_end(self, span) -> None:
+        # Include a final sample, so that short stages are measured at least once
+        self.update()
+        cpu_time, _ = get_process_usage()
+        with self.lock:
+            start_time, start_cpu_time, peak_rss = self.active.pop(span.path)
+            stage = StageResources(span.path, time.perf_counter() - start_time, cpu_time - start_cpu_time, peak_rss / MB)
+            previous = self.stages.get(span.path)
+            if previous is not None:
+                stage = StageResources(span.path, previous.wall_time + stage.wall_time, previous.cpu_time + stage.cpu_time,
+                    max(previous.peak_rss_mb, stage.peak_rss_mb))
+            self.stages[span.path] = stage
+
+    def get_metrics(self) -> dict:
+        """Get the peak RSS in megabytes and mean CPU utilisation in cores for each stage path."""
+        metrics = {}
+        with self.lock:
+            stages = list(self.stages.values())
+        for stage in stages:
+            metrics[f"peak_rss_mb/{stage.path}"] = stage.peak_rss_mb
+            metrics[f"cpu_util/{stage.path}"] = stage.cpu_util
+        return metrics
+
+    def recommend(self) -> dict:
+        """
+        Recommend a Slurm resource profile for the next submission of the pipeline.
+
+        The CPUs per task cover the busiest stage, and the memory per CPU and time limit cover the peak RSS
+        and elapsed time of the pipeline so far. The memory and time include the configured headroom.
+
+        Returns
+        ---------
+        recommendation: dict
+            The recommended resource profile, and the sbatch directives to apply it.
+        """
+        with self.lock:
+            stages = list(self.stages.values())
+            peak_rss = self.peak_rss
+        wall_time = time.perf_counter() - self.start_time
+        cpu_time, _ = get_process_usage()
+        cpu_util = (cpu_time - self.start_cpu_time) / wall_time if wall_time > 0 else 0
+
+        timed_stages = [ stage for stage in stages if stage.wall_time >= MIN_STAGE_TIME ]
+        busiest_stage = max(timed_stages, key = lambda stage: stage.cpu_util, default = None)
+        if busiest_stage is not None:
+            cpu_util = max(cpu_util, busiest_stage.cpu_util)
+        cpus_per_task = min(max(1, math.ceil(round(cpu_util, 1))), os.cpu_count() or 1)
+        memory_stage = max(stages, key = lambda stage: (stage.peak_rss_mb, len(stage.path)), default = None)
+
+        # Round memory up to the nearest 100MB, and time up to the nearest minute
+        mem_per_cpu = max(100, math.ceil(peak_rss * self.headroom / MB / cpus_per_task / 100) * 100)
+        minutes = max(1, math.ceil(wall_time * self.headroom / 60))
+        days, hours, minutes = minutes // 1440, minutes // 60 % 24, minutes % 60
+        time_limit = f"{hours:02d}:{minutes:02d}:00" if days == 0 else f"{days}-{hours:02d}:{minutes:02d}:00"
+
+        return {
+            "cpus_per_task": cpus_per_task,
+            "mem_per_cpu": f"{mem_per_cpu}MB",
+            "time": time_limit,
+            "peak_rss_mb": peak_rss / MB,
+            "peak_rss_stage": memory_stage.path if memory_stage is not None else None,
+            "cpu_util": cpu_util,
+            "cpu_util_stage": busiest_stage.path if busiest_stage is not None else None,
+            "wall_time": wall_time,
+            "headroom": self.headroom,
+            "sbatch": [
+                f"#SBATCH --cpus-per-task={cpus_per_task}",
+                f"#SBATCH --mem-per-cpu={mem_per_cpu}MB",
+                f"#SBATCH --time={time_limit}"
+            ]
+        }
+
+    def get_report(self) -> dict:
+        """Get the resource usage of each stage, and the recommended resource profile."""
+        with self.lock:
+            stages = [ { **asdict(stage), "cpu_util": stage.cpu_util } for stage in self.stages.values() ]
+        return { "stages": stages, "recommendation": self.recommend() }
+
+    def save(self, path: str) -> str:
+        """Save the resource report as a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.get_report(), f, indent = 2)
+        return path
+
+def print_recommendation(recommendation: dict) -> None:
+    """Print a recommended resource profile."""
+    peak_rss_stage, cpu_util_stage = recommendation["peak_rss_stage"], recommendation["cpu_util_stage"]
+    peak_rss = f"Peak RSS: {recommendation['peak_rss_mb']:.0f}MB"
+    if peak_rss_stage is not None:
+        peak_rss += f" ({peak_rss_stage})"
+    cpu_util = f"CPU utilisation: {recommendation['cpu_util']:.2f} cores"
+    if cpu_util_stage is not None:
+        cpu_util += f" ({cpu_util_stage})"
+    print(f"{peak_rss}, {cpu_util}")
+    print("Recommended resources for the next submission:")
+    for directive in recommendation["sbatch"]:
+        print(directive)
+
+# The resource sampler for the current pipeline run
+_SAMPLER: ResourceSampler = None
+
+def get_sampler() -> ResourceSampler:
+    """Get the resource sampler for the current pipeline run, or None if resources are not sampled."""
+    return _SAMPLER
+
+def start_sampling(config) -> ResourceSampler:
+    """
+    Start sampling resource usage for a pipeline run, if a resource_interval is configured.
+
+    Parameters
+    --------------
+    config: Config
+        The pipeline configuration object.
+
+    Returns
+    ---------
+    sampler: ResourceSampler
+        The resource sampler, or None if resources are not sampled.
+    """
+    global _SAMPLER
+    interval = config.get("resource_interval", False)
+    if interval is None:
+        return None
+
+    _SAMPLER = ResourceSampler(interval, config.get("resource_headroom", False) or 1.25)
+    _SAMPLER.start()
+    return _SAMPLER
+
+def stop_sampling() -> ResourceSampler:
+    """Stop sampling resource usage for the current pipeline run, returning the sampler."""
+    global _SAMPLER
+    sampler = _SAMPLER
+    if sampler is not None:
+        sampler.stop()
+        _SAMPLER = None
+    return sampler
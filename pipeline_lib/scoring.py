@@ -0,0 +1,158 @@
+"""
+Machine Learning Pipeline Scoring
+
+A library for batch inference using persisted prediction pipelines within the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+import numpy as np
+import pandas as pd
+import time
+
+from typing import List
+
+# Internal
+from pipeline_lib.distributed import get_n_workers, parallel_map
+from pipeline_lib.monitoring import record_scoring
+
+##########################################################################################################
+### Library  
+##########################################################################################################
+
+# The model loaded by each worker process
+_WORKER_MODEL = None
+
+def _init_worker(model) -> None:
+    """Store the model once per worker process."""
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+def is_prediction_pipeline(model) -> bool:
+    """Whether a model is a prediction pipeline that includes the preprocessing steps of its setup (see get_prediction_pipeline)."""
+    return "dtypes" in getattr(model, "named_steps", {})
+
+def _get_label_replacement(model) -> dict:
+    """Get the mapping from encoded class labels to their original values, from the data types step of a prediction pipeline."""
+    dtypes = getattr(model, "named_steps", {}).get("dtypes")
+    replacement = getattr(dtypes, "replacement", None)
+    if not replacement:
+        return {}
+    return { int(v): k for k, v in replacement.items() }
+
+def _predict(model, batch: pd.DataFrame, score: bool) -> tuple:
+    """
+    Predict labels, and optionally scores, for a single batch.
+
+    Predictions are decoded in the same way as PyCaret's predict_model. Missing predictions are replaced, the
+    probability threshold of a final classifier is applied, and encoded class labels are mapped back to their
+    original values.
+    """
+    from sklearn.base import is_classifier
+    estimator = model.steps[-1][1] if hasattr(model, "steps") else model
+    classification = is_classifier(estimator)
+    labels = model.predict(batch)
+    if np.issubdtype(labels.dtype, np.number):
+        labels = np.nan_to_num(labels)
+    if not classification:
+        return labels, None
+
+    threshold = getattr(estimator, "probability_threshold", None)
+    probabilities = None
+    if (score or threshold is not None) and hasattr(model, "predict_proba"):
+        probabilities = model.predict_proba(batch)
+        if threshold is not None and probabilities.shape[1] == 2:
+            labels = (probabilities[:, 1] >= threshold).astype(int)
+
+    try:
+        labels = labels.astype(int)
+    except (TypeError, ValueError):
+        # Labels that were not encoded by setup
+        pass
+
+    scores = None
+    if score and probabilities is not None:
+        if np.issubdtype(labels.dtype, np.integer):
+            scores = np.round(probabilities[np.arange(len(labels)), labels], 4)
+        else:
+            scores = np.round(probabilities.max(axis = 1), 4)
+
+    replacement = _get_label_replacement(model)
+    if len(replacement) > 0:
+        labels = pd.Series(labels).replace(replacement).to_numpy()
+    return labels, scores
+
+def _predict_worker(task: tuple) -> tuple:
+    batch, score = task
+    return _predict(_WORKER_MODEL, batch, score)
+
+def get_batches(df: pd.DataFrame, batch_size: int) -> List[pd.DataFrame]:
+    """
+    Split a dataframe into fixed-size batches.
+
+    Parameters
+    --------------
+    df: DataFrame
+        The dataframe.
+    batch_size: int
+        The maximum number of rows per batch.
+
+    Returns
+    ---------
+    batches: List[DataFrame]
+        The dataframe batches.
+    """
+    if batch_size is None or batch_size <= 0:
+        batch_size = max(len(df), 1)
+    return [ df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size) ]
+
+def score_batches(model, df: pd.DataFrame, batch_size: int = None, n_workers: int = 1, label: str = "Label",
+    score: bool = False) -> pd.DataFrame:
+    """
+    Score a dataframe in fixed-size batches using a persisted prediction pipeline.
+
+    The model must include its own preprocessing steps, so no estimator setup is required. Class labels are
+    decoded using the data types step of the pipeline, as in PyCaret's predict_model.
+    When more than one worker is requested, the model is sent once to each worker process.
+
+    Parameters
+    --------------
+    model: BaseEstimator
+        The fitted prediction pipeline.
+    df: DataFrame
+        The dataframe to score.
+    batch_size: int
+        The maximum number of rows per batch. Defaults to a single batch.
+    n_workers: int
+        The number of worker processes. -1 uses all available cores.
+    label: str
+        The name of the prediction column.
+    score: bool
+        Whether to add a "Score" column of class probabilities for classifiers.
+
+    Returns
+    ---------
+    predictions: DataFrame
+        The input dataframe with the prediction columns appended.
+    """
+    start = time.perf_counter()
+    batches = get_batches(df, batch_size)
+    if get_n_workers(n_workers) > 1 and len(batches) > 1:
+        tasks = [ (batch, score) for batch in batches ]
+        results = parallel_map(_predict_worker, tasks, n_workers, initializer = _init_worker, initargs = (model,))
+    else:
+        results = [ _predict(model, batch, score) for batch in batches ]
+
+    record_scoring(len(df), time.perf_counter() - start)
+    predictions = df.copy()
+    if len(results) == 0:
+        predictions[label] = pd.Series(dtype = "float64")
+        return predictions
+
+    predictions[label] = np.concatenate([ labels for labels, _ in results ])
+    if results[0][1] is not None:
+        predictions["Score"] = np.concatenate([ scores for _, scores in results ])
+    return predictions
@@ -0,0 +1,345 @@
+"""
+Machine Learning Pipeline Screening
+
+A library for screening and racing candidate models, to avoid fully evaluating weak models within the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports
+##########################################################################################################
+
+# External
+import math
+import numpy as np
+
+# Internal
+from pipeline_lib.config import Config
+from pipeline_lib.monitoring import record
+
+##########################################################################################################
+### Library
+##########################################################################################################
+
+# PyCaret metrics, mapped to scikit-learn scorers that rank models in the same order
+REGRESSION_SCORERS = {
+    "MAE": "neg_mean_absolute_error",
+    "MSE": "neg_mean_squared_error",
+    "RMSE": "neg_root_mean_squared_error",
+    "R2": "r2",
+    "RMSLE": "neg_mean_squared_log_error"
+}
+CLASSIFICATION_SCORERS = {
+    "Accuracy": "accuracy",
+    "AUC": "roc_auc_ovr",
+    "Recall": "recall",
+    "Prec.": "precision",
+    "F1": "f1",
+    "MCC": "matthews_corrcoef"
+}
+
+def _mean_absolute_percentage_error(y_true, y_pred) -> float:
+    """The mean absolute percentage error, excluding zero targets as in PyCaret."""
+    y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+    mask = y_true != 0
+    return np.mean(np.abs(y_pred[mask] - y_true[mask]) / np.abs(y_true[mask]))
+
+def get_scorer(metric: str, classification: bool, n_classes: int = 2):
+    """
+    Get the scikit-learn scorer for a PyCaret evaluation metric.
+
+    Parameters
+    --------------
+    metric: str
+        The PyCaret metric name.
+    classification: bool
+        Whether the estimator task is classification.
+    n_classes: int
+        The number of classes. Multiclass recall, precision, and F1 are weighted by class, as in PyCaret.
+
+    Returns
+    ---------
+    scorer: str | Callable
+        The scorer.
+    """
+    if not classification:
+        if metric == "MAPE":
+            # Not a built-in scorer before scikit-learn 0.24
+            from sklearn.metrics import make_scorer
+            return make_scorer(_mean_absolute_percentage_error, greater_is_better = False)
+        return REGRESSION_SCORERS.get(metric, "r2")
+
+    if metric == "Kappa":
+        from sklearn.metrics import cohen_kappa_score, make_scorer
+        return make_scorer(cohen_kappa_score)
+    scorer = CLASSIFICATION_SCORERS.get(metric, "accuracy")
+    if n_classes > 2 and scorer in ["recall", "precision", "f1"]:
+        return f"{scorer}_weighted"
+    return scorer
+
+def subsample(X, y, groups, n_rows: int, stratify: bool, random_state: int = None) -> np.ndarray:
+    """
+    Draw a subsample of the training data, keeping whole groups together or preserving the class balance.
+
+    Parameters
+    --------------
+    X: DataFrame
+        The training features.
+    y: Series
+        The training target.
+    groups: array
+        The optional fold groups.
+    n_rows: int
+        The approximate number of rows to sample.
+    stratify: bool
+        Whether to preserve the class balance of the target.
+    random_state: int
+        The random seed.
+
+    Returns
+    ---------
+    indices: array
+        The row positions of the subsample.
+    """
+    from sklearn.model_selection import GroupShuffleSplit, train_test_split
+    indices = np.arange(len(X))
+    if n_rows >= len(X):
+        return indices
+    if groups is not None:
+        splitter = GroupShuffleSplit(n_splits = 1, train_size = n_rows / len(X), random_state = random_state)
+        return next(splitter.split(X, y, groups))[0]
+
+    try:
+        sample, _ = train_test_split(indices, train_size = n_rows, random_state = random_state,
+            stratify = y if stratify else None)
+    except ValueError:
+        # Classes with a single member cannot be stratified
+        sample, _ = train_test_split(indices, train_size = n_rows, random_state = random_state)
+    return np.sort(sample)
+
+def _get_cv(fold: int, groups, stratify: bool, random_state: int = None):
+    from sklearn.model_selection import GroupKFold, KFold, StratifiedKFold
+    if groups is not None:
+        return GroupKFold(n_splits = min(fold, len(np.unique(groups))))
+    if stratify:
+        return StratifiedKFold(n_splits = fold, shuffle = True, random_state = random_state)
+    return KFold(n_splits = fold, shuffle = True, random_state = random_state)
+
+def get_candidates(estimator, include: list = None, turbo: bool = True) -> dict:
+    """
+    Get unfitted instances of the candidate models of the current setup session.
+
+    Parameters
+    --------------
+    estimator: PyCaretEstimatorBase
+        The estimator.
+    include: list
+        The model IDs to include. All models are included if empty.
+    turbo: bool
+        Whether to exclude slow models when all models are included, as in compare_models.
+
+    Returns
+    ---------
+    candidates: dict
+        The model instances, keyed by model ID.
+    """
+    table = estimator.models(internal = True)
+    if include is not None and len(include) > 0:
+        ids = [ model_id for model_id in include if model_id in table.index ]
+    else:
+        ids = [
+            model_id for model_id, row in table.iterrows()
+            if not row.get("Special", False) and (not turbo or row.get("Turbo", True))
+        ]
+    return { model_id: table.loc[model_id, "Class"](**table.loc[model_id, "Args"]) for model_id in ids }
+
+def _resolve_candidates(estimator, config: Config, include: list = None):
+    """Get the candidate instances keyed by model ID or position, the included models by key, and any unknown models."""
+    include = include or []
+    model_ids = [ model for model in include if type(model) is str ]
+    candidates = {}
+    if len(model_ids) > 0 or len(include) == 0:
+        candidates = get_candidates(estimator, model_ids, config.get("turbo"))
+    if len(include) == 0:
+        include = list(candidates.keys())
+    # Model instances are keyed by their position
+    candidates.update({ i: model for i, model in enumerate(include) if type(model) is not str })
+    keys = { i if type(model) is not str else model: model for i, model in enumerate(include) }
+    # Unknown model IDs are left for compare_models to report
+    unknown = [ keys[key] for key in keys if key not in candidates ]
+    return candidates, keys, unknown
+
+def _get_training_data(estimator):
+    """Get the transformed training data and fold groups of the current setup session."""
+    X = estimator.get_config("X_train")
+    y = estimator.get_config("y_train")
+    groups = estimator.get_config("fold_groups_param")
+    if groups is None or np.ndim(groups) == 0 or len(groups) != len(X):
+        return X, y, None
+    return X, y, np.asarray(groups)
+
+def _get_names(keys: dict, model_keys: list) -> list:
+    return [ key if type(key) is str else type(keys[key]).__name__ for key in model_keys ]
+
+def _mean_score(scores: list) -> float:
+    """The mean of the successful fold scores, or -inf if every fold failed."""
+    scores = np.array(scores, dtype = float)
+    return -np.inf if np.all(np.isnan(scores)) else np.nanmean(scores)
+
+def screen_models(estimator, config: Config, include: list = None) -> list:
+    """
+    Screen candidate models on progressively larger subsamples of the training data, using successive halving.
+
+    All candidates are first cross-validated on screening_min_samples rows. After each round, the best
+    1 / screening_factor of the candidates are kept, and the sample size is multiplied by screening_factor.
+    Screening stops once screening_finalists candidates remain, or the next sample would cover the full training
+    set. Samples keep fold groups together, and preserve the class balance for classification.
+
+    Parameters
+    --------------
+    estimator: PyCaretEstimatorBase
+        The estimator, with a completed setup session.
+    config: Config
+        The pipeline configuration object.
+    include: list
+        The model IDs or unfitted model instances to screen. All PyCaret models are screened if empty.
+
+    Returns
+    ---------
+    finalists: list
+        The finalist model IDs or instances, ordered by their screening score.
+    """
+    from sklearn.base import clone
+    from sklearn.model_selection import cross_val_score
+
+    candidates, keys, unscreened = _resolve_candidates(estimator, config, include)
+    X, y, groups = _get_training_data(estimator)
+    classification = config.get("est_task") == "classification"
+    scorer = get_scorer(config.get("evaluation_metric"), classification, len(np.unique(y)) if classification else 2)
+    random_state = config.get("random_seed")
+    factor = config.get("screening_factor")
+    finalists = config.get("screening_finalists") or config.get("n_select")
+    n_rows = config.get("screening_min_samples")
+
+    model_ids = [ key for key in keys if key in candidates ]
+    while len(model_ids) > finalists and n_rows < len(X):
+        sample = subsample(X, y, groups, n_rows, classification, random_state)
+        X_sample, y_sample = X.iloc[sample], y.iloc[sample]
+        groups_sample = groups[sample] if groups is not None else None
+        cv = _get_cv(config.get("screening_fold"), groups_sample, classification, random_state)
+
+        scores = {}
+        for model_id in model_ids:
+            fold_scores = cross_val_score(clone(candidates[model_id]), X_sample, y_sample, groups = groups_sample,
+                scoring = scorer, cv = cv, n_jobs = config.get("n_jobs"), error_score = np.nan)
+            # Models that fail on every fold are ranked last
+            scores[model_id] = _mean_score(fold_scores)
+        record("models_evaluated", len(model_ids))
+
+        n_keep = max(finalists, math.ceil(len(model_ids) / factor))
+        model_ids = sorted(model_ids, key = lambda model_id: scores[model_id], reverse = True)[:n_keep]
+        print(f"Screened {len(scores)} models on {len(sample)} rows, keeping {_get_names(keys, model_ids)}")
+        n_rows = int(n_rows * factor)
+
+    return [ keys[key] for key in model_ids ] + unscreened
+
+def _fit_and_score(model, X, y, train: np.ndarray, test: np.ndarray, scorer) -> float:
+    from sklearn.base import clone
+    from sklearn.metrics import check_scoring
+    try:
+        model = clone(model).fit(X.iloc[train], y.iloc[train])
+        return check_scoring(model, scoring = scorer)(model, X.iloc[test], y.iloc[test])
+    except Exception:
+        return np.nan
+
+def is_dominated(scores: np.ndarray, leader_scores: np.ndarray, alpha: float = 0.05) -> bool:
+    """
+    Whether a model is significantly worse than a leading model, using a one-sided paired t-test of their fold scores.
+
+    Parameters
+    --------------
+    scores: array
+        The fold scores of the model, where higher is better. Failed folds are NaN.
+    leader_scores: array
+        The scores of the leading model on the same folds.
+    alpha: float
+        The significance level.
+
+    Returns
+    ---------
+    dominated: bool
+        Whether the model is dominated.
+    """
+    # Failed folds are ranked last
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+    leader_scores = np.where(np.isnan(leader_scores), -np.inf, leader_scores)
+    differences = scores - leader_scores
+    if not np.all(np.isfinite(differences)) or np.all(differences == differences[0]):
+        # Failed folds and constant differences cannot be tested, so the model must be worse on every fold
+        return bool(np.all(scores < leader_scores))
+
+    # The one-sided p-value, as the alternative argument requires scipy 1.6
+    from scipy.stats import ttest_rel
+    statistic, pvalue = ttest_rel(scores, leader_scores)
+    pvalue = pvalue / 2 if statistic < 0 else 1 - pvalue / 2
+    return pvalue < alpha
+
+def race_models(estimator, config: Config, include: list = None) -> list:
+    """
+    Race candidate models across the cross-validation folds of the setup session, dropping hopeless candidates early.
+
+    Every remaining candidate is evaluated on one fold at a time, using the same folds as compare_models. From 
+    racing_min_folds onwards, a candidate is dropped if it is dominated by the weakest of the current top n_select 
+    candidates (see is_dominated), so slow estimators stop once their first folds are clearly worse. Racing stops 
+    once n_select candidates remain, or after racing_max_folds folds, as the survivors are cross-validated again 
+    by compare_models. Passing the survivors to compare_models gives the same top n_select as the full evaluation, 
+    unless a dropped candidate would have recovered.
+
+    Parameters
+    --------------
+    estimator: PyCaretEstimatorBase
+        The estimator, with a completed setup session.
+    config: Config
+        The pipeline configuration object.
+    include: list
+        The model IDs or unfitted model instances to race. All PyCaret models are raced if empty.
+
+    Returns
+    ---------
+    survivors: list
+        The surviving model IDs or instances, ordered by their mean fold score.
+    """
+    from joblib import Parallel, delayed
+
+    candidates, keys, unknown = _resolve_candidates(estimator, config, include)
+    X, y, groups = _get_training_data(estimator)
+    classification = config.get("est_task") == "classification"
+    scorer = get_scorer(config.get("evaluation_metric"), classification, len(np.unique(y)) if classification else 2)
+    n_select = config.get("n_select")
+    min_folds = config.get("racing_min_folds")
+    alpha = config.get("racing_alpha")
+    max_folds = config.get("racing_max_folds")
+
+    model_keys = [ key for key in keys if key in candidates ]
+    scores = { key: [] for key in model_keys }
+    folds = estimator.get_config("fold_generator").split(X, y, groups)
+    n_folds = 0
+    with Parallel(n_jobs = config.get("n_jobs")) as parallel:
+        for train, test in folds:
+            if len(model_keys) <= n_select or (max_folds is not None and n_folds >= max_folds):
+                break
+            fold_scores = parallel(delayed(_fit_and_score)(candidates[key], X, y, train, test, scorer) for key in model_keys)
+            for key, score in zip(model_keys, fold_scores):
+                scores[key].append(score)
+            record("models_evaluated", len(model_keys))
+            n_folds += 1
+
+            model_keys = sorted(model_keys, key = lambda key: _mean_score(scores[key]), reverse = True)
+            if n_folds < min_folds:
+                continue
+            leader_scores = np.array(scores[model_keys[n_select - 1]])
+            dropped = [ key for key in model_keys[n_select:] if is_dominated(np.array(scores[key]), leader_scores, alpha) ]
+            if len(dropped) > 0:
+                print(f"Dropped {_get_names(keys, dropped)} after {n_folds} folds")
+            model_keys = [ key for key in model_keys if key not in dropped ]
+
+    return [ keys[key] for key in model_keys ] + unknown
@@ -0,0 +1,360 @@
+"""
+Machine Learning Pipeline Serving
+
+A library for serving predictions from a long-running process within the machine learning pipeline.
+"""
+
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+import abc
+import io
+import json
+import os
+import pandas as pd
+import threading
+import time
+import yaml
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from joblib import dump, load
+from typing import Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Internal
+from pipeline_lib.data import join_path
+from pipeline_lib.monitoring import get_monitor, PROMETHEUS_CONTENT_TYPE
+from pipeline_lib.scoring import score_batches
+
+##########################################################################################################
+### Library  
+##########################################################################################################
+
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+JSON_CONTENT_TYPE = "application/json"
+
+##########################################################################################################
+### Model Stores  
+##########################################################################################################
+
+class ModelStoreBase(metaclass = abc.ABCMeta):
+    """Abstract base class for model stores."""
+    @abc.abstractmethod
+    def resolve(self, model_name: str, model_version: str = None, model_stage: str = None) -> str:
+        """Resolve a model version, stage, or the latest version to a concrete version."""
+        return
+
+    @abc.abstractmethod
+    def load(self, model_name: str, model_version: str):
+        """Load a concrete model version."""
+        return
+
+class MlflowModelStore(ModelStoreBase):
+    """Model store backed by the MLFlow model registry."""
+    def __init__(self, tracking_uri: str = None) -> None:
+        import mlflow
+        if tracking_uri is not None:
+            mlflow.set_tracking_uri(tracking_uri)
+        self.client = mlflow.tracking.MlflowClient()
+
+    def resolve(self, model_name: str, model_version: str = None, model_stage: str = None) -> str:
+        if model_version:
+            return str(model_version)
+
+        stages = [model_stage] if model_stage else None
+        versions = self.client.get_latest_versions(model_name, stages = stages)
+        if len(versions) == 0:
+            raise Exception(f"Model not found error: {model_name}")
+        return str(max(int(version.version) for version in versions))
+
+    def load(self, model_name: str, model_version: str):
+        import mlflow
+        return mlflow.sklearn.load_model(model_uri = f"models:/{model_name}/{model_version}")
+
+class LocalModelStore(ModelStoreBase):
+    """
+    Model store backed by a local directory.
+
+    Models are saved as {model_dir}/{model_name}/{model_version}/model.joblib. Stages are mapped to
+    versions within an optional {model_dir}/{model_name}/stages.yaml file.
+    """
+    def __init__(self, model_dir: str) -> None:
+        self.model_dir = model_dir
+
+    def _versions(self, model_name: str) -> list:
+        model_path = join_path(self.model_dir, model_name)
+        if not os.path.isdir(model_path):
+            return []
+        return sorted(int(version) for version in os.listdir(model_path) if version.isdigit())
+
+    def resolve(self, model_name: str, model_version: str = None, model_stage: str = None) -> str:
+        if model_version:
+            return str(model_version)
+
+        if model_stage:
+            stages_file = join_path(join_path(self.model_dir, model_name), "stages.yaml")
+            if os.path.isfile(stages_file):
+                with open(stages_file) as f:
+                    stages: dict = yaml.safe_load(f) or {}
+                if model_stage in stages:
+                    return str(stages[model_stage])
+            raise Exception(f"Model stage not found error: {model_name}/{model_stage}")
+
+        versions = self._versions(model_name)
+        if len(versions) == 0:
+            raise Exception(f"Model not found error: {model_name}")
+        return str(versions[-1])
+
+    def load(self, model_name: str, model_version: str):
+        return load(join_path(self.get_version_dir(model_name, model_version), "model.joblib"))
+
+    def get_version_dir(self, model_name: str, model_version: str) -> str:
+        return join_path(join_path(self.model_dir, model_name), str(model_version))
+
+    def save(self, model, model_name: str, model_stage: str = None) -> str:
+        """Save a model as a new version, and optionally assign it to a stage."""
+        versions = self._versions(model_name)
+        model_version = str(versions[-1] + 1 if len(versions) > 0 else 1)
+        version_dir = self.get_version_dir(model_name, model_version)
+        os.makedirs(version_dir, exist_ok = True)
+        dump(model, join_path(version_dir, "model.joblib"))
+
+        if model_stage:
+            stages_file = join_path(join_path(self.model_dir, model_name), "stages.yaml")
+            stages = {}
+            if os.path.isfile(stages_file):
+                with open(stages_file) as f:
+                    stages = yaml.safe_load(f) or {}
+            stages[model_stage] = int(model_version)
+            with open(stages_file, "w") as f:
+                yaml.dump(stages, f, default_flow_style = False)
+        return model_version
+
+def get_model_store(config) -> ModelStoreBase:
+    """
+    Get the model store from the configuration.
+
+    Parameters
+    --------------
+    config: Config
+        The configuration object.
+
+    Returns
+    ---------
+    model_store: ModelStoreBase
+        The model store.
+    """
+    if config.get("model_store") == "local":
+        model_dir = join_path(config.get("base_dir", False), config.get("model_store_dir"))
+        return LocalModelStore(model_dir)
+    return MlflowModelStore(config.get("MLFLOW_TRACKING_URI"))
+
+##########################################################################################################
+### Model Cache  
+##########################################################################################################
+
+class ModelCache:
+    """
+    A least-recently-used cache of loaded models.
+
+    Requested versions, stages, and the latest version are resolved to a concrete version using the model store.
+    Resolutions are reused for refresh_interval seconds, so a model is only reloaded once the registry
+    points to a new version. Models are loaded outside of the cache lock, so a slow load does not block
+    requests for other models, and concurrent requests for the same model share a single load.
+    """
+    def __init__(self, model_store: ModelStoreBase, max_size: int = 4, refresh_interval: float = 30) -> None:
+        self.model_store = model_store
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+        self.models = OrderedDict()
+        self.resolved = {}
+        self.loading = {}
+        self.lock = threading.RLock()
+
+    def resolve(self, model_name: str, model_version: str = None, model_stage: str = None) -> str:
+        key = (model_name, model_version, model_stage)
+        now = time.monotonic()
+        with self.lock:
+            resolved = self.resolved.get(key)
+            if resolved is not None and now - resolved[1] < self.refresh_interval:
+                return resolved[0]
+
+        version = self.model_store.resolve(model_name, model_version, model_stage)
+        with self.lock:
+            self.resolved[key] = (version, now)
+        return version
+
+    def get(self, model_name: str, model_version: str = None, model_stage: str = None) -> Tuple[object, str]:
+        """
+        Get a loaded model.
+
+        Parameters
+        --------------
+        model_name: str
+            The model name.
+        model_version: str
+            The optional model version.
+        model_stage: str
+            The optional model stage.
+
+        Returns
+        ---------
+        model: (BaseEstimator, str)
+            The loaded model and its concrete version.
+        """
+        version = self.resolve(model_name, model_version, model_stage)
+        key = (model_name, version)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key], version
+            future = self.loading.get(key)
+            loader = future is None
+            if loader:
+                future = Future()
+                self.loading[key] = future
+
+        if not loader:
+            return future.result(), version
+
+        try:
+            model = self.model_store.load(model_name, version)
+        except Exception as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.models[key] = model
+            while len(self.models) > self.max_size:
+                self.models.popitem(last = False)
+            del self.loading[key]
+        future.set_result(model)
+        return model, version
+
+##########################################################################################################
+### Server  
+##########################################################################################################
+
+def _read_arrow(body: bytes) -> pd.DataFrame:
+    import pyarrow as pa
+    return pa.ipc.open_stream(body).read_pandas()
+
+def _write_arrow(df: pd.DataFrame) -> bytes:
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler for the scoring server.
+
+    POST /predict accepts either a JSON body of the form {"model_name", "model_version", "model_stage", "data"},
+    where data is a list of records, or an Arrow IPC stream body with the model passed as query parameters.
+    """
+    server_version = "MLPipelineScoring"
+
+    def _send(self, status: int, body: bytes, content_type: str = JSON_CONTENT_TYPE) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        self._send(status, json.dumps(payload).encode())
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        monitor = get_monitor()
+        if path == "/health":
+            with self.server.model_cache.lock:
+                models = [ list(k) for k in self.server.model_cache.models.keys() ]
+            self._send_json(200, { "status": "ok", "models": models })
+        elif path == "/metrics" and monitor is not None:
+            self._send(200, monitor.metrics.render().encode(), PROMETHEUS_CONTENT_TYPE)
+        else:
+            self._send_json(404, { "error": "Not found" })
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._send_json(404, { "error": "Not found" })
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            content_type = self.headers.get("Content-Type", JSON_CONTENT_TYPE)
+            if content_type.startswith(ARROW_CONTENT_TYPE):
+                request = { k: v[0] for k, v in parse_qs(url.query).items() }
+                df = _read_arrow(body)
+            else:
+                request = json.loads(body)
+                df = pd.DataFrame.from_records(request.get("data", []))
+
+            if "model_name" in request:
+                model_name, model_version, model_stage = (request["model_name"], request.get("model_version"), 
+                    request.get("model_stage"))
+            else:
+                # The default model version and stage only apply to the default model
+                model_name, model_version, model_stage = (self.server.default_model_name, 
+                    self.server.default_model_version, self.server.default_model_stage)
+            if model_name is None:
+                raise ValueError("A model name must be provided.")
+        except Exception as e:
+            self._send_json(400, { "error": str(e) })
+            return
+
+        start = time.perf_counter()
+        try:
+            model, version = self.server.model_cache.get(model_name, model_version, model_stage)
+        except Exception as e:
+            # Model store and model loading failures are server errors
+            self._send_json(500, { "error": str(e) })
+            return
+
+        try:
+            predictions = score_batches(model, df, self.server.batch_size)
+        except (KeyError, TypeError, ValueError) as e:
+            # The data does not match the model
+            self._send_json(400, { "error": str(e) })
+            return
+        except Exception as e:
+            self._send_json(500, { "error": str(e) })
+            return
+        elapsed = time.perf_counter() - start
+
+        if self.headers.get("Accept", "").startswith(ARROW_CONTENT_TYPE):
+            self._send(200, _write_arrow(predictions[["Label"]]), ARROW_CONTENT_TYPE)
+        else:
+            self._send_json(200, {
+                "model_name": model_name, "model_version": version, "elapsed": elapsed,
+                "predictions": predictions["Label"].tolist()
+            })
+
+class ScoringServer(ThreadingHTTPServer):
+    """A threaded HTTP server that holds a warm model cache between requests."""
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], model_cache: ModelCache, batch_size: int = None,
+        default_model_name: str = None, default_model_version: str = None, default_model_stage: str = None, 
+        verbose: bool = False) -> None:
+        super().__init__(address, ScoringRequestHandler)
+        self.model_cache = model_cache
+        self.batch_size = batch_size
+        self.default_model_name = default_model_name
+        self.default_model_version = default_model_version
+        self.default_model_stage = default_model_stage
+        self.verbose = verbose
@@ -9,7 +9,10 @@ A library of hyperparameter tuning methods for the machine learning pipeline.
 ##########################################################################################################
 
 # External
+import os
 
+from contextlib import contextmanager
+from typing import Iterator
 
 ##########################################################################################################
 ### Library  
@@ -119,10 +122,68 @@ def to_ray_tune_grid(grid_config: dict):
 
     return grid
 
+def get_optuna_distributions() -> dict:
+    from optuna.distributions import (CategoricalDistribution, DiscreteUniformDistribution, IntLogUniformDistribution,
+        IntUniformDistribution, LogUniformDistribution, UniformDistribution)
+
+    def uniform(low: float = None, high: float = None, lower: float = None, upper: float = None, loc: float = None, 
+        scale: float = None):
+        # Accepts the arguments of Optuna, Ray Tune, and scipy distributions
+        if loc is not None:
+            return UniformDistribution(loc, loc + scale)
+        return UniformDistribution(low if low is not None else lower, high if high is not None else upper)
+
+    search_map = {
+        "uniform": uniform,
+        "loguniform": lambda low = None, high = None, lower = None, upper = None: LogUniformDistribution(
+            low if low is not None else lower, high if high is not None else upper),
+        "quniform": lambda low = None, high = None, q = 1, lower = None, upper = None: DiscreteUniformDistribution(
+            low if low is not None else lower, high if high is not None else upper, q),
+        "int": lambda low, high, step = 1: IntUniformDistribution(low, high, step),
+        "logint": lambda low, high: IntLogUniformDistribution(low, high),
+        "choice": lambda categories: CategoricalDistribution(categories)
+    }
+    return search_map
+
+def to_optuna_grid(grid_config: dict) -> dict:
+    """
+    Perform hyperparameter tuning using Optuna.
+
+    Parameter values are searched as categorical distributions.
+
+    Parameters
+    --------------
+    grid_config: dict
+        The custom grid configuration dictionary.
+
+    Returns
+    ---------
+    grid: dict
+        The Optuna grid.
+    """
+    from optuna.distributions import CategoricalDistribution
+    grid = {}
+    distributions = get_optuna_distributions()
+
+    for model, params in grid_config.items():
+        grid[model] = {}
+        for param, values in params.items():
+            if "distribution" in values and "kwargs" in values:
+                distribution_key = values["distribution"]
+                distribution = distributions.get(distribution_key)
+                if distribution is None:
+                    raise Exception(f"Error: Invalid distribution passed to Optuna grid - {distribution_key}")
+                grid[model][param] = distribution(**values["kwargs"])
+            else:
+                grid[model][param] = CategoricalDistribution(values["value"])
+
+    return grid
+
 GRID_TRANSFORMERS = {
     "grid": to_grid_search,
     "random": to_random_search,
-    "tune-sklearn": to_ray_tune_grid
+    "tune-sklearn": to_ray_tune_grid,
+    "optuna": to_optuna_grid
 }
 
 class GridTransformer:
@@ -133,7 +194,10 @@ class GridTransformer:
 
     def transform(self, grid_config: dict) -> dict:
         grid_transformers = self.grid_transformers
-        if self.search_library in grid_transformers:
+        # Optuna searches use Optuna distributions, including through tune-sklearn
+        if self.search_algorithm == "optuna":
+            grid_transformer_func = grid_transformers.get("optuna")
+        elif self.search_library in grid_transformers:
             grid_transformer_func = grid_transformers.get(self.search_library) 
         else:
             grid_transformer_func = grid_transformers.get(self.search_algorithm) 
@@ -142,4 +206,65 @@ class GridTransformer:
             return {}
         else:
             return grid_transformer_func(grid_config)
-        
\ No newline at end of file
+        
+def get_optuna_storage(storage: str, base_dir: str = None) -> str:
+    """
+    Get the storage URL of persistent Optuna studies.
+
+    Parameters
+    --------------
+    storage: str
+        A SQLite file path, or an RDB URL such as sqlite:///data/optuna.db or postgresql://user@host/db.
+    base_dir: str
+        The base directory for relative SQLite paths.
+
+    Returns
+    ---------
+    storage: str
+        The storage URL.
+    """
+    if "://" not in storage:
+        storage = f"sqlite:///{storage}"
+    if storage.startswith("sqlite:///"):
+        path = storage[len("sqlite:///"):]
+        if not os.path.isabs(path) and base_dir is not None:
+            path = os.path.abspath(os.path.join(base_dir, path))
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok = True)
+        storage = f"sqlite:///{path}"
+    return storage
+
+def get_completed_trials(storage: str, study_name: str) -> int:
+    """Get the number of completed trials of a persistent Optuna study, or 0 if the study does not exist."""
+    import optuna
+    from optuna.trial import TrialState
+    try:
+        study = optuna.load_study(study_name = study_name, storage = storage)
+    except KeyError:
+        return 0
+    return len(study.get_trials(deepcopy = False, states = (TrialState.COMPLETE,)))
+
+@contextmanager
+def persistent_study(storage: str, study_name: str) -> Iterator[None]:
+    """
+    Store the Optuna studies created within the enclosed block, resuming from an existing study of the same name.
+
+    Libraries such as PyCaret create their Optuna studies internally, so optuna.create_study is patched for the
+    duration of the block.
+
+    Usage:
+        with persistent_study("sqlite:///optuna.db", "experiment/model"):
+            tune_model(model, search_library = "optuna")
+    """
+    import optuna
+    create_study = optuna.create_study
+    def create_persistent_study(*args, **kwargs):
+        kwargs.update(storage = storage, study_name = study_name, load_if_exists = True)
+        return create_study(*args, **kwargs)
+
+    optuna.create_study = create_persistent_study
+    try:
+        yield
+    finally:
+        optuna.create_study = create_study
@@ -17,6 +17,7 @@ from pipeline_lib.config import add_argument, get_config
 from pipeline_lib.data import Data, join_path
 from pipeline_lib.estimator import EstimatorTask, get_unsupervised_custom_model, unsupervised_setup
 from pipeline_lib.pipelines import end_mlflow, get_experiment_name, init_mlflow, PlotParameters, save_local_results, save_mlflow_results
+from pipeline_lib.profiling import span, trace_pipeline
 
 ##########################################################################################################
 ### Parameters
@@ -55,9 +56,6 @@ else:
 # Random
 RANDOM_STATE = CONFIG.get("random_seed") 
 
-# Distributed
-RUN_DISTRIBUTED = CONFIG.get("run_distributed")
-
 # MLFlow
 USE_MLFLOW = CONFIG.get("use_mlflow")
 
@@ -65,21 +63,23 @@ USE_MLFLOW = CONFIG.get("use_mlflow")
 ### Pipeline
 ##########################################################################################################
 
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
     if USE_MLFLOW:
         tmp_dir = init_mlflow(CONFIG)
 
     # Data split
-    df = DATA.read_csv(FILE_NAME)
-    df = DATA.query(CONFIG, df)
+    with span("load_data"):
+        df = DATA.load(FILE_NAME, CONFIG)
     # Data preprocessing
     est_setup = unsupervised_setup(CONFIG, df, EXPERIMENT_NAME, EstimatorTask.ANOMALY_DETECTION.value)
-    # Estimator fitting
-    model = create_model(MODEL, fraction = CONFIG.get("contamination_fraction"))
-    # Tune model
-    if TARGET_VAR:
-        model = tune_model(model, supervised_target = TARGET_VAR, supervised_estimator = CONFIG.get("supervised_estimator"),
-            optimize = CONFIG.get("evaluation_metric"), fold = CONFIG.get("fold"), custom_grid = CONFIG.get("custom_grid").get(MODEL_ID)) 
+    with span("train"):
+        # Estimator fitting
+        model = create_model(MODEL, fraction = CONFIG.get("contamination_fraction"))
+        # Tune model
+        if TARGET_VAR:
+            model = tune_model(model, supervised_target = TARGET_VAR, supervised_estimator = CONFIG.get("supervised_estimator"),
+                optimize = CONFIG.get("evaluation_metric"), fold = CONFIG.get("fold"), custom_grid = CONFIG.get("custom_grid").get(MODEL_ID)) 
     # Assign anomalies
     assigned_df = assign_model(model, score = True)
 
@@ -16,8 +16,12 @@ sys.path.insert(0, os.path.abspath(base_dir))
 # Internal 
 from pipeline_lib.config import Config, add_argument, get_config
 from pipeline_lib.data import Data, join_path
-from pipeline_lib.estimator import EstimatorTask, PyCaretClassifier, PyCaretRegressor, setup, train_ensemble_estimators
-from pipeline_lib.pipelines import end_mlflow, get_experiment_name, init_mlflow, PlotParameters, save_local_results, save_mlflow_results
+from pipeline_lib.distributed import start_executor, stop_executor
+from pipeline_lib.estimator import (CachedEstimator, EstimatorTask, get_prediction_pipeline, OptunaStudyEstimator, PyCaretClassifier, 
+    PyCaretRegressor, setup, train_ensemble_estimators)
+from pipeline_lib.pipelines import (end_mlflow, get_experiment_name, init_mlflow, MetricSink, PlotParameters, save_local_results, 
+    save_mlflow_results)
+from pipeline_lib.profiling import span, trace_pipeline
 
 ##########################################################################################################
 ### Parameters
@@ -52,11 +56,17 @@ if EST_TASK == EstimatorTask.REGRESSION.value:
 else:
     ESTIMATOR = PyCaretClassifier()
 
+if CONFIG.get("optuna_storage") is not None:
+    ESTIMATOR = OptunaStudyEstimator(ESTIMATOR, CONFIG, EXPERIMENT_NAME)
+
+if CONFIG.get("result_cache_dir") is not None:
+    ESTIMATOR = CachedEstimator(ESTIMATOR, CONFIG)
+
 # Distributed
-RUN_DISTRIBUTED = CONFIG.get("run_distributed")
+EXECUTOR = CONFIG.get("executor")
 
 # Tuning
-if RUN_DISTRIBUTED:
+if EXECUTOR == "ray":
     SEARCH_ALGORITHM = CONFIG.get("distributed_search_algorithm")
     SEARCH_LIBRARY = CONFIG.get("distributed_search_library")
 else:
@@ -79,59 +89,72 @@ def _get_prediction_metrics(metrics:dict, model, metrics_list: List[str], prefix
         metrics[f"{prefix}_{metric}"] = check_metric(predictions[TARGET_VAR], predictions.Label, metric)        
     return predictions
 
-def _save_prediction_metrics(log_metric: Callable, metrics: dict, metrics_list: List[str], preds, prefix: str):
+def _save_prediction_metrics(log_metric: Callable, metrics: dict, metrics_list: List[str], preds, prefix: str, 
+    per_sample: bool = True):
     prefixed_metrics = [ f"{prefix}_{metric}" for metric in metrics_list ]
     filtered_metrics = { k: metrics[k] for k in prefixed_metrics }
 
     for k, metric in filtered_metrics.items():
         log_metric(k, metric)
+    if not per_sample:
+        return
     for i, (y, predictions) in enumerate(zip(preds[TARGET_VAR], preds.Label)):
         log_metric(key = f"{prefix}_actual", value = y, step = i)
         log_metric(key = f"{prefix}_prediction", value = predictions, step = i)
 
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
-    if RUN_DISTRIBUTED:
-        import ray
-        ray.init(address = CONFIG.get("RAY_ADDRESS"))  
+    start_executor(CONFIG)
 
     if USE_MLFLOW:
         import mlflow
         tmp_dir = init_mlflow(CONFIG)
 
     # Data split
-    df = DATA.read_csv(FILE_NAME)
-    df = DATA.query(CONFIG, df)
-    data, data_unseen = DATA.train_test_split(df, frac = CONFIG.get("training_frac"), random_state = RANDOM_STATE)
+    with span("load_data"):
+        df = DATA.load(FILE_NAME, CONFIG)
+        data, data_unseen = DATA.train_test_split(df, frac = CONFIG.get("training_frac"), random_state = RANDOM_STATE)
 
     # Data preprocessing
     est_setup = setup(ESTIMATOR, CONFIG, data, EXPERIMENT_NAME)
 
     # Estimator fitting
-    best_model, final_ensemble = train_ensemble_estimators(ESTIMATOR, CONFIG, SEARCH_ALGORITHM, SEARCH_LIBRARY)
+    with span("train"):
+        best_model, final_ensemble = train_ensemble_estimators(ESTIMATOR, CONFIG, SEARCH_ALGORITHM, SEARCH_LIBRARY)
 
     # Evaluate model
     metrics = {}
-    if EST_TASK == EstimatorTask.REGRESSION.value:
-        training_preds = _get_prediction_metrics(metrics, best_model, ["MAE", "MSE"], "training")
-        testing_preds = _get_prediction_metrics(metrics, best_model, ["MAE", "MSE"], "testing", data_unseen)
-        final_preds = _get_prediction_metrics(metrics, final_ensemble, ["MAE", "MSE"], "finalised", data_unseen)
-        if USE_MLFLOW:
-            _save_prediction_metrics(mlflow.log_metric, metrics, ["MAE", "MSE"], training_preds, "training")
-            _save_prediction_metrics(mlflow.log_metric, metrics, ["MAE", "MSE"], testing_preds, "testing")
-            _save_prediction_metrics(mlflow.log_metric, metrics, ["MAE", "MSE"], final_preds, "finalised")
+    with span("evaluate"):
+        if EST_TASK == EstimatorTask.REGRESSION.value:
+            training_preds = _get_prediction_metrics(metrics, best_model, ["MAE", "MSE"], "training")
+            testing_preds = _get_prediction_metrics(metrics, best_model, ["MAE", "MSE"], "testing", data_unseen)
+            final_preds = _get_prediction_metrics(metrics, final_ensemble, ["MAE", "MSE"], "finalised", data_unseen)
+            if USE_MLFLOW:
+                log_prediction_trace = CONFIG.get("log_prediction_trace")
+                with MetricSink() as sink:
+                    for preds, prefix in [(training_preds, "training"), (testing_preds, "testing"), (final_preds, "finalised")]:
+                        # Per-sample predictions are logged as a trace artifact instead of metric steps
+                        _save_prediction_metrics(sink.log_metric, metrics, ["MAE", "MSE"], preds, prefix, 
+                            per_sample = not log_prediction_trace)
+                        if log_prediction_trace:
+                            trace = preds[[TARGET_VAR, "Label"]].rename(columns = { TARGET_VAR: "actual", "Label": "prediction" })
+                            sink.log_trace(trace, f"{prefix}_predictions", tmp_dir.name)
 
     # Save results
     plot_params = PlotParameters(ESTIMATOR.plot_model, plots = ["residuals", "error"], model = best_model)
+    saved_model = final_ensemble
+    if CONFIG.get("save_prediction_pipeline"):
+        saved_model = get_prediction_pipeline(ESTIMATOR, final_ensemble)
+
     if USE_MLFLOW:
-        save_mlflow_results(CONFIG, final_ensemble, EXPERIMENT_NAME, tmp_dir, plot_params = plot_params)
+        save_mlflow_results(CONFIG, saved_model, EXPERIMENT_NAME, tmp_dir, plot_params = plot_params)
         end_mlflow(PROJECT_NAME, EXPERIMENT_NAME, tmp_dir, CONFIG.get("author"))
     else:
-        save_path = save_local_results(CONFIG, final_ensemble, EXPERIMENT_NAME, plot_params = plot_params)
+        save_path = save_local_results(CONFIG, saved_model, EXPERIMENT_NAME, plot_params = plot_params)
         if len(metrics.keys()) > 0:
             pd.DataFrame(metrics, index = [0]).to_csv(join_path(save_path, f"{EXPERIMENT_NAME}_metrics.csv")) 
 
-    if RUN_DISTRIBUTED:
-        ray.shutdown()
+    stop_executor()
         
 if __name__ == "__main__":
     main()
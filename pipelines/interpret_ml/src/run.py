@@ -17,9 +17,12 @@ sys.path.insert(0, os.path.abspath(base_dir))
 from pipeline_lib.custom_estimators import CUSTOM_CLASSIFIERS, CUSTOM_REGRESSORS
 from pipeline_lib.config import Config, add_argument, get_config
 from pipeline_lib.data import Data, join_path
-from pipeline_lib.estimator import EstimatorTask, PyCaretClassifier, PyCaretRegressor, setup
+from pipeline_lib.distributed import start_executor, stop_executor
+from pipeline_lib.estimator import (CachedEstimator, EstimatorTask, get_prediction_pipeline, OptunaStudyEstimator, PyCaretClassifier, 
+    PyCaretRegressor, setup)
 from pipeline_lib.pipelines import (create_local_directory, end_mlflow, get_experiment_name, init_mlflow, PlotParameters, 
-    save_local_results, save_mlflow_results, pipeline_plots)
+    save_local_results, save_mlflow_results, pipeline_plots, upload_artifact)
+from pipeline_lib.profiling import span, trace_pipeline
 
 ##########################################################################################################
 ### Parameters
@@ -60,11 +63,17 @@ else:
     ESTIMATOR = PyCaretClassifier()
     EBM = CUSTOM_CLASSIFIERS.get(EBM_KEY)
 
+if CONFIG.get("optuna_storage") is not None:
+    ESTIMATOR = OptunaStudyEstimator(ESTIMATOR, CONFIG, EXPERIMENT_NAME)
+
+if CONFIG.get("result_cache_dir") is not None:
+    ESTIMATOR = CachedEstimator(ESTIMATOR, CONFIG)
+
 # Distributed
-RUN_DISTRIBUTED = CONFIG.get("run_distributed")
+EXECUTOR = CONFIG.get("executor")
 
 # Tuning
-if RUN_DISTRIBUTED:
+if EXECUTOR == "ray":
     SEARCH_ALGORITHM = CONFIG.get("distributed_search_algorithm")
     SEARCH_LIBRARY = CONFIG.get("distributed_search_library")
 else:
@@ -81,21 +90,19 @@ USE_MLFLOW = CONFIG.get("use_mlflow")
 ### Pipeline
 ##########################################################################################################
 
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
-    if RUN_DISTRIBUTED:
-        import ray
-        ray.init(address = CONFIG.get("RAY_ADDRESS"))  
+    start_executor(CONFIG)
 
     if USE_MLFLOW:
-        import mlflow
         tmp_dir = init_mlflow(CONFIG)
         save_dir = tmp_dir.name
     else:
         save_dir = create_local_directory(CONFIG)
 
     # Data split
-    df = DATA.read_csv(FILE_NAME) 
-    df = DATA.query(CONFIG, df)
+    with span("load_data"):
+        df = DATA.load(FILE_NAME, CONFIG)
     # Data preprocessing
     est_setup = setup(ESTIMATOR, CONFIG, df, EXPERIMENT_NAME)
 
@@ -109,65 +116,75 @@ def main() -> None:
     plot_params = PlotParameters(ESTIMATOR.plot_model, plots = ["residuals", "error", "feature_all", "rfe"])
 
     for linear_model in LINEAR_MODELS:
-        trained_lm = ESTIMATOR.create_model(linear_model)
-        tuned_lm = ESTIMATOR.tune_model(trained_lm, search_algorithm = SEARCH_ALGORITHM, optimize = evaluation_metric,
-            search_library = SEARCH_LIBRARY, n_iter = n_iter, custom_grid = custom_grid.get(linear_model), 
-            early_stopping = early_stopping_algo, early_stopping_max_iters = early_stop, 
-            choose_better = True) 
-
-        plot_params.model = tuned_lm
-        image_dir = join_path(save_dir, linear_model)  
-        os.makedirs(image_dir, exist_ok = True)
-        pipeline_plots(plot_params, tuned_lm, image_dir, USE_MLFLOW)
-        coef = np.append(tuned_lm.intercept_, tuned_lm.coef_)
-        coefficients.append(coef)
+        with span(linear_model):
+            trained_lm = ESTIMATOR.create_model(linear_model)
+            tuned_lm = ESTIMATOR.tune_model(trained_lm, search_algorithm = SEARCH_ALGORITHM, optimize = evaluation_metric,
+                search_library = SEARCH_LIBRARY, n_iter = n_iter, custom_grid = custom_grid.get(linear_model), 
+                early_stopping = early_stopping_algo, early_stopping_max_iters = early_stop, 
+                choose_better = True) 
+
+            plot_params.model = tuned_lm
+            image_dir = join_path(save_dir, linear_model)  
+            os.makedirs(image_dir, exist_ok = True)
+            pipeline_plots(plot_params, tuned_lm, image_dir)
+            if USE_MLFLOW:
+                upload_artifact(image_dir) # Upload while the remaining models are fitted
+            coef = np.append(tuned_lm.intercept_, tuned_lm.coef_)
+            coefficients.append(coef)
     
     coefficients_df = pd.DataFrame(coefficients, columns = np.append(["intercept"], ESTIMATOR.get_config('X_train').columns),
         index = LINEAR_MODELS)
 
-    trained_tm = ESTIMATOR.create_model(TREE_MODEL)
-    tuned_tm = ESTIMATOR.tune_model(trained_tm, search_algorithm = SEARCH_ALGORITHM, optimize = evaluation_metric,
-        search_library = SEARCH_LIBRARY, n_iter = n_iter, custom_grid = custom_grid.get(TREE_MODEL), 
-        early_stopping = early_stopping_algo, early_stopping_max_iters = early_stop, 
-        choose_better = True) 
-
-    plot_params.model = tuned_tm
-    image_dir = join_path(save_dir, TREE_MODEL)  
-    os.makedirs(image_dir, exist_ok = True)
-    plot_params.plots = ["residuals", "error", "feature_all", "rfe"]
-    pipeline_plots(plot_params, tuned_tm, image_dir, USE_MLFLOW)
-
-    for plot in ["summary", "correlation", "reason", "pdp", "msa"]:
-        ESTIMATOR.interpret_model(tuned_tm, plot = plot, save = image_dir)
-
-    ebm_model = ESTIMATOR.create_model(EBM())
-    if CONFIG.get("tune_ebm"):
-        ebm_model = ESTIMATOR.tune_model(ebm_model, search_algorithm = SEARCH_ALGORITHM, optimize = evaluation_metric,
-            search_library = SEARCH_LIBRARY, n_iter = n_iter, custom_grid = custom_grid.get(EBM_KEY), 
+    with span(TREE_MODEL):
+        trained_tm = ESTIMATOR.create_model(TREE_MODEL)
+        tuned_tm = ESTIMATOR.tune_model(trained_tm, search_algorithm = SEARCH_ALGORITHM, optimize = evaluation_metric,
+            search_library = SEARCH_LIBRARY, n_iter = n_iter, custom_grid = custom_grid.get(TREE_MODEL), 
             early_stopping = early_stopping_algo, early_stopping_max_iters = early_stop, 
             choose_better = True) 
+
+        plot_params.model = tuned_tm
+        image_dir = join_path(save_dir, TREE_MODEL)  
+        os.makedirs(image_dir, exist_ok = True)
+        plot_params.plots = ["residuals", "error", "feature_all", "rfe"]
+        pipeline_plots(plot_params, tuned_tm, image_dir)
+
+        for plot in ["summary", "correlation", "reason", "pdp", "msa"]:
+            ESTIMATOR.interpret_model(tuned_tm, plot = plot, save = image_dir)
+        if USE_MLFLOW:
+            upload_artifact(image_dir)
+
+    with span(EBM_KEY):
+        ebm_model = ESTIMATOR.create_model(EBM())
+        if CONFIG.get("tune_ebm"):
+            ebm_model = ESTIMATOR.tune_model(ebm_model, search_algorithm = SEARCH_ALGORITHM, optimize = evaluation_metric,
+                search_library = SEARCH_LIBRARY, n_iter = n_iter, custom_grid = custom_grid.get(EBM_KEY), 
+                early_stopping = early_stopping_algo, early_stopping_max_iters = early_stop, 
+                choose_better = True) 
     
-    image_dir = join_path(save_dir, EBM_KEY)  
-    os.makedirs(image_dir, exist_ok = True)
-    plot_params.model = ebm_model
-    plot_params.plots = ["residuals", "error"]
-    pipeline_plots(plot_params, ebm_model, image_dir, USE_MLFLOW)
-    for plot in ["msa", "pdp"]:  
-        ESTIMATOR.interpret_model(ebm_model, plot = plot, save = image_dir)
-
-    ebm_model.explain_global().visualize().write_html(join_path(image_dir, "global_explanations.html"))
+        image_dir = join_path(save_dir, EBM_KEY)  
+        os.makedirs(image_dir, exist_ok = True)
+        plot_params.model = ebm_model
+        plot_params.plots = ["residuals", "error"]
+        pipeline_plots(plot_params, ebm_model, image_dir)
+        for plot in ["msa", "pdp"]:  
+            ESTIMATOR.interpret_model(ebm_model, plot = plot, save = image_dir)
+
+        ebm_model.explain_global().visualize().write_html(join_path(image_dir, "global_explanations.html"))
+        if USE_MLFLOW:
+            upload_artifact(image_dir)
     
     # Save results
+    saved_model = ebm_model
+    if CONFIG.get("save_prediction_pipeline"):
+        saved_model = get_prediction_pipeline(ESTIMATOR, ebm_model)
+
     if USE_MLFLOW:
-        for model in LINEAR_MODELS + [TREE_MODEL, EBM_KEY]:
-            mlflow.log_artifact(join_path(save_dir, model))
-        save_mlflow_results(CONFIG, ebm_model, EXPERIMENT_NAME, tmp_dir, assigned_df = coefficients_df)
+        save_mlflow_results(CONFIG, saved_model, EXPERIMENT_NAME, tmp_dir, assigned_df = coefficients_df)
         end_mlflow(PROJECT_NAME, EXPERIMENT_NAME, tmp_dir, CONFIG.get("author"))
     else:
-        save_local_results(CONFIG, ebm_model, EXPERIMENT_NAME, assigned_df = coefficients_df, save_path = save_dir)
+        save_local_results(CONFIG, saved_model, EXPERIMENT_NAME, assigned_df = coefficients_df, save_path = save_dir)
 
-    if RUN_DISTRIBUTED:
-        ray.shutdown()
+    stop_executor()
         
 if __name__ == "__main__":
     main()
@@ -1,9 +1,11 @@
 ##########################################################################################################
-### Imports  
+### Imports
 ##########################################################################################################
 
 # External
 import argparse
+import hashlib
+import json
 import os, sys
 import pandas as pd
 import tempfile
@@ -11,9 +13,11 @@ import tempfile
 base_dir = "../.."
 sys.path.insert(0, os.path.abspath(base_dir))
 
-# Internal 
+# Internal
 from pipeline_lib.config import get_config
-from pipeline_lib.data import Data
+from pipeline_lib.data import Data, hash_file, join_path
+from pipeline_lib.distributed import parallel_map
+from pipeline_lib.profiling import trace_pipeline
 
 ##########################################################################################################
 ### Constants
@@ -25,28 +29,70 @@ CONFIG = get_config(base_dir)
 DATA = Data()
 
 # Random
-RANDOM_STATE = CONFIG.get("random_seed") 
+RANDOM_STATE = CONFIG.get("random_seed")
+
+# Data
+DATA_DIR = CONFIG.get("data_dir")
+DATASETS = CONFIG.get("datasets")
+INTERACTIONS = CONFIG.get("interactions")
+MANIFEST_FILE = CONFIG.get("manifest_file")
 
 ##########################################################################################################
 ### Pipeline
 ##########################################################################################################
 
-def _add_interactions(path: str):
-    df = DATA.read_csv(f"data/{path}.csv")
-    df["x_calyx_MA_rel"] = df["x"] * df["calyx_MA_rel"]
-    df["x_maMAratio"] = df["x"] * df["maMAratio"]
-    df["height_calyx_ma"] = df["height"] * df["calyx_ma"]
-    df["perimeter_coff"] = df["perimeter"] * df["coff"]
-    df.to_csv(f"data/{path}_extended.csv", index = False)
-    
+def _get_spec_hash(interactions: dict) -> str:
+    return hashlib.sha1(json.dumps(interactions, sort_keys = True).encode()).hexdigest()
+
+def _read_manifest() -> dict:
+    if not os.path.isfile(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+def _write_manifest(manifest: dict) -> None:
+    with open(MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+
+def _add_interactions(task: tuple) -> dict:
+    """Add interaction terms to a dataset, evaluating all expressions in a single pass."""
+    dataset, interactions, input_hash, spec_hash = task
+    df = DATA.read_csv(join_path(DATA_DIR, f"{dataset}.csv"))
+    expressions = "\n".join(f"{name} = {expression}" for name, expression in interactions.items())
+    df = df.eval(expressions)
+
+    out_file = join_path(DATA_DIR, f"{dataset}_extended.csv")
+    df.to_csv(out_file, index = False)
+    return { "input": input_hash, "spec": spec_hash, "output": hash_file(out_file) }
+
+def _is_current(entry: dict, dataset: str, input_hash: str, spec_hash: str) -> bool:
+    """Whether the dataset output is unchanged since the last run."""
+    if entry is None or entry.get("input") != input_hash or entry.get("spec") != spec_hash:
+        return False
+    out_file = join_path(DATA_DIR, f"{dataset}_extended.csv")
+    return os.path.isfile(out_file) and hash_file(out_file) == entry.get("output")
+
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
-    _add_interactions("hw_data_4217")
-    _add_interactions("hw_data_7154")
-    _add_interactions("ga_data_4217")
-    _add_interactions("ga_data_7154")
-    _add_interactions("ga_data_combined")
-    _add_interactions("hw_data_combined")
-        
+    manifest = _read_manifest()
+    spec_hash = _get_spec_hash(INTERACTIONS)
+
+    tasks = []
+    for dataset in DATASETS:
+        input_hash = hash_file(join_path(DATA_DIR, f"{dataset}.csv"))
+        if _is_current(manifest.get(dataset), dataset, input_hash, spec_hash):
+            print(f"{dataset}: unchanged, skipping")
+            continue
+        tasks.append((dataset, INTERACTIONS, input_hash, spec_hash))
+
+    results = parallel_map(_add_interactions, tasks, CONFIG.get("n_workers"))
+    for task, entry in zip(tasks, results):
+        manifest[task[0]] = entry
+        print(f"{task[0]}: added {len(INTERACTIONS)} interactions")
+
+    # Remove datasets that are no longer declared
+    manifest = { dataset: entry for dataset, entry in manifest.items() if dataset in DATASETS }
+    _write_manifest(manifest)
+
 if __name__ == "__main__":
     main()
-     
\ No newline at end of file
@@ -6,6 +6,7 @@
 import argparse
 import os, sys
 import pandas as pd
+import time
 
 from pycaret.utils import check_metric
 
@@ -15,8 +16,12 @@ sys.path.insert(0, os.path.abspath(base_dir))
 # Internal 
 from pipeline_lib.config import Config, add_argument, get_config
 from pipeline_lib.data import Data, join_path
-from pipeline_lib.estimator import EstimatorTask, PyCaretClassifier, PyCaretRegressor, setup, unsupervised_setup
-from pipeline_lib.pipelines import create_local_directory, end_mlflow, get_experiment_name, init_mlflow, PlotParameters, pipeline_plots
+from pipeline_lib.estimator import EstimatorTask, load_local_model, PyCaretClassifier, PyCaretRegressor, setup, unsupervised_setup
+from pipeline_lib.pipelines import (create_local_directory, end_mlflow, get_experiment_name, init_mlflow, MetricSink, PlotParameters, 
+    pipeline_plots, upload_artifact)
+from pipeline_lib.monitoring import record_scoring
+from pipeline_lib.profiling import span, trace_pipeline
+from pipeline_lib.scoring import is_prediction_pipeline, score_batches
 
 ##########################################################################################################
 ### Parameters
@@ -65,6 +70,9 @@ elif EST_TASK == EstimatorTask.ANOMALY_DETECTION.value:
 else:
     from pycaret.clustering import load_model, predict_model, plot_model
 
+# Scoring
+BATCH_SCORING = CONFIG.get("batch_scoring")
+
 # Random
 RANDOM_STATE = CONFIG.get("random_seed") 
 
@@ -75,28 +83,46 @@ USE_MLFLOW = CONFIG.get("use_mlflow")
 ### Pipeline
 ##########################################################################################################
 
-def _save_metrics(log_metric, metrics, preds):
+def _save_metrics(log_metric, metrics, preds, per_sample = True):
     for k, v in metrics.items():
         log_metric(k, v)
+    if not per_sample:
+        return
 
     preds_sample = preds.sample(n = 300, random_state = RANDOM_STATE)
     for i, (y, predictions) in enumerate(zip(preds_sample[TARGET_VAR], preds_sample.Label)):
         log_metric(key = f"actual_value", value = y, step = i)
         log_metric(key = f"predicted_value", value = predictions, step = i)
 
+def _batch_predict(model, df: pd.DataFrame) -> pd.DataFrame:
+    """Score a dataframe in batches using a prediction pipeline, without running setup."""
+    batch_size = CONFIG.get("batch_size")
+    n_workers = CONFIG.get("scoring_workers")
+    if EST_TASK == EstimatorTask.ANOMALY_DETECTION.value:
+        return score_batches(model, df, batch_size, n_workers, "Anomaly")
+    elif EST_TASK == EstimatorTask.CLUSTERING.value:
+        predictions = score_batches(model, df, batch_size, n_workers, "Cluster")
+        predictions["Cluster"] = "Cluster " + predictions.Cluster.astype(str)
+        return predictions
+    else:
+        score = EST_TASK == EstimatorTask.CLASSIFICATION.value
+        return score_batches(model, df, batch_size, n_workers, score = score)
+
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
     # Load data
-    df = DATA.read_csv(FILE_NAME) 
-    df = DATA.query(CONFIG, df)
+    with span("load_data"):
+        df = DATA.load(FILE_NAME, CONFIG)
     # Setup
-    CONFIG.set("use_mlflow", False) # Skip MLFlow logging
-    if EST_TASK == EstimatorTask.REGRESSION.value or EST_TASK == EstimatorTask.CLASSIFICATION.value:
-        setup(ESTIMATOR, CONFIG, df, EXPERIMENT_NAME)
-    elif EST_TASK == EstimatorTask.ANOMALY_DETECTION.value:
-        est_setup = unsupervised_setup(CONFIG, df, EXPERIMENT_NAME, EstimatorTask.ANOMALY_DETECTION.value)
-    else:
-        est_setup = unsupervised_setup(CONFIG, df, EXPERIMENT_NAME, EstimatorTask.CLUSTERING.value)
-    CONFIG.set("use_mlflow", USE_MLFLOW)
+    if not BATCH_SCORING:
+        CONFIG.set("use_mlflow", False) # Skip MLFlow logging
+        if EST_TASK == EstimatorTask.REGRESSION.value or EST_TASK == EstimatorTask.CLASSIFICATION.value:
+            setup(ESTIMATOR, CONFIG, df, EXPERIMENT_NAME)
+        elif EST_TASK == EstimatorTask.ANOMALY_DETECTION.value:
+            est_setup = unsupervised_setup(CONFIG, df, EXPERIMENT_NAME, EstimatorTask.ANOMALY_DETECTION.value)
+        else:
+            est_setup = unsupervised_setup(CONFIG, df, EXPERIMENT_NAME, EstimatorTask.CLUSTERING.value)
+        CONFIG.set("use_mlflow", USE_MLFLOW)
 
     # # Load model
     if USE_MLFLOW:
@@ -112,19 +138,36 @@ def main() -> None:
         else:
             model_uri += "/latest"
 
-        model = mlflow.sklearn.load_model(
-            model_uri = model_uri
-        )
+        with span("load_model"):
+            model = mlflow.sklearn.load_model(
+                model_uri = model_uri
+            )
     else:
-        model = load_model(MODEL_PATH)
+        with span("load_model"):
+            if BATCH_SCORING:
+                model = load_local_model(MODEL_PATH)
+            else:
+                model = load_model(MODEL_PATH)
         save_dir = create_local_directory(CONFIG)
 
+    # Batch scoring skips setup, so the model must include the setup preprocessing steps
+    if BATCH_SCORING and not is_prediction_pipeline(model):
+        raise Exception(f"Invalid model error: {MODEL_PATH if not USE_MLFLOW else model_uri}. Batch scoring requires " 
+            "a prediction pipeline, saved by enabling save_prediction_pipeline")
+
     # Perform predictions
-    predictions = predict_model(model, df)
+    with span("predict"):
+        if BATCH_SCORING:
+            predictions = _batch_predict(model, df)
+        else:
+            start = time.perf_counter()
+            predictions = predict_model(model, df)
+            record_scoring(len(df), time.perf_counter() - start)
     df_path = join_path(save_dir, f"{EXPERIMENT_NAME}.csv")
     predictions.to_csv(df_path)
 
     metrics = {}
+    plot_params = None
     # Replace existing training data labels to create new plots
     if EST_TASK == EstimatorTask.ANOMALY_DETECTION.value:
         model.labels_ = predictions.Anomaly
@@ -138,16 +181,24 @@ def main() -> None:
         metrics["mse"] = check_metric(predictions[TARGET_VAR], predictions.Label, 'MSE')
 
         if USE_MLFLOW:
-            _save_metrics(mlflow.log_metric, metrics, predictions)
+            log_prediction_trace = CONFIG.get("log_prediction_trace")
+            with MetricSink() as sink:
+                # Per-sample predictions are logged as a trace artifact instead of metric steps
+                _save_metrics(sink.log_metric, metrics, predictions, per_sample = not log_prediction_trace)
+                if log_prediction_trace:
+                    trace = predictions[[TARGET_VAR, "Label"]].rename(columns = { TARGET_VAR: "actual", "Label": "prediction" })
+                    sink.log_trace(trace, "predictions", save_dir)
 
     # Add plots
-    pipeline_plots(plot_params, model, save_dir, USE_MLFLOW)
+    # Plots require the estimator setup, which is skipped for batch scoring
+    if plot_params is not None and not BATCH_SCORING:
+        pipeline_plots(plot_params, model, save_dir, USE_MLFLOW)
 
     # Save results
     if USE_MLFLOW:
         config_path = CONFIG.export(tmp_dir.name)
-        mlflow.log_artifact(config_path)
-        mlflow.log_artifact(df_path)
+        upload_artifact(config_path)
+        upload_artifact(df_path)
         mlflow.set_tag("est_task", EST_TASK)
         end_mlflow(PROJECT_NAME, EXPERIMENT_NAME, tmp_dir, CONFIG.get("author"))
     else:
@@ -0,0 +1,73 @@
+##########################################################################################################
+### Imports  
+##########################################################################################################
+
+# External
+import argparse
+import os, sys
+
+base_dir = "../.."
+sys.path.insert(0, os.path.abspath(base_dir))
+
+# Internal 
+from pipeline_lib.config import Config, add_argument, get_config
+from pipeline_lib.monitoring import start_monitoring, stop_monitoring
+from pipeline_lib.serving import get_model_store, ModelCache, ScoringServer
+
+##########################################################################################################
+### Parameters
+##########################################################################################################
+
+parser = argparse.ArgumentParser(
+    description = 'Serve predictions from trained models using a long-running process.'
+)
+    
+add_argument(parser, "--base_dir", ".", "The base project directory", str)
+add_argument(parser, "--scenario", ".", "The pipeline scenario file", str)
+add_argument(parser, "--from_params", ".", "Override parameters using a params.override.yaml file", str)
+
+##########################################################################################################
+### Constants
+##########################################################################################################
+
+# Config
+PROJECT_NAME = "predict"
+CONFIG: Config = get_config(base_dir, parser)
+
+# Estimator
+MODEL_NAME = CONFIG.get("model_name")
+MODEL_VERSION = CONFIG.get("model_version")
+MODEL_STAGE = CONFIG.get("model_stage")
+
+# Serving
+SERVE_HOST = CONFIG.get("serve_host")
+SERVE_PORT = CONFIG.get("serve_port")
+
+##########################################################################################################
+### Pipeline
+##########################################################################################################
+
+def main() -> None:
+    model_store = get_model_store(CONFIG)
+    model_cache = ModelCache(model_store, CONFIG.get("model_cache_size"), CONFIG.get("model_refresh_interval"))
+
+    # Warm the cache with the default model
+    if MODEL_NAME is not None:
+        model_cache.get(MODEL_NAME, MODEL_VERSION, MODEL_STAGE)
+
+    server = ScoringServer((SERVE_HOST, SERVE_PORT), model_cache, CONFIG.get("batch_size"), MODEL_NAME, 
+        MODEL_VERSION, MODEL_STAGE)
+    # Scoring metrics are also served from /metrics
+    start_monitoring(f"{PROJECT_NAME}_serve", CONFIG)
+    print(f"Serving predictions at http://{SERVE_HOST}:{SERVE_PORT}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop_monitoring()
+        
+if __name__ == "__main__":
+    main()
+     
@@ -14,8 +14,9 @@ sys.path.insert(0, os.path.abspath(base_dir))
 
 # Internal 
 from pipeline_lib.config import add_argument, get_config
-from pipeline_lib.data import Data, join_path
-from pipeline_lib.pipelines import create_local_directory, end_mlflow, get_experiment_name, init_mlflow
+from pipeline_lib.data import Data, is_row_wise_query, join_path
+from pipeline_lib.pipelines import create_local_directory, end_mlflow, get_experiment_name, init_mlflow, upload_artifact
+from pipeline_lib.profiling import timed, trace_pipeline
 
 ##########################################################################################################
 ### Parameters
@@ -53,30 +54,8 @@ USE_MLFLOW = CONFIG.get("use_mlflow")
 ### Pipeline
 ##########################################################################################################
 
-def save_results(df: pd.DataFrame, path_prefix: str, copy_data_path: str):
-    """Save preprocessing results."""
-    preprocessed_fname = CONFIG.get("preprocessed_file_name")
-    if preprocessed_fname is None:
-        preprocessed_fname = f"{EXPERIMENT_NAME}_data.csv"
-
-    data_file = join_path(path_prefix, preprocessed_fname)
-    df.to_csv(data_file, index = False)
-    if copy_data_path is not None:
-        shutil.copy2(data_file, copy_data_path)
-
-    config_file = CONFIG.export(path_prefix)
-    return config_file, data_file
-
-def main() -> None:
-    if USE_MLFLOW:
-        import mlflow
-        tmp_dir = init_mlflow(CONFIG)
-        save_dir = tmp_dir.name
-    else:
-        save_dir = create_local_directory(CONFIG)
-
-    df = DATA.read_csv(FILE_NAME)
-
+def preprocess(df: pd.DataFrame, queried: bool = False) -> pd.DataFrame:
+    """Apply the configured preprocessing steps to a dataframe, which may have been queried when loading."""
     # Drop nas for target
     if CONFIG.get("drop_target_nas") and TARGET_VAR is not None:
         df = df.dropna(subset = [TARGET_VAR])
@@ -89,9 +68,10 @@ def main() -> None:
     include_features = CONFIG.get("include_features")
     drop_features = CONFIG.get("drop_features")
     if len(include_features) > 0:
-        df = df[include_features]
+        # Keep the row index added by the query
+        df = df[["index"] + include_features if queried else include_features]
     if len(drop_features) > 0:
-        df = df.drop(columns = drop_features)
+        df = df.drop(columns = drop_features, errors = "ignore")
 
     # Cast columns
     col_as_type: dict = CONFIG.get("col_as_type")
@@ -99,16 +79,85 @@ def main() -> None:
         df = df.astype(col_as_type)
 
     # Perform query
-    df = DATA.query(CONFIG, df)
+    if not queried:
+        df = DATA.query(CONFIG, df)
+    return df
+
+def _get_schema(df: pd.DataFrame) -> dict:
+    """Get the column types of the first chunk, using nullable integers so that later chunks with nas keep integer values."""
+    return { column: "Int64" if pd.api.types.is_integer_dtype(dtype) else dtype for column, dtype in df.dtypes.items() }
+
+def _match_schema(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Cast a chunk to the column types of the first chunk, so that values are written consistently across chunks."""
+    for column, dtype in schema.items():
+        if column in df.columns and df[column].dtype != dtype:
+            try:
+                df[column] = df[column].astype(dtype)
+            except (TypeError, ValueError):
+                # Incompatible values, such as strings within a numeric column, are written as they are
+                continue
+    return df
+
+def write_data(data_file: str):
+    """Preprocess the input data, and write it to the data file."""
+    chunk_size = CONFIG.get("chunk_size")
+    if chunk_size is None:
+        # Queries on cast columns are applied after casting, and dropping nas depends upon all columns
+        queried = CONFIG.get("col_as_type") is None and CONFIG.get("df_query") is not None
+        df = DATA.load(FILE_NAME, CONFIG, query = queried, select = not CONFIG.get("drop_nas"), features = True)
+        df = preprocess(df, queried)
+        df.to_csv(data_file, index = False)
+        return
+
+    # Queries are applied to each chunk separately, so they must not depend upon other rows
+    df_query = CONFIG.get("df_query")
+    if df_query is not None and not is_row_wise_query(df_query):
+        raise Exception(f"Invalid df_query error: {df_query}. Must only compare values within each row when chunk_size is set")
+
+    # Write the header, so that the data file exists even if there are no chunks
+    header = preprocess(pd.DataFrame(columns = DATA.read_columns(FILE_NAME)))
+    header.to_csv(data_file, index = False)
+
+    # Stream bounded-size chunks to the data file
+    schema = None
+    for chunk in DATA.read_chunks(FILE_NAME, chunk_size):
+        df = preprocess(chunk)
+        if schema is None:
+            schema = _get_schema(df)
+        df = _match_schema(df, schema)
+        df.to_csv(data_file, index = False, mode = "a", header = False)
+
+@timed("save_results")
+def save_results(path_prefix: str, copy_data_path: str):
+    """Save preprocessing results."""
+    preprocessed_fname = CONFIG.get("preprocessed_file_name")
+    if preprocessed_fname is None:
+        preprocessed_fname = f"{EXPERIMENT_NAME}_data.csv"
+
+    data_file = join_path(path_prefix, preprocessed_fname)
+    write_data(data_file)
+    if copy_data_path is not None:
+        shutil.copy2(data_file, copy_data_path)
+
+    config_file = CONFIG.export(path_prefix)
+    return config_file, data_file
+
+@trace_pipeline(PROJECT_NAME, CONFIG)
+def main() -> None:
+    if USE_MLFLOW:
+        tmp_dir = init_mlflow(CONFIG)
+        save_dir = tmp_dir.name
+    else:
+        save_dir = create_local_directory(CONFIG)
 
     copy_data_path = CONFIG.get("copy_data_path")
     if USE_MLFLOW:
-        config_file, data_file = save_results(df, save_dir, copy_data_path)
-        mlflow.log_artifact(config_file)
-        mlflow.log_artifact(data_file)
+        config_file, data_file = save_results(save_dir, copy_data_path)
+        upload_artifact(config_file)
+        upload_artifact(data_file)
         end_mlflow(PROJECT_NAME, EXPERIMENT_NAME, tmp_dir, CONFIG.get("author"))
     else:
-        config_file, data_file = save_results(df, save_dir, copy_data_path)
+        config_file, data_file = save_results(save_dir, copy_data_path)
 
 if __name__ == "__main__":
     main()
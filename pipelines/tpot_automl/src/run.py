@@ -4,6 +4,7 @@
 
 # External
 import argparse
+import json
 import os, sys
 
 from tpot import TPOTRegressor, TPOTClassifier
@@ -12,11 +13,13 @@ base_dir = "../.."
 sys.path.insert(0, os.path.abspath(base_dir))
 
 # Internal 
+from pipeline_lib.cache import hash_dataframe, hash_key
 from pipeline_lib.config import add_argument, get_config
 from pipeline_lib.data import Data, join_path
-from pipeline_lib.distributed import close_dask, init_dask
+from pipeline_lib.distributed import start_executor, stop_executor
 from pipeline_lib.estimator import EstimatorTask
-from pipeline_lib.pipelines import create_local_directory, end_mlflow, get_experiment_name, init_mlflow
+from pipeline_lib.pipelines import create_local_directory, end_mlflow, get_experiment_name, init_mlflow, upload_artifact
+from pipeline_lib.profiling import span, timed, trace_pipeline
 
 ##########################################################################################################
 ### Parameters
@@ -51,7 +54,12 @@ EST_TASK = CONFIG.get("est_task")
 RANDOM_STATE = CONFIG.get("random_seed") 
 
 # Distributed
-RUN_DISTRIBUTED = CONFIG.get("run_distributed")
+EXECUTOR = CONFIG.get("executor")
+
+# Caching
+MEMORY_CACHE_DIR = CONFIG.get("memory_cache_dir")
+CHECKPOINT_DIR = CONFIG.get("checkpoint_dir")
+RESUME = CONFIG.get("resume")
 
 # MLFlow
 USE_MLFLOW = CONFIG.get("use_mlflow")
@@ -60,6 +68,66 @@ USE_MLFLOW = CONFIG.get("use_mlflow")
 ### Pipeline
 ##########################################################################################################
 
+def _get_checkpoint_file(fingerprint: str) -> str:
+    """Get the checkpoint file for a dataset and search space."""
+    key = hash_key(fingerprint, EST_TASK, CONFIG.get("config_dict"), CONFIG.get("fold"), RANDOM_STATE)
+    return join_path(CHECKPOINT_DIR, f"{key}.json")
+
+def save_checkpoint(est, checkpoint_file: str, generation: int) -> None:
+    """Save the current population and evaluated pipeline history."""
+    checkpoint = {
+        "generation": generation,
+        "population": [ str(individual) for individual in est._pop ],
+        "evaluated_individuals": est.evaluated_individuals_
+    }
+    tmp_file = f"{checkpoint_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_file, checkpoint_file)
+
+def load_checkpoint(est, checkpoint_file: str) -> int:
+    """
+    Restore the population and evaluated pipeline history of a previous run, so that fitting continues using warm_start.
+
+    Previously evaluated pipelines are not evaluated again.
+
+    Returns
+    ---------
+    generation: int
+        The number of completed generations, or 0 if there is no checkpoint.
+    """
+    if not os.path.isfile(checkpoint_file):
+        return 0
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+
+    from deap import creator
+    est._fit_init()
+    est._pop = []
+    for individual in checkpoint["population"]:
+        try:
+            est._pop.append(creator.Individual.from_string(individual, est._pset))
+        except (KeyError, TypeError):
+            # The operator is no longer in the search space
+            continue
+    est.evaluated_individuals_ = checkpoint["evaluated_individuals"]
+    # A placeholder Pareto front, which is replaced when fitting
+    est._pareto_front = []
+    print(f"Resuming from generation {checkpoint['generation']} with {len(est._pop)} pipelines, "
+        f"and {len(est.evaluated_individuals_)} evaluated pipelines")
+    return checkpoint["generation"]
+
+def add_checkpoints(est, checkpoint_file: str, generation: int) -> None:
+    """Save a checkpoint at the end of each generation, before TPOT's own periodic pipeline check."""
+    check_periodic_pipeline = est._check_periodic_pipeline
+    def check_and_save(gen: int) -> None:
+        est._completed_generations = generation + gen
+        save_checkpoint(est, checkpoint_file, est._completed_generations)
+        check_periodic_pipeline(gen)
+    est._completed_generations = generation
+    est._check_periodic_pipeline = check_and_save
+
+@timed("save_results")
 def save_results(est, path_prefix: str):
     """Save TPOT results."""
     config_file = CONFIG.export(path_prefix)
@@ -67,56 +135,63 @@ def save_results(est, path_prefix: str):
     est.export(pipeline_file)
     return config_file, pipeline_file
 
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
     if USE_MLFLOW:
-        import mlflow
         tmp_dir = init_mlflow(CONFIG)
 
-    if RUN_DISTRIBUTED:
-        client = init_dask()
+    executor = start_executor(CONFIG)
         
-    df = DATA.read_csv(FILE_NAME)
-    df = DATA.query(CONFIG, df)
-    columns = [TARGET_VAR]
-    ignore_features = CONFIG.get("ignore_features")
-    if type(ignore_features) is list:
-        columns += ignore_features
-    X = df.drop(columns = columns)
+    with span("load_data"):
+        ignore_features = CONFIG.get("ignore_features")
+        # Ignored features are not loaded
+        df = DATA.load(FILE_NAME, CONFIG, exclude = ignore_features if type(ignore_features) is list else None)
+    X = df.drop(columns = [TARGET_VAR])
     y = df[TARGET_VAR].values
 
     save_dir = create_local_directory(CONFIG)
+    # Cached transformers and checkpoints are keyed by a fingerprint of the dataset
+    fingerprint = hash_key(hash_dataframe(X), hash_dataframe(df[TARGET_VAR]))
     kwargs = {
-        "cv" : CONFIG.get("fold"), "random_state" : RANDOM_STATE, "use_dask" : RUN_DISTRIBUTED, 
-        "verbosity" : 2, "warm_start" : False, "periodic_checkpoint_folder": save_dir
+        "cv" : CONFIG.get("fold"), "random_state" : RANDOM_STATE, "use_dask" : EXECUTOR == "dask", 
+        "verbosity" : 2, "warm_start" : CHECKPOINT_DIR is not None, "periodic_checkpoint_folder": save_dir,
+        "memory": join_path(MEMORY_CACHE_DIR, fingerprint) if MEMORY_CACHE_DIR is not None else None
     }
 
     for config_arg in ["generations", "population_size", "n_jobs", "max_time_mins", "max_eval_time_mins",
         "config_dict", "early_stop"]:
         kwargs[config_arg] = CONFIG.get(config_arg)
+    # Pipelines are evaluated across the whole cluster when using the Ray joblib backend
+    kwargs["n_jobs"] = executor.get_n_jobs(kwargs["n_jobs"])
 
     if EST_TASK == EstimatorTask.REGRESSION.value:
         est = TPOTRegressor(**kwargs)
     else:
         est = TPOTClassifier(**kwargs)
 
-    est.fit(X, y)
-    # if RUN_DISTRIBUTED:
-    #     import joblib
-    #     with joblib.parallel_backend("dask"): # @TODO Run using Ray backend instead?
-    #         pipeline_optimizer.fit(X, y)
-    # else:
-    #     pipeline_optimizer.fit(X, y)
+    if CHECKPOINT_DIR is not None:
+        os.makedirs(CHECKPOINT_DIR, exist_ok = True)
+        checkpoint_file = _get_checkpoint_file(fingerprint)
+        generation = load_checkpoint(est, checkpoint_file) if RESUME else 0
+        if generation > 0 and est.generations is not None:
+            # Only run the remaining generations
+            est.generations = max(est.generations - generation, 1)
+        add_checkpoints(est, checkpoint_file, generation)
+
+    with span("train"), executor.joblib_backend():
+        est.fit(X, y)
+    if CHECKPOINT_DIR is not None:
+        save_checkpoint(est, checkpoint_file, est._completed_generations)
         
     if USE_MLFLOW:
         config_file, pipeline_file = save_results(est, tmp_dir.name)
-        mlflow.log_artifact(config_file)
-        mlflow.log_artifact(pipeline_file)
+        upload_artifact(config_file)
+        upload_artifact(pipeline_file)
         end_mlflow(PROJECT_NAME, EXPERIMENT_NAME, tmp_dir, CONFIG.get("author"))
     else:
         save_results(est, save_dir)
 
-    if RUN_DISTRIBUTED:
-        close_dask(client)
+    stop_executor()
 
 if __name__ == "__main__":
     main()
@@ -12,7 +12,9 @@ sys.path.insert(0, os.path.abspath(base_dir))
 
 # Internal 
 from pipeline_lib.config import add_argument, get_config
+from pipeline_lib.distributed import start_executor, stop_executor
 from pipeline_lib.pipelines import end_mlflow, get_experiment_name, init_mlflow
+from pipeline_lib.profiling import span, trace_pipeline
 
 ##########################################################################################################
 ### Parameters
@@ -44,7 +46,7 @@ if BASE_DIR is None:
 RANDOM_STATE = CONFIG.get("random_seed") 
 
 # Distributed
-RUN_DISTRIBUTED = CONFIG.get("run_distributed")
+EXECUTOR = CONFIG.get("executor")
 
 # MLFlow
 USE_MLFLOW = CONFIG.get("use_mlflow")
@@ -53,18 +55,23 @@ USE_MLFLOW = CONFIG.get("use_mlflow")
 ### Pipeline
 ##########################################################################################################
 
+@trace_pipeline(PROJECT_NAME, CONFIG)
 def main() -> None:
+    start_executor(CONFIG)
+
     if USE_MLFLOW:
         import mlflow
         tmp_dir = init_mlflow(CONFIG)
 
     example = CONFIG.get('example')
-    with open("data/example.txt", "w") as f: 
+    with span("example"), open("data/example.txt", "w") as f: 
         f.write(f"Example: {example}")
     print(f"Created example.txt" )
 
     if USE_MLFLOW:
         end_mlflow(PROJECT_NAME, EXPERIMENT_NAME, tmp_dir, CONFIG.get("author"))
+
+    stop_executor()
         
 if __name__ == "__main__":
     main()